@@ -19,7 +19,13 @@
 # pylint: disable=bad-indentation
 
 import argparse
+import datetime
+import re
+import time
+from .. import constants
+from ..validator import batch
 from ..validator import contract
+from ..validator import reports
 
 
 class StorePortMapAction(argparse.Action):
@@ -46,6 +52,57 @@ class StorePortMapAction(argparse.Action):
         setattr(namespace, self.dest, result)
 
 
+# Units of relative times, in seconds.
+_TIME_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+# Formats of absolute times, in local time.
+_TIME_FORMATS = ['%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d %H:%M',
+                 '%Y-%m-%d', '%H:%M:%S', '%H:%M']
+
+
+def time_arg(value):
+    """Parse a point in time, for argparse.
+
+    Args:
+        value: (basestring) Either a duration before now, such as "90s",
+            "15m", "2h" or "1d", or a local date and time, such as
+            "2015-10-10 12:00:00". A time without a date is taken to be
+            today.
+
+    Returns:
+        (float) The time in seconds since the epoch.
+
+    Raises:
+        argparse.ArgumentTypeError: If the value can't be parsed.
+    """
+    value = value.strip()
+    match = re.match(r'^(\d+(?:\.\d+)?)([smhd])$', value)
+    if match:
+        return time.time() - float(match.group(1)) * _TIME_UNITS[
+            match.group(2)]
+    for fmt in _TIME_FORMATS:
+        try:
+            parsed = datetime.datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+        if '%Y' not in fmt:
+            parsed = datetime.datetime.combine(datetime.date.today(),
+                                               parsed.time())
+        return time.mktime(parsed.timetuple())
+    raise argparse.ArgumentTypeError(
+        'Invalid time: {0}. Use a duration such as 15m, or a local time '
+        'such as "2015-10-10 12:00".'.format(value))
+
+
+def regex_arg(value):
+    """Compile a regular expression, for argparse."""
+    try:
+        return re.compile(value)
+    except re.error as err:
+        raise argparse.ArgumentTypeError(
+            'Invalid regular expression {0!r}: {1}'.format(value, err))
+
+
 def make_appstart_parser():
     """Make an argument parser to take in command line arguments.
 
@@ -61,6 +118,15 @@ def make_appstart_parser():
     run_parser = subparsers.add_parser('run',
                                        help='Run a Managed VM application')
     add_appstart_args(run_parser)
+    run_parser.add_argument('--watch',
+                            action='store_true',
+                            help='Watch the application directory, and '
+                            'apply changes to the running sandbox. Files that '
+                            "the application's Dockerfile only copies are "
+                            'copied into the running container, and the '
+                            'application is restarted in place. Other changes '
+                            '(such as to the Dockerfile or app.yaml) rebuild '
+                            'the sandbox.')
 
     init_parser = subparsers.add_parser('init',
                                         help='Initialize the Docker '
@@ -73,6 +139,24 @@ def make_appstart_parser():
     validate_parser.set_defaults(parser_type='validate')
     add_validate_args(validate_parser)
     add_appstart_args(validate_parser)
+
+    batch_parser = subparsers.add_parser('batch',
+                                         help='Validate several sandboxes '
+                                         'at the same time')
+    add_batch_args(batch_parser)
+
+    pool_parser = subparsers.add_parser('pool',
+                                        help='List or remove the containers '
+                                        'kept warm by "appstart run '
+                                        '--keep_warm"')
+    pool_parser.add_argument('--clear',
+                             action='store_true',
+                             help='Remove the warm containers.')
+
+    logs_parser = subparsers.add_parser('logs',
+                                        help='Search the stored output of '
+                                        'sandbox containers')
+    add_logs_args(logs_parser)
     return parser
 
 
@@ -106,6 +190,117 @@ def add_validate_args(parser):
                         help='List the clauses available to the validator.')
     parser.set_defaults(list_clauses=False)
 
+    parser.add_argument('--parallel',
+                        type=int,
+                        default=1,
+                        help='The maximum number of clauses to evaluate at '
+                        'the same time.')
+
+    parser.add_argument('--report',
+                        default=None,
+                        dest='report_file',
+                        help='A file to write a machine-readable report of '
+                        'the validation results to.')
+
+    parser.add_argument('--report_format',
+                        default='json',
+                        choices=sorted(reports.REPORT_FORMATS.keys()),
+                        help='The format of the report written by --report.')
+    parser.add_argument('--soak_duration',
+                        type=float,
+                        default=0,
+                        help='How long to probe the health check endpoint '
+                        'for, in seconds, once the application has started. '
+                        'The health check stability clause is skipped if '
+                        'this is 0.')
+
+
+def add_batch_args(parser):
+    """Adds command line arguments for batch validation.
+
+    Args:
+       parser: the argparse.ArgumentParser to add the args to.
+    """
+    parser.add_argument('batch_file',
+                        help='A YAML file that lists the sandboxes to '
+                        'validate. See README.md for its format.')
+    parser.add_argument('--jobs',
+                        type=int,
+                        default=batch.DEFAULT_JOBS,
+                        help='The maximum number of sandboxes to validate '
+                        'at the same time.')
+    parser.add_argument('--output_dir',
+                        default=None,
+                        help='The directory to store the logs, reports and '
+                        'container output of each sandbox in. Defaults to a '
+                        'timestamped directory under {0}.'.format(
+                            constants.BATCH_DIR))
+    parser.add_argument('--threshold',
+                        default='WARNING',
+                        choices=[name for _, name in
+                                 contract.LEVEL_NAMES_TO_NUMBERS.iteritems()],
+                        help='The threshold at which validation should fail.')
+    parser.add_argument('--tags',
+                        nargs='*',
+                        help='Tag names of the tests to run')
+    parser.add_argument('--verbose',
+                        action='store_true',
+                        dest='verbose',
+                        help='Whether to write debug messages to the log of '
+                        'each sandbox.')
+    parser.set_defaults(verbose=False)
+    parser.add_argument('--parallel',
+                        type=int,
+                        default=1,
+                        help='The maximum number of clauses to evaluate at '
+                        'the same time, within each sandbox.')
+    parser.add_argument('--report',
+                        default=None,
+                        dest='report_file',
+                        help='A file to write the merged machine-readable '
+                        'report of all sandboxes to.')
+    parser.add_argument('--report_format',
+                        default='json',
+                        choices=sorted(reports.REPORT_FORMATS.keys()),
+                        help='The format of the report written by --report.')
+    parser.add_argument('--soak_duration',
+                        type=float,
+                        default=0,
+                        help='How long to probe the health check endpoint '
+                        'for, in seconds, once the application has started. '
+                        'The health check stability clause is skipped if '
+                        'this is 0.')
+
+
+def add_logs_args(parser):
+    parser.add_argument('output_path',
+                        nargs='?',
+                        default=None,
+                        help='The directory that a sandbox stored its '
+                        "containers' output in (see --output_path of "
+                        "'appstart run'). Defaults to that of the most "
+                        'recent sandbox.')
+    parser.add_argument('--container',
+                        action='append',
+                        dest='containers',
+                        help='Only show the output of this container, such '
+                        'as "app" or "devappserver". Can be repeated. '
+                        'Defaults to all containers.')
+    parser.add_argument('--since',
+                        type=time_arg,
+                        help='Only show output from this time on. Either a '
+                        'duration before now, such as 15m or 2h, or a local '
+                        'time such as "2015-10-10 12:00".')
+    parser.add_argument('--until',
+                        type=time_arg,
+                        help='Only show output up to this time, in the same '
+                        'format as --since.')
+    parser.add_argument('--grep',
+                        type=regex_arg,
+                        dest='pattern',
+                        help='Only show lines that match this regular '
+                        'expression.')
+
 
 def add_init_args(parser):
     parser.add_argument('--use_cache',
@@ -127,7 +322,8 @@ def add_appstart_args(parser):
                         type=int,
                         help='The port on the Docker host machine where '
                         'your application should be reached. Defaults to '
-                        '8080.')
+                        '8080. With 0, Docker picks a free port, as it does '
+                        'for the other ports.')
     parser.add_argument('--admin_port',
                         default='8000',
                         type=int,
@@ -198,6 +394,21 @@ def add_appstart_args(parser):
                         help='How many seconds to wait for the application '
                         'to start listening on port 8080. Defaults to 30 '
                         'seconds.')
+    parser.add_argument('--output_path',
+                        default=None,
+                        help='The directory on this machine where the '
+                        'output of the containers should be stored, to be '
+                        "searched with 'appstart logs'. Output is stored in "
+                        'compressed segments, and only the most recent ones '
+                        'are kept. Defaults to a timestamped directory '
+                        'inside /tmp/log/app_engine/container_output.')
+    parser.add_argument('--stats_interval',
+                        type=float,
+                        default=5,
+                        help='How often to sample the CPU, memory, network '
+                        'and disk usage of the containers, in seconds. A '
+                        'summary is printed when the containers are removed. '
+                        'Use 0 to turn sampling off. Defaults to 5 seconds.')
     parser.add_argument('config_files',
                         nargs='+',
                         default=None,
@@ -228,6 +439,17 @@ def add_appstart_args(parser):
                         'version.')
     parser.set_defaults(force_version=False)
 
+    parser.add_argument('--keep_warm',
+                        action='store_true',
+                        dest='keep_warm',
+                        help='Keep the devappserver and pinger containers '
+                        'running after Appstart exits, and reuse them the '
+                        'next time Appstart runs with the same devappserver '
+                        'configuration, so that only the application '
+                        'container has to start. Use "appstart pool --clear" '
+                        'to remove them.')
+    parser.set_defaults(keep_warm=False)
+
     parser.add_argument('--clear_datastore',
                         action='store_true',
                         dest='clear_datastore',
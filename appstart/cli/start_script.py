@@ -21,6 +21,7 @@ containers.
 # This file conforms to the external style guide
 # pylint: disable=bad-indentation, g-bad-import-order
 
+import errno
 import logging
 import os
 import sys
@@ -32,6 +33,8 @@ from .. import devappserver_init
 from .. import pinger
 from .. import utils
 from ..sandbox import container_sandbox
+from ..sandbox import log_store
+from ..validator import batch
 from ..validator import contract
 from ..validator import runtime_contract
 
@@ -65,12 +68,15 @@ def main():
 
     # In response to 'appstart run', create a container sandbox and run it.
     elif parser_type == 'run':
+        watch = args.pop('watch')
         try:
             with warnings.catch_warnings():
                 # Suppress the InsecurePlatformWarning generated by urllib3
                 # see: http://stackoverflow.com/questions/29134512/
                 warnings.simplefilter('ignore')
-                with container_sandbox.ContainerSandbox(**args):
+                with container_sandbox.ContainerSandbox(**args) as sandbox:
+                    if watch:
+                        sandbox.watch()
                     while True:
                         # Sleeping like this is hacky, but it works. Note
                         # that signal.pause is not compatible with Windows...
@@ -91,6 +97,10 @@ def main():
         tags = args.pop('tags')
         verbose = args.pop('verbose')
         list_clauses = args.pop('list_clauses')
+        parallel = args.pop('parallel')
+        report_file = args.pop('report_file')
+        report_format = args.pop('report_format')
+        soak_duration = args.pop('soak_duration')
         success = False
         utils.get_logger().setLevel(logging.INFO)
         try:
@@ -100,7 +110,11 @@ def main():
                 if list_clauses:
                     validator.list_clauses()
                     sys.exit(0)
-                success = validator.validate(tags, threshold, logfile, verbose)
+                success = validator.validate(tags, threshold, logfile, verbose,
+                                             parallel=parallel,
+                                             report_file=report_file,
+                                             report_format=report_format,
+                                             soak_duration=soak_duration)
         except KeyboardInterrupt:
             utils.get_logger().info('Exiting')
         except utils.AppstartAbort as err:
@@ -110,6 +124,71 @@ def main():
             sys.exit(0)
         sys.exit('Validation failed')
 
+    # In response to 'appstart batch', validate several sandboxes at once.
+    elif parser_type == 'batch':
+        output_dir = args['output_dir'] or os.path.join(
+            constants.BATCH_DIR, container_sandbox.make_unique_timestamp())
+        success = False
+        utils.get_logger().setLevel(logging.INFO)
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore')
+                validator = batch.BatchValidator(
+                    runtime_contract,
+                    batch.load_batch_file(args['batch_file']),
+                    output_dir,
+                    jobs=args['jobs'])
+                success = validator.validate(
+                    args['tags'], args['threshold'],
+                    verbose=args['verbose'],
+                    parallel=args['parallel'],
+                    report_file=args['report_file'],
+                    report_format=args['report_format'],
+                    soak_duration=args['soak_duration'])
+        except KeyboardInterrupt:
+            utils.get_logger().info('Exiting')
+        except utils.AppstartAbort as err:
+            if err.message:
+                utils.get_logger().warning(err.message)
+        if success:
+            sys.exit(0)
+        sys.exit('Validation failed')
+
+    # In response to 'appstart pool', list or remove warm containers.
+    elif parser_type == 'pool':
+        try:
+            dclient = utils.get_docker_client()
+            if args['clear']:
+                container_sandbox.remove_warm_containers(dclient)
+            else:
+                for name, _ in container_sandbox.find_warm_containers(dclient):
+                    print name
+        except utils.AppstartAbort as err:
+            if err.message:
+                utils.get_logger().warning(str(err.message))
+            sys.exit(1)
+
+    # In response to 'appstart logs', search stored container output.
+    elif parser_type == 'logs':
+        output_path = (args['output_path'] or
+                       log_store.find_latest(constants.OUTPUT_DIR))
+        if not output_path or not os.path.isdir(output_path):
+            sys.exit('No stored container output found in {0}'.format(
+                output_path or constants.OUTPUT_DIR))
+        try:
+            for line in log_store.search(output_path,
+                                         containers=args['containers'],
+                                         since=args['since'],
+                                         until=args['until'],
+                                         pattern=args['pattern']):
+                print log_store.format_line(line)
+        except KeyboardInterrupt:
+            pass
+        except IOError as err:
+            # The output was piped to a command that exited, like head.
+            if err.errno != errno.EPIPE:
+                raise
+
     else:
         # This should not be reached
         sys.exit(1)
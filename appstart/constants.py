@@ -19,3 +19,11 @@ DEVAPPSERVER_IMAGE = 'appstart_devappserver_base'
 
 # Pinger image name
 PINGER_IMAGE = 'appstart_pinger'
+
+# Directory under which the output of sandbox containers is stored, in a
+# timestamped directory per sandbox
+OUTPUT_DIR = '/tmp/log/app_engine/container_output'
+
+# Directory under which 'appstart batch' stores its results, in a timestamped
+# directory per run
+BATCH_DIR = '/tmp/log/app_engine/batch'
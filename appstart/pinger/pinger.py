@@ -36,43 +36,104 @@ The problem with this approach is that the request may actually cause the
 container to change state in an unpredictable way.
 
 To actually run the pinger, a container is created and put on the same network
-stack as the application container. It's then possible to run the pinger via
-docker exec and see its exit status. The actual running of pinger.py is done in
+stack as the application container. The pinger can then be used in two ways:
+
+1) As a one-shot command, run via docker exec. The exit status says whether
+the application is listening on the port given on the command line.
+
+2) As a resident agent (with the --agent flag), which is how the pinger image
+runs it by default. The agent reads probe requests from stdin, one JSON object
+per line, e.g. {"host": "0.0.0.0", "ports": [8080, 8081]}, and answers each
+with a single line of JSON on stdout, e.g. {"results": {"8080": true,
+"8081": false}}. Appstart attaches to the container once and reuses the
+connection, so probes don't pay for a docker exec and an interpreter start.
+
+The actual running of pinger.py is done in
 appstart.sandbox.container.PingerContainer.
 """
 
 import httplib
+import json
 import logging
 import socket
 import sys
+import time
 
+# Host and port that are pinged by default.
+DEFAULT_HOST = '0.0.0.0'
+DEFAULT_PORT = 8080
 
-def ping():
-    """Check if container is listening on the specified port."""
-    try:
-        host = sys.argv[1]
-        port = int(sys.argv[2])
-    except (IndexError, ValueError):
-        host = '0.0.0.0'
-        port = 8080
+# Seconds to wait for a connection to be established in agent mode.
+AGENT_CONNECT_TIMEOUT = 1
+
+
+def probe(host, port, timeout=None):
+    """Check if something is listening on host:port.
+
+    Args:
+        host: (basestring) The host to connect to.
+        port: (int) The port to connect to.
+        timeout: (float or None) Seconds to wait for the connection.
 
+    Returns:
+        (bool) Whether or not a connection could be established.
+    """
     con = None
-    success = True
     try:
-        con = httplib.HTTPConnection(host, port)
+        con = httplib.HTTPConnection(host, port, timeout=timeout)
         con.connect()
     except (socket.error, httplib.HTTPException):
-        success = False
+        return False
     finally:
         if con:
             con.close()
-    if success:
+    return True
+
+
+def ping():
+    """Check if container is listening on the specified port."""
+    try:
+        host = sys.argv[1]
+        port = int(sys.argv[2])
+    except (IndexError, ValueError):
+        host = DEFAULT_HOST
+        port = DEFAULT_PORT
+
+    if probe(host, port):
         logging.info('success')
         sys.exit(0)
     logging.info('failure')
     sys.exit(1)
 
 
+def serve():
+    """Answer probe requests from stdin until stdin is closed."""
+    while True:
+        line = sys.stdin.readline()
+        if not line:
+            break
+        try:
+            request = json.loads(line)
+            host = request.get('host', DEFAULT_HOST)
+            ports = [int(port) for port in request['ports']]
+        except (AttributeError, KeyError, TypeError, ValueError):
+            response = {'error': 'Malformed request: {0!r}'.format(line)}
+        else:
+            response = {'results': {
+                str(port): probe(host, port, AGENT_CONNECT_TIMEOUT)
+                for port in ports}}
+        sys.stdout.write(json.dumps(response) + '\n')
+        sys.stdout.flush()
+
+    # Keep the container alive, so that the pinger can still be used
+    # through docker exec.
+    while True:
+        time.sleep(1000)
+
+
 if __name__ == '__main__':
     logging.basicConfig(level=logging.INFO)
-    ping()
+    if sys.argv[1:] == ['--agent']:
+        serve()
+    else:
+        ping()
@@ -16,6 +16,15 @@ import yaml
 from .. import utils
 
 
+# Options of the production health checker, and their defaults. Intervals
+# and timeouts are in seconds; thresholds count consecutive checks.
+HEALTH_CHECK_DEFAULTS = {'check_interval_sec': 5,
+                         'timeout_sec': 4,
+                         'unhealthy_threshold': 2,
+                         'healthy_threshold': 2,
+                         'restart_threshold': 60}
+
+
 class ApplicationConfiguration(object):
     """Class to parse an xml or yaml config file.
 
@@ -72,6 +81,7 @@ class ApplicationConfiguration(object):
 
         # Assume that health checks are enabled.
         self.health_checks_enabled = True
+        self.health_check_options = dict(HEALTH_CHECK_DEFAULTS)
         health = root.getElementsByTagName('health-check')
         if health:
             checks = health[0].getElementsByTagName('enable-health-check')
@@ -79,6 +89,12 @@ class ApplicationConfiguration(object):
                 value = checks[0].firstChild
                 if value and value.nodeValue != 'true':
                     self.health_checks_enabled = False
+            for option in HEALTH_CHECK_DEFAULTS:
+                elements = health[0].getElementsByTagName(
+                    option.replace('_', '-'))
+                if elements and elements[0].firstChild:
+                    self.health_check_options[option] = self._parse_option(
+                        option, elements[0].firstChild.nodeValue, xml_config)
 
     def _init_from_yaml_config(self, yaml_config):
         """Initialize from a yaml file.
@@ -103,6 +119,38 @@ class ApplicationConfiguration(object):
             self.health_checks_enabled = False
         else:
             self.health_checks_enabled = True
+        self.health_check_options = dict(HEALTH_CHECK_DEFAULTS)
+        if isinstance(hc_options, dict):
+            for option in HEALTH_CHECK_DEFAULTS:
+                if option in hc_options:
+                    self.health_check_options[option] = self._parse_option(
+                        option, hc_options[option], yaml_config)
+
+    @staticmethod
+    def _parse_option(option, value, config_file):
+        """Parse a health check option.
+
+        Args:
+            option: (basestring) The name of the option.
+            value: (object) The value from the configuration file.
+            config_file: (basestring) The path to the configuration file.
+
+        Returns:
+            (int) The value of the option.
+
+        Raises:
+            utils.AppstartAbort: If the value isn't a positive integer.
+        """
+        try:
+            parsed = int(str(value).strip())
+        except ValueError:
+            parsed = None
+        if parsed is None or parsed <= 0:
+            raise utils.AppstartAbort(
+                'Health check option {0} must be a positive integer in {1}, '
+                'not {2!r}'.format(option, os.path.basename(config_file),
+                                   value))
+        return parsed
 
     @staticmethod
     def _verify_structure(full_config_file_path):
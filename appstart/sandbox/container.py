@@ -17,11 +17,16 @@
 # This file conforms to the external style guide.
 # pylint: disable=bad-indentation, g-bad-import-order
 
+import json
 import requests
+import shutil
 import signal
-import StringIO
+import socket
+import struct
 import tarfile
+import tempfile
 import threading
+import time
 import urlparse
 
 import docker
@@ -31,6 +36,32 @@ from .. import utils
 
 _EXITING = False
 
+# The thread that imported this module, which is the main thread.
+_MAIN_THREAD = threading.current_thread()
+
+# Archives extracted from containers are kept in memory up to this many
+# bytes, and spilled to a temporary file on disk beyond that.
+TAR_SPOOL_MAX_SIZE = 16 * 1024 * 1024
+
+# Argument that makes pinger.py run as a resident probe agent.
+AGENT_FLAG = '--agent'
+
+# Seconds to wait for the pinger agent to answer a probe.
+AGENT_TIMEOUT = 10
+
+# Size of the header of each frame in docker's multiplexed output.
+STREAM_HEADER_SIZE = 8
+
+# Seconds that each request for docker events covers. The event watcher
+# stops at most this long after being asked to.
+EVENT_WINDOW = 1
+
+# Stream type of stdout frames in docker's multiplexed output.
+STDOUT_STREAM = 1
+
+# Seconds to let a container's process stop before it's killed on restart.
+RESTART_TIMEOUT = 5
+
 
 def sig_handler(unused_signo, unused_frame):
     global _EXITING
@@ -70,7 +101,13 @@ class Container(object):
         """
         # Anticipate the possibility of SIGINT during construction.
         # Note that graceful behavior is guaranteed only for SIGINT.
-        prev = signal.signal(signal.SIGINT, sig_handler)
+        # Signal handlers can only be installed from the main thread. When
+        # containers are created from other threads, SIGINT is delivered to
+        # the main thread, which waits for this call to finish before
+        # cleaning up (see scheduler.PhaseScheduler).
+        in_main_thread = threading.current_thread() is _MAIN_THREAD
+        if in_main_thread:
+            prev = signal.signal(signal.SIGINT, sig_handler)
 
         # Protecting create_container in this manner ensures that there
         # is GUARANTEED to be a container_id after this call. Then,
@@ -86,7 +123,8 @@ class Container(object):
                                       '{0}'.format(err))
 
         # Restore previous handler
-        signal.signal(signal.SIGINT, prev)
+        if in_main_thread:
+            signal.signal(signal.SIGINT, prev)
 
         # If _EXITING is True, then the signal handler was called.
         if _EXITING:
@@ -94,6 +132,16 @@ class Container(object):
 
         self.name = docker_kwargs.get('name')
 
+    def adopt(self, cont_id, name):
+        """Manage an existing container, rather than creating one.
+
+        Args:
+            cont_id: (basestring) The id of the container.
+            name: (basestring) The name of the container.
+        """
+        self._container_id = cont_id
+        self.name = name
+
     def kill(self):
         """Kill the underlying container."""
 
@@ -102,13 +150,19 @@ class Container(object):
         if self._container_id:
             self._dclient.kill(self._container_id)
 
-    def remove(self):
-        """Remove the underlying container."""
+    def remove(self, force=False):
+        """Remove the underlying container.
+
+        Args:
+            force: (bool) Whether or not to kill the container first if it
+                is still running. This takes a single call to the docker
+                daemon, rather than one to kill and one to remove.
+        """
 
         # Containers are occasionally removed twice in ContainerSandbox.
         # Stay silent about this scenario.
         if self._container_id:
-            self._dclient.remove_container(self._container_id)
+            self._dclient.remove_container(self._container_id, force=force)
             self._container_id = None
 
     def start(self, **start_kwargs):
@@ -124,55 +178,44 @@ class Container(object):
         except docker.errors.APIError as err:
             raise utils.AppstartAbort('Docker error: {0}'.format(err))
 
-    def stream_logs(self, stream=True):
-        """Print the container's stdout/stderr.
+    def restart(self, timeout=RESTART_TIMEOUT):
+        """Restart the container's process, keeping its file system.
 
         Args:
-            stream: (bool) Whether or not to continue streaming stdout/stderr.
-                If False, only the current stdout/stderr buffer will be
-                collected from the container. If True, stdout/stderr collection
-                will continue as a subprocess.
-        """
-
-        def log_streamer():
-            # This loop tackles the problem of request timeouts. When the
-            # docker client is created, it establishes a timeout. The
-            # default is 60 seconds. If docker.Client.logs hangs for
-            # more than 60 seconds, this is considered a "timeout".
-            name = (self._dclient.inspect_container(self._container_id)
-                    .get('Name'))
-            while True:
-                try:
-                    # If a timeout happens, an error will be raise from inside
-                    # the log generator.
-                    logs = self._dclient.logs(container=self._container_id,
-                                              stream=True)
-                    for line in logs:
-                        utils.get_logger().debug('{0}: {1}'.format(
-                            name, line.strip()))
-
-                # In the case of a timeout, try to start collecting logs again.
-                except requests.exceptions.ReadTimeout:
-                    pass
-
-                # An APIError/NullResource occurs if the container doesn't
-                # exist anymore. This indicates that we're shutting down, so
-                # we can break and terminate the thread.  (The older versions
-                # produce an APIError).
-                except (docker.errors.APIError, docker.errors.NullResource):
-                    break
+            timeout: (int) How many seconds to wait for the process to stop
+                before killing it.
+        """
+        try:
+            self._dclient.restart(self._container_id, timeout=timeout)
+            utils.get_logger().info('Restarting container: {0}'.format(
+                self.name))
+        except docker.errors.APIError as err:
+            raise utils.AppstartAbort('Docker error: {0}'.format(err))
 
-        if stream:
-            # If we want to stream the log output of the container,
-            # start another thread. There's no need to join this thread,
-            # because it's supposed to live until the container is removed.
-            thread = threading.Thread(target=log_streamer)
-            thread.start()
-        else:
-            logs = self._dclient.logs(container=self._container_id,
-                                      stream=False)
-            for line in logs.split('\n'):
-                utils.get_logger().debug(line.strip())
+    def put_archive(self, path, data):
+        """Extract a tar archive into the container.
+
+        Args:
+            path: (basestring) The directory (within the container) to
+                extract the archive in.
+            data: (file or basestring) The tar archive.
+        """
+        dclient = utils.get_docker_client(version=utils.ARCHIVE_API_VERSION)
+        try:
+            dclient.put_archive(self._container_id, path, data)
+        except docker.errors.APIError as err:
+            raise utils.AppstartAbort('Could not copy files into {0}: '
+                                      '{1}'.format(self.name, err))
+
+    def print_logs(self):
+        """Print the container's stdout/stderr, as it is now.
+
+        To follow the logs of running containers, see log_stream.py.
+        """
+        logs = self._dclient.logs(container=self._container_id,
+                                  stream=False)
+        for line in logs.split('\n'):
+            utils.get_logger().debug(line.strip())
 
     def running(self):
         """Check if the container is still running.
@@ -188,6 +231,21 @@ class Container(object):
     def get_id(self):
         return self._container_id
 
+    def host_ports(self):
+        """Find the host ports that the container's tcp ports are published on.
+
+        Returns:
+            ({int: int}) The host port of each published container port.
+        """
+        info = self._dclient.inspect_container(self._container_id)
+        ports = {}
+        network = info.get('NetworkSettings') or {}
+        for spec, bindings in (network.get('Ports') or {}).iteritems():
+            port, _, protocol = spec.partition('/')
+            if protocol == 'tcp' and bindings:
+                ports[int(port)] = int(bindings[0]['HostPort'])
+        return ports
+
     def execute(self, cmd, **create_kwargs):
         """Execute the command specified by cmd inside the container.
 
@@ -205,9 +263,19 @@ class Container(object):
         self._dclient.exec_start(exec_id)
         return self._dclient.exec_inspect(exec_id)
 
+    def _copy(self, path):
+        """Return a stream of the tar archive of path within the container."""
+        try:
+            return self._dclient.copy(self._container_id, path)
+        except docker.errors.APIError:
+            raise IOError('File could not be found at {0}.'.format(path))
+
     def extract_tar(self, path):
         """Extract the file/directory specified by path as a TarWrapper object.
 
+        The archive is kept in memory if it's small, and spilled to a
+        temporary file on disk otherwise (see TAR_SPOOL_MAX_SIZE).
+
         Args:
             path: (basestring) The path (within the container)
                 to the file/directory to extract.
@@ -218,26 +286,226 @@ class Container(object):
         Returns:
             (utils.TarWrapper) The tar archive.
         """
+        reply = self._copy(path)
+        fileobj = tempfile.SpooledTemporaryFile(max_size=TAR_SPOOL_MAX_SIZE)
         try:
-            reply = self._dclient.copy(self._container_id, path)
-        except docker.errors.APIError:
-            raise IOError('File could not be found at {0}.'.format(path))
-
-        fileobj = StringIO.StringIO(reply.read())
+            shutil.copyfileobj(reply, fileobj, utils.CHUNK_SIZE)
+        finally:
+            reply.close()
+        fileobj.seek(0)
 
         # Wrap the TarFile for more user-friendliness
         return utils.TarWrapper(tarfile.open(fileobj=fileobj))
 
 
+class ContainerEventWatcher(object):
+    """Watch the docker event stream for containers that stop running."""
+
+    # Events which indicate that a container is no longer running.
+    FATAL_EVENTS = frozenset(['die', 'oom'])
+
+    def __init__(self, dclient, containers, since=None, until=None):
+        """Initializer for ContainerEventWatcher.
+
+        Args:
+            dclient: (docker.Client) The docker client to get events from.
+            containers: ([Container, ...]) The containers to watch.
+            since: (int or None) Timestamp of the earliest event to consider.
+            until: (int or None) Timestamp at which to stop watching.
+        """
+        self._dclient = dclient
+        self._containers = {cont.get_id(): cont for cont in containers}
+        self._since = since
+        self._until = until
+        self._stopped = threading.Event()
+        self._closed = threading.Event()
+
+        # The first container that stopped running, if any.
+        self.dead_container = None
+
+        # Whether or not the event stream could be used.
+        self.available = True
+
+    def start(self):
+        """Start watching events in a background thread."""
+        thread = threading.Thread(target=self._watch)
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        """Stop watching events, within EVENT_WINDOW seconds."""
+        self._closed.set()
+
+    def wait(self, timeout):
+        """Sleep for up to timeout seconds, or until a container stops.
+
+        Args:
+            timeout: (float) The maximum number of seconds to sleep.
+        """
+        self._stopped.wait(max(timeout, 0))
+
+    def _watch(self):
+        # The daemon only closes an event stream at its until time, so
+        # events are requested EVENT_WINDOW seconds at a time, to be able
+        # to stop in between.
+        since = self._since
+        try:
+            while not self._closed.is_set():
+                window_end = int(time.time()) + EVENT_WINDOW
+                if self._until is not None:
+                    window_end = min(window_end, self._until)
+                events = self._dclient.events(
+                    since=since,
+                    until=window_end,
+                    filters={'container': self._containers.keys()},
+                    decode=True)
+                for event in events:
+                    cont = self._containers.get(event.get('id'))
+                    if cont and event.get('status') in self.FATAL_EVENTS:
+                        self.dead_container = cont
+                        self._stopped.set()
+                        return
+                if self._until is not None and window_end >= self._until:
+                    break
+
+                # Timestamps are whole seconds, so the windows overlap by
+                # one second to not miss any events.
+                since = window_end - 1
+                self._closed.wait(max(window_end - time.time(), 0))
+            if self._closed.is_set():
+                return
+        except Exception as err:  # pylint: disable=broad-except
+            utils.get_logger().debug('Could not watch docker events: '
+                                     '{0}'.format(err))
+
+        # The stream ended (or never started) without any container dying,
+        # so there is nothing more to learn from it.
+        self.available = False
+
+
 class PingerContainer(Container):
     """Give devappserver the ability to ping the application.
 
-    Relies on container having a pinger.py in the root directory.
+    Relies on container having a pinger.py in the root directory. If the
+    pinger image runs pinger.py as a resident agent (see appstart.pinger),
+    probes are sent to the agent over a single attached connection.
+    Otherwise, every probe runs pinger.py through docker exec.
     """
 
+    def __init__(self, *args, **kwargs):
+        super(PingerContainer, self).__init__(*args, **kwargs)
+        self._agent = None
+        self._agent_buffer = ''
+        self._agent_lock = threading.Lock()
+
+    def create(self, **docker_kwargs):
+        """Create the pinger container, keeping its stdin open for the agent.
+
+        Args:
+            **docker_kwargs: (dict) Keyword arguments that can be supplied
+                to docker.Client.create_container.
+        """
+        docker_kwargs.setdefault('stdin_open', True)
+        super(PingerContainer, self).create(**docker_kwargs)
+
+    def start_agent(self):
+        """Attach to the probe agent, if the pinger image runs one.
+
+        Returns:
+            (bool) Whether or not the agent can be used.
+        """
+        try:
+            config = self._dclient.inspect_container(
+                self._container_id).get('Config', {})
+            if AGENT_FLAG not in (config.get('Entrypoint') or []):
+                return False
+            self._agent = self._dclient.attach_socket(
+                self._container_id,
+                params={'stdin': 1, 'stdout': 1, 'stream': 1})
+            self._agent.settimeout(AGENT_TIMEOUT)
+        except (docker.errors.APIError, requests.exceptions.RequestException,
+                socket.error) as err:
+            utils.get_logger().debug('Could not attach to pinger agent: '
+                                     '{0}'.format(err))
+            self._agent = None
+        return self._agent is not None
+
+    def probe(self, ports, host='0.0.0.0'):
+        """Check which ports are being listened on in the application.
+
+        Args:
+            ports: ([int, ...]) The ports (inside the application
+                container) to check.
+            host: (basestring) The host to connect to, from within the
+                application's network stack.
+
+        Returns:
+            ({int: bool, ...}) Whether or not each port is being listened on.
+        """
+        with self._agent_lock:
+            if self._agent:
+                try:
+                    return self._probe_with_agent(ports, host)
+                except (socket.error, ValueError, KeyError) as err:
+                    utils.get_logger().debug('Pinger agent failed, falling '
+                                             'back to docker exec: '
+                                             '{0}'.format(err))
+                    self._agent.close()
+                    self._agent = None
+
+        return {port: self.execute('python /pinger.py {0} {1}'.format(
+            host, port))['ExitCode'] == 0 for port in ports}
+
+    def _probe_with_agent(self, ports, host):
+        request = json.dumps({'host': host, 'ports': list(ports)})
+        self._agent.sendall(request + '\n')
+        response = json.loads(self._read_agent_line())
+        if 'error' in response:
+            raise ValueError(response['error'])
+        results = response['results']
+        return {port: bool(results[str(port)]) for port in ports}
+
+    def _read_agent_line(self):
+        """Read one line of the agent's stdout.
+
+        Without a tty, docker multiplexes stdout and stderr over the attached
+        connection. Each frame starts with an 8 byte header: the stream type
+        (1 for stdout, 2 for stderr), three zero bytes, and the big-endian
+        length of the payload.
+        """
+        while '\n' not in self._agent_buffer:
+            stream_type, length = struct.unpack(
+                '>BxxxL', self._read_from_agent(STREAM_HEADER_SIZE))
+            payload = self._read_from_agent(length)
+            if stream_type == STDOUT_STREAM:
+                self._agent_buffer += payload
+        line, self._agent_buffer = self._agent_buffer.split('\n', 1)
+        return line
+
+    def _read_from_agent(self, size):
+        data = ''
+        while len(data) < size:
+            chunk = self._agent.recv(size - len(data))
+            if not chunk:
+                raise socket.error('Connection to pinger agent was closed.')
+            data += chunk
+        return data
+
+    def close_agent(self):
+        """Detach from the agent, leaving the container running."""
+        with self._agent_lock:
+            if self._agent:
+                self._agent.close()
+                self._agent = None
+
+    def remove(self, force=False):
+        """Detach from the agent and remove the container."""
+        self.close_agent()
+        super(PingerContainer, self).remove(force=force)
+
     def ping_application_container(self):
         """Return True iff the application is listening on port 8080."""
-        return self.execute('python /pinger.py')['ExitCode'] == 0
+        return self.probe([8080])[8080]
 
 
 class ApplicationContainer(Container):
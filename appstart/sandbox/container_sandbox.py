@@ -24,32 +24,130 @@ system tests in this manner.
 # This file conforms to the external style guide
 # pylint: disable=bad-indentation, g-bad-import-order
 
+import hashlib
 import io
+import json
 import os
+import posixpath
 import sys
+import threading
 import time
+import uuid
 import docker
 import configuration
 import container
+import file_watcher
+import hot_reload
+import log_store
+import log_stream
+import scheduler
+import stats
 from .. import utils
 from .. import constants
 from ..utils import get_logger
 
-# Maximum attempts to health check application container.
-MAX_ATTEMPTS = 30
+# Default number of seconds to wait for the application container to start.
+START_TIMEOUT = 30
+
+# Delay (in seconds) before the second attempt to ping the application. The
+# delay doubles after each attempt, up to MAX_PROBE_DELAY.
+INITIAL_PROBE_DELAY = 0.01
+MAX_PROBE_DELAY = 1.0
+
+# Maximum number of seconds to spend removing containers when the sandbox
+# stops. Containers that aren't gone by then are reported to the user.
+TEARDOWN_TIMEOUT = 10
 
 # Default port that the application is expected to listen on inside
 # the application container.
 DEFAULT_APPLICATION_PORT = 8080
 
+# Repository for devappserver images that contain the application's config
+# files. Images are tagged with a digest of their build context.
+DEVAPPSERVER_OVERLAY_REPO = 'devappserver_image'
+
+# Base url of docker clients that talk to a local unix socket.
+UNIX_SOCKET_URL = 'http+docker://'
+
+# Number of hex digits of the build context digest used in image tags.
+DIGEST_TAG_LENGTH = 16
+
+# Prefix of the names of containers that are kept warm between runs. See
+# ContainerSandbox.keep_warm.
+WARM_CONTAINER_PREFIX = 'appstart_warm_'
+
+# Config files that devappserver reads from the directories of the
+# application's config files, besides the config files themselves.
+EXTRA_CONFIG_FILES = ('queue.yaml', 'cron.yaml', 'dispatch.yaml',
+                      'index.yaml')
+
 # Time format for naming images/containers
 TIME_FMT = '%Y.%m.%d_%H.%M.%S'
 
+# Number of random hex digits after the timestamp in the names of images and
+# containers, so that sandboxes started in the same second don't collide.
+NAME_SUFFIX_LENGTH = 6
+
+# Host port that asks docker to pick any free port of the docker host.
+AUTO_PORT = 0
+
 # Java offset for the xml file's location, relative to the root
 # diretory of the WAR archive
 JAVA_OFFSET = 'WEB-INF/'
 
 
+def make_unique_timestamp():
+    """Make a timestamp to name images, containers and directories with.
+
+    Returns:
+        (basestring) The current time, followed by a random suffix that
+        tells apart sandboxes started in the same second.
+    """
+    return '{0}_{1}'.format(time.strftime(TIME_FMT),
+                            uuid.uuid4().hex[:NAME_SUFFIX_LENGTH])
+
+
+def find_warm_containers(dclient):
+    """Find the containers that are kept warm between sandboxes.
+
+    Args:
+        dclient: (docker.Client) The docker client.
+
+    Returns:
+        ([(basestring, basestring), ...]) The names and ids of the
+        containers, sorted by name.
+    """
+    found = []
+    for cont in dclient.containers(all=True):
+        for name in cont.get('Names') or []:
+            name = name.lstrip('/')
+            if name.startswith(WARM_CONTAINER_PREFIX):
+                found.append((name, cont['Id']))
+                break
+    return sorted(found)
+
+
+def remove_warm_containers(dclient):
+    """Remove the containers that are kept warm between sandboxes.
+
+    Args:
+        dclient: (docker.Client) The docker client.
+
+    Returns:
+        ([basestring, ...]) The names of the removed containers.
+    """
+    removed = []
+    for name, cont_id in find_warm_containers(dclient):
+        get_logger().info('Removing %s', name)
+        try:
+            dclient.remove_container(cont_id, force=True)
+            removed.append(name)
+        except docker.errors.APIError as err:
+            get_logger().warning('Failed to remove container %s (%s).',
+                                 name, err)
+    return removed
+
+
 class ContainerSandbox(object):
     """Sandbox to manage the user application & devappserver containers.
 
@@ -79,10 +177,13 @@ class ContainerSandbox(object):
                  run_api_server=True,
                  storage_path='/tmp/app_engine/storage',
                  nocache=False,
-                 timeout=MAX_ATTEMPTS,
+                 timeout=START_TIMEOUT,
                  force_version=False,
                  devbase_image=constants.DEVAPPSERVER_IMAGE,
-                 extra_ports=None):
+                 extra_ports=None,
+                 stats_interval=stats.DEFAULT_INTERVAL,
+                 output_path=None,
+                 keep_warm=False):
         """Get the sandbox ready to construct and run the containers.
 
         Args:
@@ -123,11 +224,17 @@ class ContainerSandbox(object):
                 will persist assuming their data has not been deleted.
             application_port: (int) The port on the docker host that should be
                 mapped to the application. The application will be
-                accessible through this port.
+                accessible through this port. If AUTO_PORT, docker picks a
+                free port, which is stored in self.port once the container
+                that publishes it has started. The same goes for the
+                other host ports.
             admin_port: (int) The port on the docker server host that
                 should be mapped to the admin server, which runs inside
                 the devappserver container. The admin panel will be
                 accessible through this port.
+            proxy_port: (int) The port on the docker host that should be
+                mapped to the devappserver's proxy in front of the
+                application.
             devbase_image: (basestring or None): If specified, the sandbox
                 will build the devappserver on the specified base_image
             clear_datastore: (bool) Whether or not to clear the datastore.
@@ -168,8 +275,22 @@ class ContainerSandbox(object):
             extra_ports: ({int: int, ...} or None) A mapping from application
                 docker container ports to host ports, allowing
                 additional application ports to be exposed.
+            stats_interval: (float) How often to sample the resource usage
+                of the containers, in seconds. If 0, resource usage isn't
+                sampled.
+            output_path: (basestring or None) The directory where the
+                output of the containers should be stored, so that it can
+                be searched with 'appstart logs'. Unlike log_path, this
+                directory is on this machine, and isn't visible to the
+                containers. If output_path is None, a timestamped directory
+                is made under constants.OUTPUT_DIR.
+            keep_warm: (bool) Whether or not to keep the devappserver and
+                pinger containers running when the sandbox stops, so that
+                the next sandbox with the same devappserver configuration
+                can reuse them, and only has to start the application
+                container. Ignored if run_api_server is False.
         """
-        self.cur_time = time.strftime(TIME_FMT)
+        self.cur_time = make_unique_timestamp()
         self.app_id = (application_id or None)
         self.internal_api_port = internal_api_port
         self.internal_proxy_port = internal_proxy_port
@@ -181,6 +302,8 @@ class ContainerSandbox(object):
             log_path or self.make_timestamped_name(
                 '/tmp/log/app_engine/app_logs',
                 self.cur_time))
+        self.output_path = (output_path or
+                            os.path.join(constants.OUTPUT_DIR, self.cur_time))
         self.image_name = image_name
         self.admin_port = admin_port
         self.proxy_port = proxy_port
@@ -188,12 +311,42 @@ class ContainerSandbox(object):
         self.devappserver_container = None
         self.app_container = None
         self.pinger_container = None
+        self.time_to_ready = None
         self.nocache = nocache
         self.run_devappserver = run_api_server
+        self.keep_warm = keep_warm and run_api_server
+
+        # (bool) Whether the devappserver and pinger containers were kept
+        # warm by an earlier sandbox.
+        self.reused_warm_containers = False
+
+        # (basestring or None) The name of the devappserver container that
+        # is kept warm, which the pinger container's name is based on.
+        self._warm_name = None
+        self._started_at = None
         self.timeout = timeout
         self.devbase_image = constants.DEVAPPSERVER_IMAGE
         self.extra_ports = extra_ports
 
+        # ({int: int}) The host port requested for each published port of
+        # the devappserver container. See host_port_bindings.
+        self._requested_ports = {
+            DEFAULT_APPLICATION_PORT: application_port,
+            internal_admin_port: admin_port,
+            internal_proxy_port: proxy_port,
+        }
+        self._requested_ports.update(extra_ports or {})
+        self.stats_interval = stats_interval
+
+        # (log_stream.LogMultiplexer or None) Follows the logs of the
+        # containers once they've started.
+        self.logs = None
+        self._log_consumer = None
+
+        # (stats.StatsCollector or None) Samples the resource usage of the
+        # containers once they've started. See stats.py.
+        self.stats = None
+
         if devbase_image:
             self.devbase_image = devbase_image
 
@@ -237,64 +390,144 @@ class ContainerSandbox(object):
         self.run_devappserver is False. If image_name isn't specified, an
         image is created for the application as well. Newly made containers
         are cleaned up, but newly made images are not.
-        """
 
+        Independent steps run concurrently: the devappserver and application
+        images are built at the same time, and the pinger container is
+        created while they build. Only true dependencies (such as the
+        application joining devappserver's network stack) are serialized.
+        """
+        self._started_at = time.time()
+        self.reused_warm_containers = False
+        phases = scheduler.PhaseScheduler()
         if self.run_devappserver:
-            # Devappserver must know APP_ID to properly interface with
-            # services like datastore, blobstore, etc. It also needs
-            # to know where to find the config file, which port to
-            # run the proxy on, and which port to run the api server on.
-            das_env = {'CLEAR_DATASTORE': self.clear_datastore,
-                       'PROXY_PORT': self.internal_proxy_port,
-                       'API_PORT': self.internal_api_port,
-                       'ADMIN_PORT': self.internal_admin_port,
-                       'CONFIG_FILE': ' '.join([os.path.join(self.das_offset, os.path.basename(path))
-                                                for path in self.conf_paths])}
-
-            if self.app_id:
-                das_env['APP_ID'] = self.app_id
-
-            devappserver_image = self.build_devappserver_image(
-                devbase_image=self.devbase_image
-            )
-            devappserver_container_name = (
-                self.make_timestamped_name('devappserver',
-                                           self.cur_time))
-
-            port_bindings = {
-                DEFAULT_APPLICATION_PORT: self.port,
-                self.internal_admin_port: self.admin_port,
-                self.internal_proxy_port: self.proxy_port,
+            phases.add_phase(
+                'devappserver_image',
+                lambda: self.build_devappserver_image(
+                    devbase_image=self.devbase_image))
+            phases.add_phase(
+                'devappserver_container',
+                lambda: self.start_devappserver_container(
+                    phases.results['devappserver_image']),
+                dependencies=['devappserver_image'])
+
+        # Build from the application directory iff image_name is not
+        # specified.
+        phases.add_phase('app_image',
+                         lambda: self.image_name or self.build_app_image())
+        phases.add_phase(
+            'app_container',
+            lambda: self.create_app_container(phases.results['app_image']),
+            dependencies=['app_image'])
+        phases.add_phase(
+            'app_start',
+            self.start_app_container,
+            dependencies=(['app_container', 'devappserver_container']
+                          if self.run_devappserver else ['app_container']))
+        # Warm pinger containers are named after, and share the network
+        # stack of, the devappserver container.
+        phases.add_phase('pinger_container', self.create_pinger_container,
+                         dependencies=(['devappserver_container']
+                                       if self.keep_warm else []))
+        phases.add_phase('pinger_start',
+                         self.start_pinger_container,
+                         dependencies=['pinger_container', 'app_start'])
+        try:
+            phases.run()
+        finally:
+            phases.log_timings()
+
+        self.wait_for_start()
+        self.start_stats_collector()
+        # call /_ah/start ?
+
+        self.start_log_stream()
+
+    def start_devappserver_container(self, devappserver_image):
+        """Create and start the devappserver container.
+
+        Args:
+            devappserver_image: (basestring) The devappserver image, as
+                returned by build_devappserver_image.
+        """
+        # Devappserver must know APP_ID to properly interface with
+        # services like datastore, blobstore, etc. It also needs
+        # to know where to find the config file, which port to
+        # run the proxy on, and which port to run the api server on.
+        das_env = {'CLEAR_DATASTORE': self.clear_datastore,
+                   'PROXY_PORT': self.internal_proxy_port,
+                   'API_PORT': self.internal_api_port,
+                   'ADMIN_PORT': self.internal_admin_port,
+                   'CONFIG_FILE': ' '.join([os.path.join(self.das_offset, os.path.basename(path))
+                                            for path in self.conf_paths])}
+
+        if self.app_id:
+            das_env['APP_ID'] = self.app_id
+
+        devappserver_container_name = (
+            self.make_timestamped_name('devappserver',
+                                       self.cur_time))
+
+        port_bindings = self.host_port_bindings(self._requested_ports)
+
+        self.devappserver_container = container.Container(self.dclient)
+        if self.keep_warm:
+            # Only a devappserver container with the very same
+            # configuration can be reused.
+            settings = dict(das_env, CLEAR_DATASTORE=None)
+            digest = hashlib.sha256(json.dumps(
+                [devappserver_image, settings, sorted(port_bindings.items()),
+                 self.storage_path], sort_keys=True)).hexdigest()
+            devappserver_container_name = self._warm_name = (
+                WARM_CONTAINER_PREFIX + 'devappserver_' +
+                digest[:DIGEST_TAG_LENGTH])
+
+            # A fresh devappserver is needed to clear the datastore.
+            if self.adopt_warm_container(self.devappserver_container,
+                                         devappserver_container_name,
+                                         reuse=not self.clear_datastore):
+                get_logger().info('Reusing warm container: %s',
+                                  devappserver_container_name)
+                self.reused_warm_containers = True
+                self.resolve_host_ports(self.devappserver_container)
+                return
+
+            # Warm containers of an earlier configuration would keep the
+            # host ports that the new devappserver needs.
+            self.remove_conflicting_warm_containers(
+                devappserver_container_name, port_bindings)
+
+        # The host_config specifies port bindings and volume bindings.
+        # /storage is bound to the storage_path. Internally, the
+        # devappserver writes all the db files to /storage. The mapping
+        # thus allows these files to appear on the host machine. As for
+        # port mappings, we only want to expose the application (via the
+        # proxy), and the admin panel.
+        devappserver_hconf = docker.utils.create_host_config(
+            port_bindings=port_bindings,
+            binds={
+                self.storage_path: {'bind': '/storage'},
             }
-            if self.extra_ports:
-                port_bindings.update(self.extra_ports)
-
-            # The host_config specifies port bindings and volume bindings.
-            # /storage is bound to the storage_path. Internally, the
-            # devappserver writes all the db files to /storage. The mapping
-            # thus allows these files to appear on the host machine. As for
-            # port mappings, we only want to expose the application (via the
-            # proxy), and the admin panel.
-            devappserver_hconf = docker.utils.create_host_config(
-                port_bindings=port_bindings,
-                binds={
-                    self.storage_path: {'bind': '/storage'},
-                }
-            )
-
-            self.devappserver_container = container.Container(self.dclient)
-            self.devappserver_container.create(
-                name=devappserver_container_name,
-                image=devappserver_image,
-                ports=port_bindings.keys(),
-                volumes=['/storage'],
-                host_config=devappserver_hconf,
-                environment=das_env)
-
-            self.devappserver_container.start()
-            get_logger().info('Starting container: %s',
-                              devappserver_container_name)
+        )
+
+        self.devappserver_container.create(
+            name=devappserver_container_name,
+            image=devappserver_image,
+            ports=port_bindings.keys(),
+            volumes=['/storage'],
+            host_config=devappserver_hconf,
+            environment=das_env)
+
+        self.devappserver_container.start()
+        get_logger().info('Starting container: %s',
+                          devappserver_container_name)
+        self.resolve_host_ports(self.devappserver_container)
 
+    def create_app_container(self, app_image):
+        """Create (but do not start) the application container.
+
+        Args:
+            app_image: (basestring) The name of the application image.
+        """
         # The application container needs several environment variables
         # in order to start up the application properly, as well as
         # look for the api server in the correct place. Notes:
@@ -321,21 +554,18 @@ class ContainerSandbox(object):
                    'GAE_SERVER_PORT': '8080',
                    'USE_MVM_AGENT': 'true'}
 
-        # Build from the application directory iff image_name is not
-        # specified.
-        app_image = self.image_name or self.build_app_image()
         app_container_name = self.make_timestamped_name('test_app',
                                                         self.cur_time)
 
-        # If devappserver is running, hook up the app to it.
+        # If devappserver is running, the app will share its network stack
+        # (see start_app_container), so it doesn't publish any ports itself.
         if self.run_devappserver:
-            network_mode = ('container:%s' %
-                            self.devappserver_container.get_id())
             ports = port_bindings = None
         else:
-            port_bindings = {DEFAULT_APPLICATION_PORT: self.port}
+            port_bindings = self.host_port_bindings(
+                {DEFAULT_APPLICATION_PORT:
+                 self._requested_ports[DEFAULT_APPLICATION_PORT]})
             ports = [DEFAULT_APPLICATION_PORT]
-            network_mode = None
 
         app_hconf = docker.utils.create_host_config(
             port_bindings=port_bindings,
@@ -356,6 +586,15 @@ class ContainerSandbox(object):
             host_config=app_hconf,
             environment=app_env)
 
+    def start_app_container(self):
+        """Start the application container, hooked up to devappserver."""
+        # If devappserver is running, hook up the app to it.
+        if self.run_devappserver:
+            network_mode = ('container:%s' %
+                            self.devappserver_container.get_id())
+        else:
+            network_mode = None
+
         # Start as a shared network container, putting the application
         # on devappserver's network stack. (If devappserver is not
         # running, network_mode is None).
@@ -365,12 +604,64 @@ class ContainerSandbox(object):
             if self.run_devappserver:
                 self.abort_if_not_running(self.devappserver_container)
             raise
+        if not self.run_devappserver:
+            self.resolve_host_ports(self.app_container)
+
+    @staticmethod
+    def host_port_bindings(requested_ports):
+        """Make the port bindings of a container's host config.
+
+        Args:
+            requested_ports: ({int: int}) The host port requested for each
+                container port. AUTO_PORT stands for any free port.
+
+        Returns:
+            ({int: int or None}) The port bindings, where None lets docker
+            pick the host port.
+        """
+        return dict((cont_port, None if host_port == AUTO_PORT else host_port)
+                    for cont_port, host_port in requested_ports.iteritems())
+
+    def resolve_host_ports(self, cont):
+        """Find out which host ports docker picked for AUTO_PORT ports.
 
-        # Construct a pinger container and bind it to the application's network
+        Args:
+            cont: (container.Container) The running container that
+                publishes the sandbox's ports.
+        """
+        if AUTO_PORT not in self._requested_ports.values():
+            return
+        published = cont.host_ports()
+
+        def resolve(cont_port, host_port):
+            if self._requested_ports.get(cont_port) != AUTO_PORT:
+                return host_port
+            return published.get(cont_port, host_port)
+
+        self.port = resolve(DEFAULT_APPLICATION_PORT, self.port)
+        self.admin_port = resolve(self.internal_admin_port, self.admin_port)
+        self.proxy_port = resolve(self.internal_proxy_port, self.proxy_port)
+        if self.extra_ports:
+            self.extra_ports = dict(
+                (cont_port, resolve(cont_port, host_port))
+                for cont_port, host_port in self.extra_ports.iteritems())
+
+    def create_pinger_container(self):
+        """Create (but do not start) the pinger container."""
+        # The pinger container will be bound to the application's network
         # stack. This will allow the pinger to attempt to connect to the
         # application's ports.
         pinger_name = self.make_timestamped_name('pinger', self.cur_time)
         self.pinger_container = container.PingerContainer(self.dclient)
+        if self.keep_warm:
+            pinger_name = self._warm_name.replace('devappserver', 'pinger', 1)
+
+            # A warm pinger is only on the right network stack if its
+            # devappserver was reused too.
+            if self.adopt_warm_container(
+                    self.pinger_container, pinger_name,
+                    reuse=self.reused_warm_containers):
+                return
         try:
             self.pinger_container.create(name=pinger_name,
                                          image=constants.PINGER_IMAGE)
@@ -381,17 +672,352 @@ class ContainerSandbox(object):
                                           'init"? ')
             raise
 
+    def start_pinger_container(self):
+        """Start the pinger container on the application's network stack."""
+        # The application shares devappserver's network stack, which
+        # outlives the application when devappserver is kept warm.
+        if self.keep_warm:
+            stack = self.devappserver_container
+        else:
+            stack = self.app_container
+        if not self.pinger_container.running():
+            try:
+                self.pinger_container.start(
+                    network_mode='container:{}'.format(stack.get_id()))
+            except utils.AppstartAbort:
+                self.abort_if_not_running(stack)
+                raise
+
+        if not self.pinger_container.start_agent():
+            get_logger().debug('The pinger image does not run a probe agent. '
+                               'Run "appstart init" to rebuild it for '
+                               'faster startup detection.')
+
+    def start_log_stream(self):
+        """Follow the logs of the containers, and print and store them.
+
+        All containers are followed by a single thread, and their lines are
+        printed as debug output and stored in output_path by another.
+        """
+        self.logs = log_stream.LogMultiplexer(self.dclient)
+        self.logs.follow(self.app_container, 'app')
+        if self.devappserver_container:
+            # Skip what a warm devappserver printed in earlier runs.
+            self.logs.follow(self.devappserver_container, 'devappserver',
+                             since=(self._started_at
+                                    if self.reused_warm_containers else None))
+        store = log_store.LogStore(self.output_path)
+        get_logger().info('Storing container output in %s', self.output_path)
+
+        # [bool] Whether output is still being stored. It stops at the
+        # first error.
+        storing = [True]
+
+        def store_safely(func, *args):
+            if not storing[0]:
+                return
+            try:
+                func(*args)
+            except (IOError, OSError) as err:
+                get_logger().warning('Could not store container output '
+                                     'in %s: %s', self.output_path, err)
+                storing[0] = False
+
+        def consume_lines():
+            for line in self.logs.lines(
+                    on_idle=lambda: store_safely(store.flush_stale)):
+                get_logger().debug('%s: %s', line.container, line.text)
+                store_safely(store.write, line)
+
+                # A steady trickle of lines never lets the queue go idle.
+                store_safely(store.flush_stale)
+            try:
+                store.flush()
+            except (IOError, OSError):
+                pass
+
+        self._log_consumer = threading.Thread(target=consume_lines,
+                                              name='log-consumer')
+        self._log_consumer.daemon = True
+        self._log_consumer.start()
+
+    def start_stats_collector(self):
+        """Start sampling the resource usage of the containers.
+
+        The pinger container is left out, since it's not part of the
+        application.
+        """
+        if not self.stats_interval:
+            return
+        containers = {'app': self.app_container}
+        if self.devappserver_container:
+            containers['devappserver'] = self.devappserver_container
+        self.stats = stats.StatsCollector(self.dclient, containers,
+                                          interval=self.stats_interval)
+        self.stats.start()
+
+    def adopt_warm_container(self, cont, name, reuse=True):
+        """Take over a container that was kept warm by an earlier sandbox.
+
+        A container with the name that can't be reused is removed, so that
+        a new one can take its name.
+
+        Args:
+            cont: (container.Container) The container object to manage the
+                warm container with.
+            name: (basestring) The name of the warm container.
+            reuse: (bool) Whether or not the container may be reused, if
+                it's running.
+
+        Returns:
+            (bool) Whether or not a running container was adopted.
+        """
         try:
-            self.pinger_container.start(
-                network_mode='container:{}'.format(self.app_container.get_id()))
-        except utils.AppstartAbort:
-            self.abort_if_not_running(self.app_container)
-            raise
+            info = self.dclient.inspect_container(name)
+        except docker.errors.APIError:
+            return False
+        if reuse and info['State']['Running']:
+            cont.adopt(info['Id'], name)
+            return True
+        get_logger().info('Removing warm container: %s', name)
+        try:
+            self.dclient.remove_container(info['Id'], force=True)
+        except docker.errors.APIError:
+            pass
+        return False
 
-        self.wait_for_start()
-        # call /_ah/start ?
+    def remove_conflicting_warm_containers(self, name, port_bindings):
+        """Remove warm containers that publish host ports we need.
 
-        self.app_container.stream_logs()
+        A change to the configuration makes a new warm devappserver, with
+        a new name, while the old one keeps running. The old devappserver
+        and its pinger are removed if they hold any of the host ports.
+
+        Args:
+            name: (basestring) The name of the new warm devappserver.
+            port_bindings: ({int: int or None}) The port bindings of the
+                new devappserver, as returned by host_port_bindings.
+        """
+        needed = set(port for port in port_bindings.itervalues() if port)
+        if not needed:
+            return
+        prefix = WARM_CONTAINER_PREFIX + 'devappserver_'
+        warm = dict(find_warm_containers(self.dclient))
+        for das_name, das_id in sorted(warm.iteritems()):
+            if not das_name.startswith(prefix) or das_name == name:
+                continue
+            stale = container.Container(self.dclient)
+            stale.adopt(das_id, das_name)
+            try:
+                if not needed & set(stale.host_ports().itervalues()):
+                    continue
+            except docker.errors.APIError:
+                continue
+            pinger_name = das_name.replace('devappserver', 'pinger', 1)
+            for stale_name in (pinger_name, das_name):
+                if stale_name not in warm:
+                    continue
+                get_logger().info('Removing warm container: %s', stale_name)
+                try:
+                    self.dclient.remove_container(warm[stale_name],
+                                                  force=True)
+                except docker.errors.APIError as err:
+                    get_logger().warning('Failed to remove container %s '
+                                         '(%s).', stale_name, err)
+
+    def watch(self, debounce=file_watcher.DEFAULT_DEBOUNCE):
+        """Keep the sandbox up to date with the application directory.
+
+        Runs until interrupted. A change that can't be applied is logged,
+        and the sandbox waits for the next one. If the sandbox was torn
+        down by the failure, the next change starts it again.
+
+        Args:
+            debounce: (float) How long the application directory has to be
+                quiet before changes are applied, in seconds.
+        """
+        watcher = file_watcher.DirectoryWatcher(self.app_dir,
+                                                debounce=debounce)
+        get_logger().info('Watching %s for changes', self.app_dir)
+        try:
+            while True:
+                changes = watcher.wait_for_changes()
+                if not changes:
+                    continue
+                get_logger().debug('Changed: %s', ', '.join(sorted(changes)))
+                try:
+                    if self.app_container and self.app_container.get_id():
+                        self.apply_changes(changes)
+                    else:
+                        self.start()
+                except utils.AppstartAbort as err:
+                    get_logger().warning('%s Waiting for the next change.',
+                                         err.message)
+        finally:
+            watcher.close()
+
+    def apply_changes(self, changes):
+        """Bring the running sandbox up to date with changed files.
+
+        Files that the application's Dockerfile only copies into the image
+        are copied into the running containers instead, and the
+        application's process is restarted in place. Changes to the
+        Dockerfile, to files that its RUN instructions may use, or to
+        devappserver's config files rebuild the sandbox.
+
+        Args:
+            changes: (iterable) Paths relative to the application directory
+                that changed, as reported by file_watcher.DirectoryWatcher.
+
+        Returns:
+            (hot_reload.ChangePlan) What was done.
+        """
+        plan = self.plan_changes(changes)
+        if (not plan.rebuild and plan.app_deleted and
+                not self.app_container.running()):
+            # Files are deleted by a command in the container, which can't
+            # run while it's stopped.
+            plan = hot_reload.ChangePlan(plan.app_deleted[0], {}, [], {}, [])
+        if plan.rebuild:
+            get_logger().info('%s changed, rebuilding the sandbox',
+                              plan.rebuild)
+            self.stop()
+            self.start()
+            return plan
+
+        if plan.devappserver_files or plan.devappserver_deleted:
+            self.sync_files(self.devappserver_container,
+                            plan.devappserver_files,
+                            plan.devappserver_deleted)
+        if plan.app_files or plan.app_deleted:
+            self.sync_files(self.app_container, plan.app_files,
+                            plan.app_deleted)
+            self.restart_app_container()
+        return plan
+
+    def plan_changes(self, changes):
+        """Work out how to bring the sandbox up to date with changed files.
+
+        Args:
+            changes: (iterable) Paths relative to the application directory
+                that changed.
+
+        Returns:
+            (hot_reload.ChangePlan) What to copy into and delete from the
+            containers, or the file that calls for a rebuild.
+        """
+        paths = [(relpath, os.path.join(self.app_dir, relpath))
+                 for relpath in sorted(changes)]
+        dockerfile_map = (None if self.image_name else
+                          hot_reload.DockerfileMap(self.app_dir))
+        for relpath, path in paths:
+            if ((self.run_devappserver and
+                 self.is_devappserver_config(path)) or
+                    (dockerfile_map and
+                     dockerfile_map.is_build_input(relpath))):
+                return hot_reload.ChangePlan(relpath, {}, [], {}, [])
+
+        plan = hot_reload.ChangePlan(None, {}, [], {}, [])
+
+        def add(files, deleted, dest, path):
+            if os.path.isfile(path):
+                files[dest] = path
+            elif not os.path.exists(path):
+                deleted.append(dest)
+
+        # devappserver serves static files from its copy of the directories
+        # of the config files.
+        static_dirs = []
+        if self.run_devappserver and not (
+                self.application_configuration.is_java):
+            static_dirs = utils.get_static_dirs(self.conf_paths[0])
+        conf_dirs = set(os.path.dirname(p) for p in self.conf_paths)
+
+        for relpath, path in paths:
+            if dockerfile_map:
+                for dest in dockerfile_map.destinations(relpath):
+                    add(plan.app_files, plan.app_deleted, dest, path)
+            if not any(path == d or path.startswith(d + os.sep)
+                       for d in static_dirs):
+                continue
+            for conf_dir in conf_dirs:
+                if path.startswith(conf_dir + os.sep):
+                    dest = posixpath.join(
+                        '/app', self.das_offset,
+                        os.path.relpath(path, conf_dir).replace(os.sep, '/'))
+                    add(plan.devappserver_files, plan.devappserver_deleted,
+                        dest, path)
+        return plan
+
+    def is_devappserver_config(self, path):
+        """Check whether a file is one of devappserver's config files.
+
+        Args:
+            path: (basestring) The absolute path to the file, which may not
+                exist (anymore).
+
+        Returns:
+            (bool) Whether or not the devappserver image has to be rebuilt
+            when the file changes.
+        """
+        if path in self.conf_paths:
+            return True
+        if (self.application_configuration.is_java and
+                path == self.get_web_xml(self.conf_paths[0])):
+            return True
+        return (os.path.basename(path) in EXTRA_CONFIG_FILES and
+                os.path.dirname(path) in set(os.path.dirname(p)
+                                             for p in self.conf_paths))
+
+    @staticmethod
+    def sync_files(cont, files, deleted):
+        """Copy files into a container, and delete others from it.
+
+        Args:
+            cont: (container.Container) The container.
+            files: ({basestring: basestring}) The files to copy, from their
+                path in the container to their path on this machine.
+            deleted: ([basestring, ...]) The paths to delete from the
+                container.
+
+        Raises:
+            utils.AppstartAbort: If the container couldn't be updated.
+        """
+        if deleted:
+            try:
+                cont.execute(['rm', '-rf', '--'] + sorted(deleted))
+            except docker.errors.APIError as err:
+                raise utils.AppstartAbort('Could not delete files from {0}: '
+                                          '{1}'.format(cont.name, err))
+        if files:
+            archive = hot_reload.make_archive(files)
+            try:
+                cont.put_archive('/', archive)
+            finally:
+                archive.close()
+        get_logger().info('Updated %s: copied %d file(s), deleted %d',
+                          cont.name, len(files), len(deleted))
+
+    def restart_app_container(self):
+        """Restart the application's process, and wait for it to be ready.
+
+        The container keeps its file system, so files copied into it by
+        sync_files are kept.
+        """
+        self.app_container.restart()
+
+        # Without devappserver, the pinger is on the network stack of the
+        # application container, which is replaced when it restarts.
+        if not self.run_devappserver:
+            self.pinger_container.close_agent()
+            self.pinger_container.restart()
+            self.pinger_container.start_agent()
+
+        if self.logs:
+            self.logs.follow(self.app_container, 'app')
+        if self.stats:
+            self.stats.restart('app')
+        self.wait_for_start()
 
     def stop(self):
         """Remove containers to clean up the environment."""
@@ -400,30 +1026,98 @@ class ContainerSandbox(object):
     @staticmethod
     def abort_if_not_running(cont):
         if not cont.running():
-            cont.stream_logs(stream=False)
+            cont.print_logs()
             raise utils.AppstartAbort('{0} stopped '
                                       'prematurely'.format(cont.name))
 
     def __exit__(self, etype, value, traceback):
         self.stop()
 
-    def stop_and_remove_containers(self):
-        """Stop and remove application containers."""
-        containers_to_remove = [self.app_container,
-                                self.devappserver_container,
-                                self.pinger_container]
-        for cont in containers_to_remove:
-            if cont and cont.running():
-                cont_id = cont.get_id()
-                get_logger().info('Stopping %s', cont_id)
-                cont.kill()
+    def stop_and_remove_containers(self, timeout=TEARDOWN_TIMEOUT):
+        """Stop and remove application containers.
+
+        The containers are removed concurrently. Each one is killed and
+        removed with a single forced removal, so there's no need to check
+        whether it's still running first.
 
-                get_logger().info('Removing %s', cont_id)
-                cont.remove()
+        Args:
+            timeout: (float) The maximum number of seconds to wait for the
+                containers to be removed.
+
+        Returns:
+            ([basestring, ...]) The ids of the containers that could not be
+            removed before the timeout expired.
+        """
+        if self.stats:
+            self.stats.stop()
+            self.stats.log_summary()
+            self.stats = None
+
+        containers_to_remove = [self.app_container]
+        if self.keep_warm and self.devappserver_container:
+            if self.pinger_container:
+                self.pinger_container.close_agent()
+            get_logger().info('Keeping %s warm. Remove it and its pinger with '
+                              '"appstart pool --clear".',
+                              self.devappserver_container.name)
+        else:
+            containers_to_remove.extend([self.devappserver_container,
+                                         self.pinger_container])
+        # {basestring: basestring} Reasons why containers weren't removed.
+        # Threads that time out may still add to it, so it's only read
+        # through a copy taken under the lock.
+        failures = {}
+        failures_lock = threading.Lock()
+
+        def remove(cont, cont_id):
+            try:
+                cont.remove(force=True)
+            except Exception as err:  # pylint: disable=broad-except
+                with failures_lock:
+                    failures[cont_id] = str(err) or type(err).__name__
+
+        threads = []
+        for cont in containers_to_remove:
+            cont_id = cont.get_id() if cont else None
+            if not cont_id:
+                continue
+            get_logger().info('Removing %s', cont_id)
+            thread = threading.Thread(target=remove, args=(cont, cont_id),
+                                      name='remove-{0}'.format(cont_id))
+            thread.daemon = True
+            thread.start()
+            threads.append((cont_id, thread))
+
+        deadline = time.time() + timeout
+        for cont_id, thread in threads:
+            thread.join(max(deadline - time.time(), 0))
+            if thread.is_alive():
+                with failures_lock:
+                    failures.setdefault(cont_id, 'timed out')
+        with failures_lock:
+            reported = dict(failures)
+
+        # Once the containers are gone, their logs are complete.
+        if self.logs:
+            self.logs.stop(max(deadline - time.time(), 0))
+            self._log_consumer.join(max(deadline - time.time(), 0))
+            self.logs = None
+
+        for cont_id in sorted(reported):
+            get_logger().warning('Failed to remove container %s (%s). '
+                                 'Remove it with "docker rm -f %s".',
+                                 cont_id, reported[cont_id], cont_id)
+        return sorted(reported)
 
     def wait_for_start(self):
         """Wait for the app container to start.
 
+        The application is probed with an exponentially increasing delay,
+        starting at INITIAL_PROBE_DELAY, so that fast applications are
+        detected quickly. Meanwhile, the docker event stream is used to
+        notice containers that die. The time it took for the application
+        to become ready is stored in self.time_to_ready.
+
         Raises:
             utils.AppstartAbort: If the application server doesn't
                 start after timeout reach it on 8080.
@@ -431,7 +1125,6 @@ class ContainerSandbox(object):
         host = self.app_container.host
 
         get_logger().info('Waiting for application to listen on port 8080')
-        attempt = 1
         graphical = sys.stdout.isatty()
 
         def print_if_graphical(message):
@@ -443,29 +1136,75 @@ class ContainerSandbox(object):
             print_if_graphical('\n')
             raise utils.AppstartAbort(error)
 
-        print_if_graphical('Waiting ')
-        while True:
-            if attempt > self.timeout:
-                exit_loop_with_error('The application server timed out.')
-
-            if self.run_devappserver:
-                self.abort_if_not_running(self.devappserver_container)
-
-            self.abort_if_not_running(self.app_container)
+        start_time = time.time()
+        deadline = start_time + self.timeout
 
-            if attempt % 4 == 0:
-                # \033[3D moves the cursor left 3 times. \033[K clears to the
-                # end of the line. So, every 4th ping, clear the dots.
-                print_if_graphical('\033[3D\033[K')
-            else:
-                print_if_graphical('.')
-
-            if self.pinger_container.ping_application_container():
-                print_if_graphical('\n')
-                break
+        # Rather than polling the state of the containers, listen for them
+        # dying. The watcher replays events from slightly before now, so a
+        # container that died before we subscribed is still noticed.
+        watched = [self.app_container]
+        if self.run_devappserver:
+            watched.append(self.devappserver_container)
+        watcher = container.ContainerEventWatcher(self.dclient,
+                                                  watched,
+                                                  since=int(start_time) - 1,
+                                                  until=int(deadline) + 1)
+        watcher.start()
 
-            attempt += 1
-            time.sleep(1)
+        try:
+            print_if_graphical('Waiting ')
+            attempt = 1
+            ticks = 0
+            delay = INITIAL_PROBE_DELAY
+            while True:
+                if watcher.available:
+                    if watcher.dead_container:
+                        self.abort_if_not_running(watcher.dead_container)
+                else:
+                    # Without the event stream, fall back to inspecting the
+                    # containers on every attempt.
+                    for cont in watched:
+                        self.abort_if_not_running(cont)
+
+                if self.pinger_container.ping_application_container():
+                    print_if_graphical('\n')
+                    break
+
+                now = time.time()
+                if now >= deadline:
+                    exit_loop_with_error('The application server timed out.')
+
+                # Print one dot per second of waiting.
+                while ticks < int(now - start_time):
+                    ticks += 1
+                    if ticks % 4 == 0:
+                        # \033[3D moves the cursor left 3 times. \033[K
+                        # clears to the end of the line. So, every 4th
+                        # second, clear the dots.
+                        print_if_graphical('\033[3D\033[K')
+                    else:
+                        print_if_graphical('.')
+
+                # Back off exponentially between probes, but wake up right
+                # away if one of the containers dies.
+                watcher.wait(min(delay, deadline - now))
+                delay = min(delay * 2, MAX_PROBE_DELAY)
+                attempt += 1
+        finally:
+            watcher.stop()
+
+        self.time_to_ready = time.time() - start_time
+        get_logger().info('Application was ready after {0:.3f}s ({1} '
+                          'probe{2}).'.format(self.time_to_ready,
+                                              attempt,
+                                              '' if attempt == 1 else 's'))
+
+        if self.extra_ports:
+            listening = self.pinger_container.probe(sorted(self.extra_ports))
+            for port in sorted(port for port, up in listening.iteritems()
+                               if not up):
+                get_logger().warning('The application is not listening on '
+                                     'extra port {0} yet.'.format(port))
 
         # Tell the user where to connect, depending on whether or not the
         # devappserver is running.
@@ -511,10 +1250,20 @@ class ContainerSandbox(object):
     def build_devappserver_image(self, devbase_image=constants.DEVAPPSERVER_IMAGE):
         """Build a layer over devappserver to include application files.
 
-        The new image contains the user's config files.
+        The new image contains the user's config files. If an image with the
+        same build context (config files, static files, Dockerfile and base
+        image) already exists, it is reused and nothing is built.
+
+        Args:
+            devbase_image: (basestring) The devappserver base image to
+                build on top of.
+
+        Raises:
+            utils.AppstartAbort: If the base image does not exist or the
+                build failed.
 
         Returns:
-            (basestring) The name of the new devappserver image.
+            (basestring) The name of the devappserver image.
         """
         # Collect the files that should be added to the docker build
         # context.
@@ -525,10 +1274,9 @@ class ContainerSandbox(object):
             files_to_add[self.get_web_xml(self.conf_paths[0])] = None
 
         # Add any other valid yaml files over
-        valid_yaml_file_names = ['queue', 'cron', 'dispatch', 'index']
         for dirname in path_dirs:
-            for filename in valid_yaml_file_names:
-                full_path = os.path.join(dirname, '%s.yaml' % filename)
+            for filename in EXTRA_CONFIG_FILES:
+                full_path = os.path.join(dirname, filename)
                 if os.path.isfile(full_path):
                     files_to_add[full_path] = None
 
@@ -548,12 +1296,34 @@ class ContainerSandbox(object):
                     for path in path_dirs])
                }
 
+        # The overlay image is named after a digest of everything that goes
+        # into it, so an unchanged application reuses the image from its
+        # previous run instead of rebuilding it.
+        try:
+            base_image_id = self.dclient.inspect_image(devbase_image).get('Id')
+        except docker.errors.APIError:
+            raise utils.AppstartAbort('No devappserver base image found. '
+                                      'Did you forget to run "appstart '
+                                      'init"?')
+        digest = utils.hash_build_context(dockerfile, files_to_add,
+                                          base_image_id)
+        image_name = '%s:%s' % (DEVAPPSERVER_OVERLAY_REPO,
+                                digest[:DIGEST_TAG_LENGTH])
+
+        if not self.nocache and self.image_exists(image_name):
+            get_logger().info('Using cached devappserver image: %s',
+                              image_name)
+            return image_name
+
         # Construct a file-like object from the Dockerfile.
         dockerfile_obj = io.BytesIO(dockerfile.encode('utf-8'))
-        build_context = utils.make_tar_build_context(dockerfile_obj,
-                                                     files_to_add)
-        image_name = self.make_timestamped_name('devappserver_image',
-                                                self.cur_time)
+
+        # The build context is streamed to the daemon. Compressing it only
+        # pays off when the daemon is on another machine.
+        build_context = utils.make_tar_build_context(
+            dockerfile_obj,
+            files_to_add,
+            compress=not self.dclient.base_url.startswith(UNIX_SOCKET_URL))
 
         # Build the devappserver image.
         res = self.dclient.build(fileobj=build_context,
@@ -563,16 +1333,25 @@ class ContainerSandbox(object):
                                  tag=image_name)
 
         # Log the output of the build.
-        try:
-            utils.log_and_check_build_results(res, image_name)
-        except utils.AppstartAbort:
-            if not utils.find_image(constants.DEVAPPSERVER_IMAGE):
-                raise utils.AppstartAbort('No devappserver base image found. '
-                                          'Did you forget to run "appstart '
-                                          'init"?')
-            raise
+        utils.log_and_check_build_results(res, image_name)
         return image_name
 
+    def image_exists(self, image_name):
+        """Check whether the docker host already has an image.
+
+        Args:
+            image_name: (basestring) The name (and optionally tag) of the
+                image.
+
+        Returns:
+            (bool) Whether or not the image exists.
+        """
+        try:
+            self.dclient.inspect_image(image_name)
+        except docker.errors.APIError:
+            return False
+        return True
+
     @staticmethod
     def get_web_xml(full_config_file_path):
         """Get (what should be) the path of the web.xml file.
@@ -587,6 +1366,23 @@ class ContainerSandbox(object):
         return os.path.join(os.path.dirname(full_config_file_path),
                             'web.xml')
 
+    def get_host_log_path(self):
+        """Return the application's log directory, if it's readable here.
+
+        The log directory is bind mounted from log_path on the docker host,
+        which is only this machine if docker is reached through a local
+        unix socket.
+
+        Returns:
+            (basestring or None) log_path, or None if the logs can only be
+            read through docker.
+        """
+        if (self.dclient.base_url.startswith(UNIX_SOCKET_URL) and
+                os.path.isdir(self.log_path) and
+                os.access(self.log_path, os.R_OK | os.X_OK)):
+            return self.log_path
+        return None
+
     @staticmethod
     def make_timestamped_name(base, time_str):
         """Construct a name for an image or container.
@@ -0,0 +1,284 @@
+# Copyright 2015 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Watch a directory tree for files that change.
+
+On Linux, changes are reported by inotify. Elsewhere, or when inotify is
+out of watches, the tree is scanned periodically instead.
+"""
+
+# This file conforms to the external style guide.
+# pylint: disable=bad-indentation, g-bad-import-order
+
+import ctypes
+import ctypes.util
+import errno
+import fnmatch
+import os
+import select
+import struct
+import sys
+import time
+
+from ..utils import get_logger
+
+# How long a directory has to be quiet before a burst of changes is
+# reported, in seconds. Editors and version control tools touch several
+# files for a single save or checkout.
+DEFAULT_DEBOUNCE = 0.3
+
+# The longest time to keep waiting for a burst of changes to end, in
+# seconds.
+MAX_BATCH_DELAY = 5
+
+# How often the tree is scanned when inotify can't be used, in seconds.
+DEFAULT_POLL_INTERVAL = 1
+
+# Names of files and directories whose changes are never reported, such as
+# version control metadata and editor swap files.
+IGNORED_NAMES = ('.git', '.hg', '.svn', '*.swp', '*.swx', '*~', '.#*', '4913')
+
+# inotify event flags. See inotify(7).
+_IN_MODIFY = 0x00000002
+_IN_ATTRIB = 0x00000004
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_Q_OVERFLOW = 0x00004000
+_IN_IGNORED = 0x00008000
+_IN_ONLYDIR = 0x01000000
+_IN_ISDIR = 0x40000000
+
+_WATCH_MASK = (_IN_MODIFY | _IN_ATTRIB | _IN_CLOSE_WRITE | _IN_MOVED_FROM |
+               _IN_MOVED_TO | _IN_CREATE | _IN_DELETE | _IN_ONLYDIR)
+
+# struct inotify_event, without the name that follows it.
+_EVENT_HEADER = struct.Struct('iIII')
+
+_READ_SIZE = 64 * 1024
+
+
+def is_ignored(relpath):
+    """Check whether changes to a path should not be reported.
+
+    Args:
+        relpath: (basestring) A path relative to the watched directory.
+
+    Returns:
+        (bool) Whether or not any component of the path is ignored.
+    """
+    return any(fnmatch.fnmatch(part, pattern)
+               for part in relpath.split(os.sep)
+               for pattern in IGNORED_NAMES)
+
+
+def _walk_files(directory):
+    """List the files in a tree, relative to its root."""
+    files = []
+    for dirname, subdirs, filenames in os.walk(directory):
+        rel_dir = os.path.relpath(dirname, directory)
+        subdirs[:] = [d for d in subdirs if not is_ignored(d)]
+        for filename in filenames:
+            files.append(os.path.normpath(os.path.join(rel_dir, filename)))
+    return files
+
+
+class _InotifyBackend(object):
+    """Report changes as inotify sees them."""
+
+    def __init__(self, directory):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._rm_watch = libc.inotify_rm_watch
+        self._directory = directory
+        self._fd = libc.inotify_init()
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init failed')
+
+        # {int: basestring} The directory of each watch, relative to the
+        # watched directory.
+        self._watches = {}
+        try:
+            self._watch_tree('')
+        except OSError:
+            self.close()
+            raise
+
+    def _watch_tree(self, rel_dir):
+        for dirname, subdirs, _ in os.walk(
+                os.path.join(self._directory, rel_dir)):
+            subdirs[:] = [d for d in subdirs if not is_ignored(d)]
+            wd = self._add_watch(self._fd, dirname, _WATCH_MASK)
+            if wd < 0:
+                err = ctypes.get_errno()
+                if err == errno.ENOENT:
+                    continue
+                raise OSError(err, 'Could not watch {0}'.format(dirname))
+            rel = os.path.relpath(dirname, self._directory)
+            self._watches[wd] = '' if rel == '.' else rel
+
+    def read(self, timeout):
+        """Wait for changes.
+
+        Args:
+            timeout: (float or None) How long to wait, in seconds.
+
+        Returns:
+            (set) The paths that changed, relative to the watched
+            directory. Empty if nothing changed before the timeout.
+        """
+        try:
+            readable, _, _ = select.select([self._fd], [], [], timeout)
+        except select.error as err:
+            if err.args[0] == errno.EINTR:
+                return set()
+            raise
+        if not readable:
+            return set()
+        data = os.read(self._fd, _READ_SIZE)
+        changes = set()
+        offset = 0
+        while offset + _EVENT_HEADER.size <= len(data):
+            wd, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip('\0')
+            offset += length
+            if mask & _IN_Q_OVERFLOW:
+                # Events were lost, so report everything.
+                changes.update(_walk_files(self._directory))
+                continue
+            if mask & _IN_IGNORED:
+                self._watches.pop(wd, None)
+                continue
+            rel_dir = self._watches.get(wd)
+            if rel_dir is None or not name:
+                continue
+            path = os.path.join(rel_dir, name)
+            if mask & _IN_ISDIR and mask & (_IN_CREATE | _IN_MOVED_TO):
+                # Files in a new directory may have been created before it
+                # was watched.
+                if not is_ignored(path):
+                    try:
+                        self._watch_tree(path)
+                    except OSError as err:
+                        get_logger().warning('Not watching %s: %s',
+                                             path, err)
+                    changes.update(
+                        os.path.join(path, f) for f in _walk_files(
+                            os.path.join(self._directory, path)))
+            changes.add(path)
+        return changes
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+class _PollingBackend(object):
+    """Report changes by comparing scans of the tree."""
+
+    def __init__(self, directory, poll_interval):
+        self._directory = directory
+        self._poll_interval = poll_interval
+        self._snapshot = self._scan()
+
+    def _scan(self):
+        snapshot = {}
+        for path in _walk_files(self._directory):
+            try:
+                stat = os.stat(os.path.join(self._directory, path))
+            except OSError:
+                continue
+            snapshot[path] = (stat.st_mtime, stat.st_size, stat.st_mode)
+        return snapshot
+
+    def read(self, timeout):
+        """Wait for changes. See _InotifyBackend.read."""
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            delay = self._poll_interval
+            if deadline is not None:
+                delay = min(delay, max(deadline - time.time(), 0))
+            time.sleep(delay)
+            snapshot = self._scan()
+            changes = set(path for path in set(snapshot) | set(self._snapshot)
+                          if snapshot.get(path) != self._snapshot.get(path))
+            self._snapshot = snapshot
+            if changes or (deadline is not None and time.time() >= deadline):
+                return changes
+
+    def close(self):
+        pass
+
+
+class DirectoryWatcher(object):
+    """Report the files that change in a directory tree, in batches."""
+
+    def __init__(self, directory, debounce=DEFAULT_DEBOUNCE,
+                 poll_interval=DEFAULT_POLL_INTERVAL, use_inotify=True):
+        """Initializer for DirectoryWatcher.
+
+        Args:
+            directory: (basestring) The directory to watch.
+            debounce: (float) How long the directory has to be quiet before
+                changes are reported, in seconds.
+            poll_interval: (float) How often to scan the tree if inotify
+                can't be used, in seconds.
+            use_inotify: (bool) Whether or not to try inotify before
+                falling back to scanning.
+        """
+        self.directory = directory
+        self.debounce = debounce
+        self._backend = None
+        if use_inotify and sys.platform.startswith('linux'):
+            try:
+                self._backend = _InotifyBackend(directory)
+            except (AttributeError, OSError) as err:
+                get_logger().debug('Could not use inotify (%s), scanning '
+                                   '%s every %ss instead.', err, directory,
+                                   poll_interval)
+        if not self._backend:
+            self._backend = _PollingBackend(directory, poll_interval)
+
+    def wait_for_changes(self, timeout=None):
+        """Wait for files to change, and for the changes to settle.
+
+        Args:
+            timeout: (float or None) How long to wait for the first change,
+                in seconds. Waits forever if None.
+
+        Returns:
+            (set) The paths that changed, relative to the watched directory.
+            Paths that don't exist anymore were deleted. Empty if nothing
+            changed before the timeout.
+        """
+        changes = self._backend.read(timeout)
+        if changes:
+            deadline = time.time() + MAX_BATCH_DELAY
+            while True:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                more = self._backend.read(min(self.debounce, remaining))
+                if not more:
+                    break
+                changes |= more
+        return set(path for path in changes if not is_ignored(path))
+
+    def close(self):
+        """Stop watching."""
+        self._backend.close()
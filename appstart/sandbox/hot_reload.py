@@ -0,0 +1,279 @@
+# Copyright 2015 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Work out how changed files reach a running application container.
+
+The application's Dockerfile decides where each file of the build context
+ends up in the image. A changed file that is only copied into the image can
+be copied into the running container instead of rebuilding the image. A
+file that a later RUN instruction may have used (such as a requirements.txt
+that is installed) can't, and neither can the Dockerfile itself.
+"""
+
+# This file conforms to the external style guide.
+# pylint: disable=bad-indentation, g-bad-import-order
+
+import collections
+import fnmatch
+import json
+import os
+import posixpath
+import re
+import tarfile
+import tempfile
+
+# Files in the root of the application directory that change the build
+# itself when they change.
+BUILD_FILES = ('Dockerfile', '.dockerignore')
+
+# Archives that ADD unpacks, rather than copying them.
+_ARCHIVE_SUFFIXES = ('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz',
+                     '.txz')
+
+# Archives in memory larger than this are spilled to disk, in bytes.
+ARCHIVE_SPOOL_MAX_SIZE = 1 << 24
+
+_GLOB_MAGIC = re.compile('[*?[]')
+
+# A change to the application directory, sorted by what it takes to apply.
+#
+# rebuild: (basestring or None) A file whose change calls for the sandbox
+#     to be rebuilt, if any. When present, the other fields are empty.
+# app_files: ({basestring: basestring}) Files to copy into the application
+#     container, from container path to host path.
+# app_deleted: ([basestring, ...]) Paths to delete from the application
+#     container.
+# devappserver_files: ({basestring: basestring}) Files to copy into the
+#     devappserver container, from container path to host path.
+# devappserver_deleted: ([basestring, ...]) Paths to delete from the
+#     devappserver container.
+ChangePlan = collections.namedtuple('ChangePlan', [
+    'rebuild', 'app_files', 'app_deleted', 'devappserver_files',
+    'devappserver_deleted'])
+
+
+def _instructions(dockerfile):
+    """Split a Dockerfile into (instruction, arguments) pairs."""
+    logical = ''
+    for line in dockerfile.splitlines():
+        stripped = line.strip()
+        if not logical and (not stripped or stripped.startswith('#')):
+            continue
+        if stripped.endswith('\\'):
+            logical += stripped[:-1] + ' '
+            continue
+        logical += stripped
+        parts = logical.split(None, 1)
+        logical = ''
+        if parts:
+            yield parts[0].upper(), parts[1] if len(parts) > 1 else ''
+
+
+def _split_arguments(arguments):
+    """Split the arguments of ADD or COPY, in either of their forms."""
+    if arguments.startswith('['):
+        try:
+            return [str(arg) for arg in json.loads(arguments)]
+        except ValueError:
+            pass
+    return arguments.split()
+
+
+class DockerfileMap(object):
+    """Map the files of a build context to their paths in the image."""
+
+    def __init__(self, context_dir):
+        """Initializer for DockerfileMap.
+
+        Args:
+            context_dir: (basestring) The directory with the Dockerfile,
+                whose contents are the build context.
+        """
+        self.context_dir = context_dir
+
+        # [([basestring, ...], basestring, bool, bool), ...] The sources,
+        # destination, whether the sources can be unpacked (ADD), and
+        # whether a RUN instruction follows, for each ADD and COPY.
+        self._copies = []
+
+        # [(basestring, bool), ...] The .dockerignore patterns, and whether
+        # each one is an exception.
+        self._ignored = []
+
+        try:
+            with open(os.path.join(context_dir, 'Dockerfile')) as dockerfile:
+                self._parse(dockerfile.read())
+        except IOError:
+            pass
+        try:
+            with open(os.path.join(context_dir, '.dockerignore')) as ignore:
+                for line in ignore:
+                    pattern = line.strip()
+                    if not pattern or pattern.startswith('#'):
+                        continue
+                    exception = pattern.startswith('!')
+                    pattern = posixpath.normpath(pattern.lstrip('!'))
+                    self._ignored.append((pattern.lstrip('/'), exception))
+        except IOError:
+            pass
+
+    def _parse(self, dockerfile):
+        workdir = '/'
+        pending = []
+        for instruction, arguments in _instructions(dockerfile):
+            if instruction == 'FROM':
+                # Everything before FROM belongs to a different image.
+                del self._copies[:]
+                pending = []
+                workdir = '/'
+            elif instruction == 'WORKDIR':
+                workdir = posixpath.join(workdir, arguments.strip())
+            elif instruction == 'RUN':
+                for index in pending:
+                    self._copies[index] = self._copies[index][:3] + (True,)
+                pending = []
+            elif instruction in ('ADD', 'COPY'):
+                args = _split_arguments(arguments)
+                if len(args) < 2:
+                    continue
+                sources = [posixpath.normpath(src).lstrip('/') or '.'
+                           for src in args[:-1]
+                           if not re.match(r'^\w+://', src)]
+                dest = args[-1]
+                # Several sources always go into a directory.
+                into_dir = (dest.endswith('/') or dest in ('.', '..') or
+                            len(args) > 2 or
+                            any(_GLOB_MAGIC.search(s) for s in sources))
+                dest = posixpath.normpath(posixpath.join(workdir, dest))
+                if into_dir:
+                    dest = dest.rstrip('/') + '/'
+                pending.append(len(self._copies))
+                self._copies.append((sources, dest, instruction == 'ADD',
+                                     False))
+
+    def is_ignored(self, relpath):
+        """Check whether .dockerignore leaves a file out of the context.
+
+        Args:
+            relpath: (basestring) A path relative to the context directory.
+
+        Returns:
+            (bool) Whether or not the file is left out.
+        """
+        relpath = relpath.replace(os.sep, '/')
+        prefixes = _prefixes(relpath)
+        ignored = False
+        for pattern, exception in self._ignored:
+            if any(fnmatch.fnmatchcase(prefix, pattern)
+                   for prefix, _ in prefixes):
+                ignored = not exception
+        return ignored
+
+    def _matches(self, relpath):
+        """Yield (destination, copy) for each copy of a file into the image.
+        """
+        relpath = relpath.replace(os.sep, '/')
+        for copy in self._copies:
+            sources, dest = copy[0], copy[1]
+            for source in sources:
+                for prefix, rest in _prefixes(relpath):
+                    if source == '.':
+                        inner = relpath
+                    elif prefix == source or (
+                            _GLOB_MAGIC.search(source) and
+                            fnmatch.fnmatchcase(prefix, source)):
+                        inner = rest
+                    else:
+                        continue
+                    if inner:
+                        # Directories are copied by their contents.
+                        yield posixpath.join(dest, inner), copy
+                    elif dest.endswith('/'):
+                        yield dest + posixpath.basename(relpath), copy
+                    else:
+                        yield dest, copy
+                    break
+
+    def destinations(self, relpath):
+        """Find where the image has a file from the build context.
+
+        Args:
+            relpath: (basestring) A path relative to the context directory.
+                It may be a directory.
+
+        Returns:
+            ([basestring, ...]) The absolute paths of its copies in the
+            image, if any.
+        """
+        if self.is_ignored(relpath):
+            return []
+        return sorted(set(dest for dest, _ in self._matches(relpath)))
+
+    def is_build_input(self, relpath):
+        """Check whether a file may affect the image beyond being copied.
+
+        This is the case if a RUN instruction follows a copy of the file,
+        or if ADD unpacks it.
+
+        Args:
+            relpath: (basestring) A path relative to the context directory.
+
+        Returns:
+            (bool) Whether or not the image must be rebuilt when the file
+            changes.
+        """
+        if relpath.replace(os.sep, '/') in BUILD_FILES:
+            return True
+        if self.is_ignored(relpath):
+            return False
+        for _, (_, _, unpacks, has_run) in self._matches(relpath):
+            if has_run or (unpacks and relpath.endswith(_ARCHIVE_SUFFIXES)):
+                return True
+        return False
+
+
+def _prefixes(relpath):
+    """List (prefix, rest) pairs of a path, from the shortest prefix on."""
+    parts = relpath.split('/')
+    return [('/'.join(parts[:i]), '/'.join(parts[i:]))
+            for i in range(1, len(parts) + 1)]
+
+
+def make_archive(files):
+    """Make a tar archive of files, to extract at the root of a container.
+
+    Files are owned by root, as they would be if the Dockerfile had copied
+    them.
+
+    Args:
+        files: ({basestring: basestring}) The absolute container path of each
+            file, mapped to its path on this machine.
+
+    Returns:
+        (file) The archive, at its start. Files that disappeared since they
+        were listed are left out.
+    """
+    fileobj = tempfile.SpooledTemporaryFile(max_size=ARCHIVE_SPOOL_MAX_SIZE)
+    with tarfile.open(fileobj=fileobj, mode='w') as tar:
+        for dest, path in sorted(files.iteritems()):
+            try:
+                tinfo = tar.gettarinfo(path, arcname=dest.lstrip('/'))
+                with open(path, 'rb') as source:
+                    tinfo.uid = tinfo.gid = 0
+                    tinfo.uname = tinfo.gname = 'root'
+                    tar.addfile(tinfo, source)
+            except (IOError, OSError):
+                continue
+    fileobj.seek(0)
+    return fileobj
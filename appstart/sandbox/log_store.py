@@ -0,0 +1,332 @@
+# Copyright 2015 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Store the output of containers on disk, and search it.
+
+Each container's output goes to its own directory, in numbered segments.
+A segment is a gzip file made of independently compressed blocks of lines
+(concatenated gzip members, so zcat can read it whole), and grows until it
+reaches the segment size. Only the newest segments are kept.
+
+Next to each segment, an index file has one line per block:
+
+    <first timestamp> <last timestamp> <offset> <length>
+
+with the block's position in the segment, in bytes. Searches read the
+indices and decompress only the blocks that overlap the requested time
+range.
+
+Each stored line is "<timestamp> <stream> <text>", with the timestamp in
+seconds since the epoch.
+"""
+
+# This file conforms to the external style guide.
+# pylint: disable=bad-indentation, g-bad-import-order
+
+import heapq
+import os
+import threading
+import time
+import zlib
+
+import log_stream
+
+# The number of uncompressed bytes in a block.
+BLOCK_SIZE = 64 * 1024
+
+# The number of compressed bytes at which a segment is rotated.
+DEFAULT_SEGMENT_SIZE = 8 * 1024 * 1024
+
+# The number of segments to keep per container.
+DEFAULT_MAX_SEGMENTS = 64
+
+# The longest time that a line may stay in memory before being written,
+# in seconds, as long as flush_stale is called.
+FLUSH_INTERVAL = 5
+
+_SEGMENT_SUFFIX = '.log.gz'
+_INDEX_SUFFIX = '.idx'
+
+# wbits for zlib to read and write the gzip format.
+_GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+
+def _segment_numbers(directory):
+    """List the numbers of the segments in a container's directory."""
+    return sorted(int(name[:-len(_SEGMENT_SUFFIX)])
+                  for name in os.listdir(directory)
+                  if name.endswith(_SEGMENT_SUFFIX) and
+                  name[:-len(_SEGMENT_SUFFIX)].isdigit())
+
+
+def _segment_path(directory, number):
+    return os.path.join(directory, '{0:06d}{1}'.format(number,
+                                                       _SEGMENT_SUFFIX))
+
+
+def _index_path(directory, number):
+    return os.path.join(directory, '{0:06d}{1}'.format(number,
+                                                       _INDEX_SUFFIX))
+
+
+class _ContainerLog(object):
+    """Write the segments of a single container."""
+
+    def __init__(self, directory, segment_size, max_segments):
+        self._directory = directory
+        self._segment_size = segment_size
+        self._max_segments = max_segments
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        # Continue after the segments of a previous run.
+        numbers = _segment_numbers(directory)
+        self._number = numbers[-1] + 1 if numbers else 0
+
+        self._lines = []
+        self._size = 0
+        self._first = None
+        self._last = None
+
+        # (float) When the oldest line in the block was added.
+        self._added = None
+
+    def write(self, log_line):
+        line = '{0:.9f} {1} {2}\n'.format(log_line.timestamp,
+                                          log_line.stream, log_line.text)
+        if self._first is None:
+            self._first = log_line.timestamp
+            self._added = time.time()
+        if self._last is None or log_line.timestamp > self._last:
+            self._last = log_line.timestamp
+        self._lines.append(line)
+        self._size += len(line)
+        if self._size >= BLOCK_SIZE:
+            self.flush()
+
+    def flush_stale(self):
+        if self._added is not None and (
+            time.time() - self._added >= FLUSH_INTERVAL):
+            self.flush()
+
+    def flush(self):
+        """Compress the pending lines, and append them to the segment."""
+        if not self._lines:
+            return
+        compressor = zlib.compressobj(6, zlib.DEFLATED, _GZIP_WBITS)
+        block = compressor.compress(''.join(self._lines)) + compressor.flush()
+
+        segment = _segment_path(self._directory, self._number)
+        with open(segment, 'ab') as segment_file:
+            offset = segment_file.tell()
+            segment_file.write(block)
+        with open(_index_path(self._directory, self._number),
+                  'a') as index_file:
+            index_file.write('{0:.9f} {1:.9f} {2} {3}\n'.format(
+                self._first, self._last, offset, len(block)))
+
+        self._lines = []
+        self._size = 0
+        self._first = self._last = self._added = None
+        if offset + len(block) >= self._segment_size:
+            self._rotate()
+
+    def _rotate(self):
+        self._number += 1
+
+        # Make room for the new segment.
+        numbers = _segment_numbers(self._directory)
+        for number in numbers[:max(len(numbers) + 1 - self._max_segments,
+                                   0)]:
+            for path in (_segment_path(self._directory, number),
+                         _index_path(self._directory, number)):
+                if os.path.exists(path):
+                    os.remove(path)
+
+
+class LogStore(object):
+    """Store lines of container output in rotated, compressed segments."""
+
+    def __init__(self, directory, segment_size=DEFAULT_SEGMENT_SIZE,
+                 max_segments=DEFAULT_MAX_SEGMENTS):
+        """Initializer for LogStore.
+
+        Args:
+            directory: (basestring) The directory to store output in. Each
+                container gets a subdirectory.
+            segment_size: (int) The size in bytes at which a segment is
+                rotated.
+            max_segments: (int) The number of segments to keep per
+                container. Older ones are deleted.
+        """
+        self.directory = directory
+        self._segment_size = segment_size
+        self._max_segments = max_segments
+        self._logs = {}
+        self._lock = threading.Lock()
+
+    def write(self, log_line):
+        """Store a line.
+
+        The line is written to disk once its block is full, or when it's
+        flushed.
+
+        Args:
+            log_line: (log_stream.LogLine) The line.
+        """
+        with self._lock:
+            log = self._logs.get(log_line.container)
+            if not log:
+                log = self._logs[log_line.container] = _ContainerLog(
+                    os.path.join(self.directory, log_line.container),
+                    self._segment_size, self._max_segments)
+            log.write(log_line)
+
+    def flush_stale(self):
+        """Write lines that have waited longer than FLUSH_INTERVAL."""
+        with self._lock:
+            for log in self._logs.itervalues():
+                log.flush_stale()
+
+    def flush(self):
+        """Write all pending lines."""
+        with self._lock:
+            for log in self._logs.itervalues():
+                log.flush()
+
+
+def list_containers(directory):
+    """List the containers that have output in a store.
+
+    Args:
+        directory: (basestring) The directory of the store.
+
+    Returns:
+        ([basestring, ...]) The names of the containers, sorted.
+    """
+    if not os.path.isdir(directory):
+        return []
+    return sorted(name for name in os.listdir(directory)
+                  if os.path.isdir(os.path.join(directory, name)))
+
+
+def _read_index(directory, number):
+    blocks = []
+    try:
+        with open(_index_path(directory, number)) as index_file:
+            for line in index_file:
+                fields = line.split()
+                if len(fields) == 4:
+                    blocks.append((float(fields[0]), float(fields[1]),
+                                   int(fields[2]), int(fields[3])))
+    except IOError:
+        pass
+    return blocks
+
+
+def _search_container(directory, name, since, until, pattern):
+    for number in _segment_numbers(directory):
+        blocks = [block for block in _read_index(directory, number)
+                  if (since is None or block[1] >= since) and
+                  (until is None or block[0] <= until)]
+        if not blocks:
+            continue
+        try:
+            segment_file = open(_segment_path(directory, number), 'rb')
+        except IOError:
+            # Deleted by rotation since the directory was listed.
+            continue
+        with segment_file:
+            for _, _, offset, length in blocks:
+                segment_file.seek(offset)
+                data = zlib.decompress(segment_file.read(length),
+                                       _GZIP_WBITS)
+                # Lines end with '\n' only. Their text may hold other line
+                # breaks, such as the '\r' of progress output.
+                for line in data.split('\n'):
+                    try:
+                        stamp, stream, text = line.split(' ', 2)
+                        timestamp = float(stamp)
+                    except ValueError:
+                        continue
+                    if since is not None and timestamp < since:
+                        continue
+                    if until is not None and timestamp > until:
+                        continue
+                    if pattern and not pattern.search(text):
+                        continue
+                    yield log_stream.LogLine(name, stream, timestamp, text)
+
+
+def search(directory, containers=None, since=None, until=None,
+           pattern=None):
+    """Search the output in a store.
+
+    Args:
+        directory: (basestring) The directory of the store.
+        containers: ([basestring, ...] or None) The containers to search.
+            Defaults to all of them.
+        since: (float or None) If present, only return lines from this
+            time on, in seconds since the epoch.
+        until: (float or None) If present, only return lines up to this
+            time.
+        pattern: (re.RegexObject or None) If present, only return lines
+            whose text matches it.
+
+    Yields:
+        (log_stream.LogLine) The matching lines of all containers, in the
+        order of their timestamps.
+    """
+    names = containers or list_containers(directory)
+    results = [((line.timestamp, line) for line in _search_container(
+        os.path.join(directory, name), name, since, until, pattern))
+               for name in names
+               if os.path.isdir(os.path.join(directory, name))]
+    for _, line in heapq.merge(*results):
+        yield line
+
+
+def find_latest(directory):
+    """Find the most recent store in a directory of stores.
+
+    Args:
+        directory: (basestring) A directory of stores with timestamped
+            names, such as constants.OUTPUT_DIR.
+
+    Returns:
+        (basestring or None) The path to the store that was modified last,
+        or None if there is none.
+    """
+    if not os.path.isdir(directory):
+        return None
+    paths = [os.path.join(directory, name) for name in os.listdir(directory)]
+    paths = [path for path in paths if os.path.isdir(path)]
+    if not paths:
+        return None
+    return max(paths, key=os.path.getmtime)
+
+
+def format_line(log_line):
+    """Format a line for display.
+
+    Args:
+        log_line: (log_stream.LogLine) The line.
+
+    Returns:
+        (basestring) The line, with its local time, container and stream.
+    """
+    return '{0}.{1:03d} {2} {3}: {4}'.format(
+        time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(log_line.timestamp)),
+        int(log_line.timestamp % 1 * 1000), log_line.container,
+        log_line.stream, log_line.text)
@@ -0,0 +1,448 @@
+# Copyright 2015 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Follow the logs of several containers from a single thread.
+
+A LogMultiplexer keeps one connection to the docker daemon per container,
+following the container's logs, and waits on all of them at once with
+select. The response bodies are parsed incrementally: HTTP chunks are
+decoded, docker's stdout/stderr frames are split apart and every complete
+line is put on a bounded queue. When the queue is full, the multiplexer
+stops reading until there's room, which in turn makes the daemon wait.
+
+Lines are requested with their timestamps. If a connection is closed while
+its container is still running, it's reopened with the "since" parameter,
+and lines that were already seen are skipped, so nothing is emitted twice.
+"""
+
+# This file conforms to the external style guide.
+# pylint: disable=bad-indentation, g-bad-import-order
+
+import calendar
+import collections
+import errno
+import Queue
+import select
+import socket
+import struct
+import threading
+import time
+import urllib
+import urlparse
+
+import docker
+import requests
+
+from ..utils import get_logger
+
+# The number of lines that can wait in the queue for a consumer.
+DEFAULT_QUEUE_SIZE = 10000
+
+# How much to read from a connection at once, in bytes.
+READ_SIZE = 64 * 1024
+
+# How long to wait for any connection to become readable before checking
+# whether the multiplexer was stopped, in seconds.
+POLL_INTERVAL = 0.5
+
+# The minimum time between two connections to the same container, in
+# seconds.
+RECONNECT_DELAY = 1
+
+# Size of the header of each frame in docker's multiplexed output.
+_FRAME_HEADER_SIZE = 8
+
+# Names of the stream types in frame headers.
+_STREAMS = {0: 'stdin', 1: 'stdout', 2: 'stderr'}
+
+# A single line of a container's output. The timestamp is in seconds since
+# the epoch, as recorded by the docker daemon.
+LogLine = collections.namedtuple('LogLine', ['container', 'stream',
+                                             'timestamp', 'text'])
+
+
+def _open_connection(dclient, url):
+    """Open a new connection to the docker daemon.
+
+    The connection is made with the docker client's own transport, so unix
+    sockets and TLS work the same way they do for the client.
+
+    Args:
+        dclient: (docker.Client) The docker client.
+        url: (basestring) A url on the docker daemon.
+
+    Returns:
+        (socket.socket) The connected socket.
+    """
+    conn = dclient.get_adapter(url).get_connection(url)._new_conn()
+    conn.connect()
+    return conn.sock
+
+
+class _Follower(object):
+    """The state of the logs connection of a single container."""
+
+    def __init__(self, cont, name):
+        self.cont = cont
+        self.name = name
+        self.sock = None
+        self.tty = False
+
+        # ((int, int) or None) The seconds and nanoseconds of the latest
+        # line that was put on the queue.
+        self.last_seen = None
+
+        # ((int, int) or None) Right after the connection is reopened,
+        # lines up to this time were seen already and are skipped. Until
+        # then, stdout and stderr lines that share a timestamp or arrive
+        # slightly out of order are all kept.
+        self.resume_after = None
+
+        # (float) The earliest time at which to connect again.
+        self.retry_at = 0
+
+        # The response parser's state. While headers is not None, the
+        # response headers are still being read.
+        self.headers = None
+        self.chunked = False
+        self.chunk_left = 0
+        self.raw = bytearray()
+        self.frames = bytearray()
+
+        # {basestring: bytearray} Incomplete lines, by stream.
+        self.partial = {}
+
+        # (basestring) The most recent timestamp prefix, and its value in
+        # seconds since the epoch. Consecutive lines often share it.
+        self.ts_prefix = None
+        self.ts_seconds = 0
+
+    def reset(self):
+        self.headers = bytearray()
+        self.chunked = False
+        self.chunk_left = 0
+        del self.raw[:]
+        del self.frames[:]
+        self.partial = {}
+
+
+class LogMultiplexer(object):
+    """Follow the logs of containers, and queue their lines."""
+
+    def __init__(self, dclient, queue_size=DEFAULT_QUEUE_SIZE):
+        """Initializer for LogMultiplexer.
+
+        Args:
+            dclient: (docker.Client) The docker client to get logs from.
+            queue_size: (int) The maximum number of lines in the queue.
+        """
+        self._dclient = dclient
+
+        # (Queue.Queue) The lines of all containers, in the order they
+        # were read.
+        self.queue = Queue.Queue(queue_size)
+
+        self._followers = []
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._buf = bytearray(READ_SIZE)
+
+    def follow(self, cont, name=None, since=None):
+        """Start following the logs of a container.
+
+        A container that is followed already isn't followed twice. Its
+        connection is reopened when it closes, as long as the container is
+        running, so a restarted container can be followed again safely.
+
+        Args:
+            cont: (container.Container) The container.
+            name: (basestring or None) The name to give its lines.
+                Defaults to the container's name.
+            since: (float or None) If present, skip lines from before this
+                time, in seconds since the epoch.
+        """
+        follower = _Follower(cont, name or cont.name)
+        if since is not None:
+            follower.last_seen = follower.resume_after = (int(since), 0)
+        with self._lock:
+            if any(f.cont is cont for f in self._followers):
+                return
+            self._followers.append(follower)
+        if not self._thread:
+            self._thread = threading.Thread(target=self._run,
+                                            name='log-multiplexer')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def stop(self, timeout=None):
+        """Stop following logs, and close all connections.
+
+        Lines that are already in the queue can still be consumed.
+
+        Args:
+            timeout: (float or None) How long to wait for the multiplexer's
+                thread to finish, in seconds.
+        """
+        self._stopped.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def lines(self, on_idle=None):
+        """Consume lines from the queue.
+
+        Args:
+            on_idle: (callable or None) If present, called whenever no line
+                arrives for POLL_INTERVAL seconds.
+
+        Yields:
+            (LogLine) Each line, until the multiplexer is stopped and the
+            queue is empty.
+        """
+        while True:
+            try:
+                yield self.queue.get(timeout=POLL_INTERVAL)
+            except Queue.Empty:
+                if self._stopped.is_set():
+                    return
+                if on_idle:
+                    on_idle()
+
+    def _run(self):
+        try:
+            while not self._stopped.is_set():
+                with self._lock:
+                    followers = list(self._followers)
+                now = time.time()
+                for follower in followers:
+                    if not follower.sock and now >= follower.retry_at:
+                        self._connect(follower)
+                ready = {f.sock: f for f in followers if f.sock}
+                if not ready:
+                    self._stopped.wait(POLL_INTERVAL)
+                    continue
+                try:
+                    readable, _, _ = select.select(ready.keys(), [], [],
+                                                   POLL_INTERVAL)
+                except select.error as err:
+                    if err.args[0] == errno.EINTR:
+                        continue
+                    raise
+                for sock in readable:
+                    self._read(ready[sock])
+        finally:
+            with self._lock:
+                for follower in self._followers:
+                    self._disconnect(follower)
+
+    def _drop(self, follower):
+        self._disconnect(follower)
+        with self._lock:
+            if follower in self._followers:
+                self._followers.remove(follower)
+
+    def _connect(self, follower):
+        cont_id = follower.cont.get_id()
+        if not cont_id:
+            self._drop(follower)
+            return
+        follower.retry_at = time.time() + RECONNECT_DELAY
+        params = {'stdout': 1, 'stderr': 1, 'follow': 1, 'timestamps': 1}
+        if follower.last_seen:
+            params['since'] = follower.last_seen[0]
+            follower.resume_after = follower.last_seen
+        try:
+            follower.tty = bool(self._dclient.inspect_container(
+                cont_id).get('Config', {}).get('Tty'))
+            url = self._dclient._url(  # pylint: disable=protected-access
+                '/containers/{0}/logs', cont_id)
+            sock = _open_connection(self._dclient, url)
+            parsed = urlparse.urlparse(url)
+            sock.sendall('GET {0}?{1} HTTP/1.1\r\nHost: {2}\r\n\r\n'.format(
+                parsed.path, urllib.urlencode(sorted(params.items())),
+                parsed.netloc or 'localhost'))
+        except (docker.errors.APIError, docker.errors.NullResource,
+                requests.exceptions.RequestException, socket.error) as err:
+            get_logger().debug('Stopped following logs of %s: %s',
+                               follower.name, err)
+            self._drop(follower)
+            return
+        follower.sock = sock
+        follower.reset()
+
+    @staticmethod
+    def _disconnect(follower):
+        if follower.sock:
+            try:
+                follower.sock.close()
+            except socket.error:
+                pass
+            follower.sock = None
+
+    def _read(self, follower):
+        """Read what's available on a follower's connection."""
+        while True:
+            try:
+                size = follower.sock.recv_into(self._buf)
+            except socket.timeout:
+                return
+            except socket.error as err:
+                if err.args[0] in (errno.EAGAIN, errno.EINTR):
+                    return
+                size = 0
+            if not size or not self._feed(follower,
+                                          memoryview(self._buf)[:size]):
+                self._closed(follower)
+                return
+
+            # TLS sockets may hold decrypted data that select doesn't see.
+            pending = getattr(follower.sock, 'pending', None)
+            if not pending or not pending():
+                return
+
+    def _closed(self, follower):
+        """Handle the end of a follower's response."""
+        self._disconnect(follower)
+        try:
+            running = follower.cont.running()
+        except (docker.errors.APIError, docker.errors.NullResource,
+                requests.exceptions.RequestException):
+            running = False
+        if not running:
+            self._drop(follower)
+
+    def _feed(self, follower, data):
+        """Parse data from a follower's connection.
+
+        Args:
+            follower: (_Follower) The follower.
+            data: (memoryview) The data that was read.
+
+        Returns:
+            (bool) False if the response is over.
+        """
+        if follower.headers is not None:
+            follower.headers += data
+            end = follower.headers.find('\r\n\r\n')
+            if end < 0:
+                return True
+            head = str(follower.headers[:end]).split('\r\n')
+            body = follower.headers[end + 4:]
+            follower.headers = None
+            status = head[0].split()
+            if len(status) < 2 or status[1] != '200':
+                get_logger().debug('Could not follow logs of %s: %s',
+                                   follower.name, head[0])
+                return False
+            follower.chunked = 'transfer-encoding: chunked' in (
+                line.lower() for line in head)
+            data = memoryview(body)
+
+        if not follower.chunked:
+            follower.frames += data
+            return self._split_frames(follower)
+
+        follower.raw += data
+        raw = follower.raw
+        pos = 0
+        while pos < len(raw):
+            if follower.chunk_left:
+                take = min(follower.chunk_left, len(raw) - pos)
+                follower.frames += memoryview(raw)[pos:pos + take]
+                follower.chunk_left -= take
+                pos += take
+                continue
+            end = raw.find('\r\n', pos)
+            if end < 0:
+                break
+            size_line = str(raw[pos:end]).split(';')[0].strip()
+            pos = end + 2
+            if not size_line:
+                # The line break that ends the previous chunk.
+                continue
+            follower.chunk_left = int(size_line, 16)
+            if not follower.chunk_left:
+                del raw[:]
+                self._split_frames(follower)
+                return False
+        del raw[:pos]
+        return self._split_frames(follower)
+
+    def _split_frames(self, follower):
+        frames = follower.frames
+        if follower.tty:
+            self._split_lines(follower, 'stdout', memoryview(frames))
+            del frames[:]
+            return True
+        pos = 0
+        while len(frames) - pos >= _FRAME_HEADER_SIZE:
+            stream_type, length = struct.unpack_from('>BxxxL', frames, pos)
+            start = pos + _FRAME_HEADER_SIZE
+            if len(frames) - start < length:
+                break
+            self._split_lines(follower, _STREAMS.get(stream_type, 'stdout'),
+                              memoryview(frames)[start:start + length])
+            pos = start + length
+        del frames[:pos]
+        return True
+
+    def _split_lines(self, follower, stream, payload):
+        partial = follower.partial.setdefault(stream, bytearray())
+        partial += payload
+        start = 0
+        while True:
+            end = partial.find('\n', start)
+            if end < 0:
+                break
+            self._emit(follower, stream, str(partial[start:end]))
+            start = end + 1
+        del partial[:start]
+
+    def _parse_timestamp(self, follower, stamp):
+        """Parse an RFC 3339 timestamp, as written by the docker daemon.
+
+        Returns:
+            ((int, int) or None) The seconds since the epoch and the
+            nanoseconds.
+        """
+        prefix = stamp[:19]
+        if prefix != follower.ts_prefix:
+            try:
+                follower.ts_seconds = calendar.timegm(
+                    time.strptime(prefix, '%Y-%m-%dT%H:%M:%S'))
+            except ValueError:
+                return None
+            follower.ts_prefix = prefix
+        fraction = stamp[20:].rstrip('Z') if stamp[19:20] == '.' else ''
+        return follower.ts_seconds, int((fraction + '000000000')[:9] or 0)
+
+    def _emit(self, follower, stream, line):
+        stamp, _, text = line.partition(' ')
+        key = self._parse_timestamp(follower, stamp)
+        if key is None:
+            key, text = follower.last_seen or (0, 0), line
+        elif follower.resume_after:
+            if key <= follower.resume_after:
+                # Already seen before the connection was reopened.
+                return
+            follower.resume_after = None
+        follower.last_seen = max(follower.last_seen, key)
+        log_line = LogLine(follower.name, stream, key[0] + key[1] / 1e9,
+                           text.rstrip('\r'))
+        while not self._stopped.is_set():
+            try:
+                self.queue.put(log_line, timeout=POLL_INTERVAL)
+                return
+            except Queue.Full:
+                pass
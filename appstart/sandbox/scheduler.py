@@ -0,0 +1,181 @@
+# Copyright 2015 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Run interdependent startup phases concurrently.
+
+The ContainerSandbox brings up several images and containers, only some of
+which depend on each other. The PhaseScheduler runs every phase as soon as
+the phases it depends on have finished, and records how long each one took.
+"""
+
+# This file conforms to the external style guide.
+# pylint: disable=bad-indentation, g-bad-import-order
+
+import sys
+import threading
+import time
+
+from ..utils import get_logger
+
+# Default maximum number of phases that may run at the same time.
+DEFAULT_MAX_WORKERS = 4
+
+# How often (in seconds) the scheduler wakes up while waiting for phases.
+# Waiting without a timeout would make the main thread deaf to SIGINT.
+_POLL_INTERVAL = 0.1
+
+
+class PhaseScheduler(object):
+    """Runs a graph of phases on a bounded number of threads.
+
+    Phases are added with add_phase and executed with run. A phase starts as
+    soon as all of its dependencies have completed. If a phase raises, no
+    new phases are started, the phases already running are allowed to
+    finish, and the first error is re-raised from run.
+    """
+
+    def __init__(self, max_workers=DEFAULT_MAX_WORKERS):
+        """Initializer for PhaseScheduler.
+
+        Args:
+            max_workers: (int) The maximum number of phases to run
+                concurrently.
+        """
+        self.max_workers = max_workers
+
+        # [basestring, ...] Phase names, in the order they were added.
+        self._order = []
+
+        # {basestring: (callable, set)} Phase functions and dependencies.
+        self._phases = {}
+
+        # {basestring: object} Return values of completed phases.
+        self.results = {}
+
+        # {basestring: (float, float)} Start and end times of phases.
+        self.timings = {}
+
+        self._condition = threading.Condition()
+        self._running = set()
+        self._done = set()
+        self._error = None
+        self._start_time = None
+        self._end_time = None
+
+    def add_phase(self, name, func, dependencies=()):
+        """Add a phase to the schedule.
+
+        Args:
+            name: (basestring) A unique name for the phase.
+            func: (callable) A function taking no arguments. Its return
+                value is stored in self.results under the phase's name.
+            dependencies: ([basestring, ...]) Names of phases that must
+                complete before this one starts. They must already have
+                been added, which rules out cycles.
+
+        Raises:
+            ValueError: If the name is taken or a dependency is unknown.
+        """
+        if name in self._phases:
+            raise ValueError('Phase {0} was added twice.'.format(name))
+        for dep in dependencies:
+            if dep not in self._phases:
+                raise ValueError('Phase {0} depends on unknown phase '
+                                 '{1}.'.format(name, dep))
+        self._order.append(name)
+        self._phases[name] = (func, set(dependencies))
+
+    def run(self):
+        """Run all phases, blocking until they have completed.
+
+        Raises:
+            Exception: The first exception raised by a phase. KeyboardInterrupt
+                is re-raised after all running phases have finished.
+        """
+        self._start_time = time.time()
+        try:
+            with self._condition:
+                while len(self._done) < len(self._order):
+                    if self._error:
+                        break
+                    self._start_ready_phases()
+                    self._condition.wait(_POLL_INTERVAL)
+        except KeyboardInterrupt:
+            with self._condition:
+                self._error = self._error or sys.exc_info()
+        finally:
+            self._wait_for_running_phases()
+            self._end_time = time.time()
+
+        if self._error:
+            # pylint: disable=unpacking-non-sequence
+            etype, value, traceback = self._error
+            raise etype, value, traceback
+
+    def _start_ready_phases(self):
+        """Start every phase whose dependencies are done. Must hold the lock."""
+        for name in self._order:
+            if len(self._running) >= self.max_workers:
+                return
+            if name in self._done or name in self._running:
+                continue
+            func, dependencies = self._phases[name]
+            if dependencies <= self._done:
+                self._running.add(name)
+                thread = threading.Thread(target=self._run_phase,
+                                          args=(name, func),
+                                          name='phase-{0}'.format(name))
+                thread.daemon = True
+                thread.start()
+
+    def _run_phase(self, name, func):
+        start = time.time()
+        result = error = None
+        try:
+            result = func()
+        except BaseException:  # pylint: disable=broad-except
+            error = sys.exc_info()
+
+        with self._condition:
+            self.timings[name] = (start, time.time())
+            self._running.discard(name)
+            if error:
+                self._error = self._error or error
+            else:
+                self.results[name] = result
+                self._done.add(name)
+            self._condition.notify_all()
+
+    def _wait_for_running_phases(self):
+        """Block until no phases are running anymore."""
+        with self._condition:
+            while self._running:
+                self._condition.wait(_POLL_INTERVAL)
+
+    def log_timings(self):
+        """Log how long each phase took, as well as the total wall time."""
+        if self._start_time is None or self._end_time is None:
+            return
+        get_logger().info('  STARTUP PHASES  '.center(80, '-'))
+        for name in sorted(self.timings, key=lambda n: self.timings[n][0]):
+            start, end = self.timings[name]
+            get_logger().info('{0: <30} started at +{1:.2f}s, took '
+                              '{2:.2f}s'.format(name,
+                                                start - self._start_time,
+                                                end - start))
+        busy = sum(end - start for start, end in self.timings.values())
+        get_logger().info('Total: {0:.2f}s wall time, {1:.2f}s of '
+                          'work'.format(self._end_time - self._start_time,
+                                        busy))
+        get_logger().info('-' * 80)
@@ -0,0 +1,304 @@
+# Copyright 2015 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Sample the resource usage of the sandbox's containers.
+
+The docker daemon streams resource usage statistics for a container about
+once a second. A StatsCollector follows these streams in the background and
+keeps a sample every so often, in a fixed-size SampleBuffer per container.
+"""
+
+# This file conforms to the external style guide.
+# pylint: disable=bad-indentation, g-bad-import-order
+
+import array
+import collections
+import threading
+import time
+
+from ..utils import get_logger
+
+# How often to keep a sample, in seconds.
+DEFAULT_INTERVAL = 5
+
+# How many samples to keep per container. At the default interval, that's
+# an hour's worth.
+DEFAULT_CAPACITY = 720
+
+# A single measurement of a container's resource usage. Byte counts for the
+# network and the disk are totals since the container started.
+Sample = collections.namedtuple('Sample', ['time',
+                                           'cpu_percent',
+                                           'memory_usage',
+                                           'memory_limit',
+                                           'rx_bytes',
+                                           'tx_bytes',
+                                           'read_bytes',
+                                           'write_bytes'])
+
+
+class SampleBuffer(object):
+    """A ring buffer of samples.
+
+    Each field is kept in an array of doubles, rather than as a list of
+    tuples, so that long runs don't take much memory.
+    """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        """Initializer for SampleBuffer.
+
+        Args:
+            capacity: (int) The number of samples to keep. Once the buffer
+                is full, the oldest samples are overwritten.
+        """
+        self.capacity = capacity
+        self._fields = [array.array('d', [0.0] * capacity)
+                        for _ in Sample._fields]
+
+        # The index that the next sample is written to.
+        self._next = 0
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._size
+
+    def append(self, sample):
+        """Add a sample, overwriting the oldest one if the buffer is full.
+
+        Args:
+            sample: (Sample) The sample to add.
+        """
+        with self._lock:
+            for values, value in zip(self._fields, sample):
+                values[self._next] = value
+            self._next = (self._next + 1) % self.capacity
+            self._size = min(self._size + 1, self.capacity)
+
+    def samples(self, since=None):
+        """Return the samples in the buffer, oldest first.
+
+        Args:
+            since: (float or None) If present, only return samples taken
+                at this time or later, in seconds since the epoch.
+
+        Returns:
+            ([Sample, ...]) The samples.
+        """
+        with self._lock:
+            start = (self._next - self._size) % self.capacity
+            indices = [(start + i) % self.capacity
+                       for i in range(self._size)]
+            samples = [Sample(*[values[i] for values in self._fields])
+                       for i in indices]
+        if since is not None:
+            samples = [s for s in samples if s.time >= since]
+        return samples
+
+
+def _cpu_totals(stats):
+    cpu = stats.get('cpu_stats') or {}
+    usage = cpu.get('cpu_usage') or {}
+    return (usage.get('total_usage', 0), cpu.get('system_cpu_usage', 0),
+            len(usage.get('percpu_usage') or []) or 1)
+
+
+def make_sample(stats, previous=None, now=None):
+    """Make a sample out of a stats object from the docker daemon.
+
+    Args:
+        stats: (dict) The decoded stats object.
+        previous: (dict or None) The stats object before it, to measure
+            CPU usage against. If None, the daemon's own previous
+            measurement is used, if it sent one.
+        now: (float or None) The time of the sample. Defaults to now.
+
+    Returns:
+        (Sample) The sample.
+    """
+    total, system, cpus = _cpu_totals(stats)
+    if previous is not None:
+        prev_total, prev_system, _ = _cpu_totals(previous)
+    else:
+        prev_total, prev_system, _ = _cpu_totals(
+            {'cpu_stats': stats.get('precpu_stats')})
+    cpu_percent = 0.0
+    if system > prev_system and total >= prev_total:
+        cpu_percent = (float(total - prev_total) / (system - prev_system) *
+                       cpus * 100)
+
+    memory = stats.get('memory_stats') or {}
+
+    # Docker 1.9 reports each network interface separately.
+    networks = stats.get('networks') or {'': stats.get('network') or {}}
+    rx_bytes = sum(n.get('rx_bytes', 0) for n in networks.itervalues())
+    tx_bytes = sum(n.get('tx_bytes', 0) for n in networks.itervalues())
+
+    io_bytes = {'Read': 0, 'Write': 0}
+    blkio = stats.get('blkio_stats') or {}
+    for entry in blkio.get('io_service_bytes_recursive') or []:
+        if entry.get('op') in io_bytes:
+            io_bytes[entry['op']] += entry.get('value', 0)
+
+    return Sample(time=now or time.time(),
+                  cpu_percent=cpu_percent,
+                  memory_usage=memory.get('usage', 0),
+                  memory_limit=memory.get('limit', 0),
+                  rx_bytes=rx_bytes,
+                  tx_bytes=tx_bytes,
+                  read_bytes=io_bytes['Read'],
+                  write_bytes=io_bytes['Write'])
+
+
+def _megabytes(num_bytes):
+    return num_bytes / float(1 << 20)
+
+
+class StatsCollector(object):
+    """Sample the resource usage of containers in the background."""
+
+    def __init__(self, dclient, containers, interval=DEFAULT_INTERVAL,
+                 capacity=DEFAULT_CAPACITY):
+        """Initializer for StatsCollector.
+
+        Args:
+            dclient: (docker.Client) The docker client to get stats from.
+            containers: ({basestring: Container}) The containers to sample,
+                keyed by a name for reports, such as "app".
+            interval: (float) How often to keep a sample, in seconds.
+            capacity: (int) The number of samples to keep per container.
+        """
+        self._dclient = dclient
+        self._containers = containers
+        self.interval = interval
+        self._stopped = threading.Event()
+
+        # {basestring: SampleBuffer} The samples of each container.
+        self.buffers = {name: SampleBuffer(capacity) for name in containers}
+
+        # {basestring: int} How many times each container was followed.
+        # Only the most recent thread of a container keeps its samples.
+        self._generations = dict.fromkeys(containers, 0)
+
+    def start(self):
+        """Start sampling, with one background thread per container."""
+        for name in self._containers:
+            self.restart(name)
+
+    def restart(self, name):
+        """Start sampling a container again, such as after it restarted.
+
+        Docker ends the stats stream of a container that stops, so a
+        restarted container needs a new one.
+
+        Args:
+            name: (basestring) The name of the container, as given to the
+                initializer.
+        """
+        self._generations[name] += 1
+        thread = threading.Thread(
+            target=self._follow,
+            args=(name, self._containers[name].get_id(),
+                  self._generations[name]),
+            name='stats-{0}'.format(name))
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        """Stop sampling.
+
+        The background threads exit when the daemon sends its next
+        stats object, or when the container is removed.
+        """
+        self._stopped.set()
+
+    def _follow(self, name, cont_id, generation):
+        buf = self.buffers[name]
+        previous = None
+        last_kept = 0
+        try:
+            for stats in self._dclient.stats(cont_id, decode=True):
+                if (self._stopped.is_set() or
+                        self._generations[name] != generation):
+                    return
+                now = time.time()
+                if now - last_kept >= self.interval:
+                    buf.append(make_sample(stats, previous, now))
+                    previous = stats
+                    last_kept = now
+        except Exception as err:  # pylint: disable=broad-except
+            if not self._stopped.is_set():
+                get_logger().debug('Stopped sampling %s: %s', name, err)
+
+    def samples(self, name, since=None):
+        """Return the samples of a container, oldest first.
+
+        Args:
+            name: (basestring) The name of the container, as given to the
+                initializer.
+            since: (float or None) If present, only return samples taken
+                at this time or later, in seconds since the epoch.
+
+        Returns:
+            ([Sample, ...]) The samples.
+        """
+        return self.buffers[name].samples(since)
+
+    def summarize(self, name, since=None):
+        """Summarize the samples of a container.
+
+        Args:
+            name: (basestring) The name of the container.
+            since: (float or None) If present, only consider samples taken
+                at this time or later.
+
+        Returns:
+            ({basestring: float} or None) Average and peak CPU usage in
+            percent, peak and final memory usage and its growth over the
+            samples in megabytes, and network and disk traffic in
+            megabytes. None if there are no samples.
+        """
+        samples = self.samples(name, since)
+        if not samples:
+            return None
+        first, last = samples[0], samples[-1]
+        return {
+            'samples': len(samples),
+            'cpu_average': (sum(s.cpu_percent for s in samples) /
+                            len(samples)),
+            'cpu_peak': max(s.cpu_percent for s in samples),
+            'memory_peak': _megabytes(max(s.memory_usage for s in samples)),
+            'memory_final': _megabytes(last.memory_usage),
+            'memory_growth': _megabytes(last.memory_usage -
+                                        first.memory_usage),
+            'network_rx': _megabytes(last.rx_bytes),
+            'network_tx': _megabytes(last.tx_bytes),
+            'disk_read': _megabytes(last.read_bytes),
+            'disk_write': _megabytes(last.write_bytes)}
+
+    def log_summary(self):
+        """Log a summary of the resource usage of each container."""
+        for name in sorted(self.buffers):
+            summary = self.summarize(name)
+            if not summary:
+                continue
+            get_logger().info(
+                '%s: CPU %.1f%% average, %.1f%% peak; memory %.1fMB peak, '
+                '%.1fMB final (%+.1fMB); network %.1fMB in, %.1fMB out; '
+                'disk %.1fMB read, %.1fMB written', name,
+                summary['cpu_average'], summary['cpu_peak'],
+                summary['memory_peak'], summary['memory_final'],
+                summary['memory_growth'], summary['network_rx'],
+                summary['network_tx'], summary['disk_read'],
+                summary['disk_write'])
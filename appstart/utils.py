@@ -17,18 +17,21 @@
 # This file follows the external style guide.
 # pylint: disable=bad-indentation, g-bad-import-order
 
+import fnmatch
 import logging
-import io
+import hashlib
 import json
 import os
+import posixpath
 import re
 import requests
 import socket
 import ssl
 import sys
 import tarfile
-import tempfile
+import threading
 import yaml
+import zlib
 
 import docker
 
@@ -39,18 +42,43 @@ TIMEOUT_SECS = 60
 # Default docker host if user isn't using boot2docker
 LINUX_DOCKER_HOST = '/var/run/docker.sock'
 
+# Maximum number of pooled HTTP connections kept open to the docker daemon
+POOL_MAXSIZE = 10
+
+# Docker client calls that are safe to repeat after a reconnect
+_RETRYABLE_CALLS = frozenset(['containers', 'copy', 'exec_inspect', 'images',
+                              'info', 'inspect_container', 'inspect_image',
+                              'logs', 'ping', 'version'])
+
+# Characters that make a path component a shell-style pattern
+_GLOB_MAGIC = re.compile('[*?[]')
+
 # Supported docker versions
 DOCKER_API_VERSION = '1.17'
+
+# The docker API version that can copy files into containers. Every
+# supported docker version speaks it.
+ARCHIVE_API_VERSION = '1.20'
 MIN_DOCKER_VERSION = [1, 8, 0]
 MAX_DOCKER_VERSION = [1, 9, 1000]
 
 # Logger that is shared accross all components of appstart
 _logger = None
 
+# Docker clients, keyed by connection parameters. See get_docker_client.
+_docker_clients = {}
+_docker_clients_lock = threading.Lock()
+
 # Logging format
 FMT = '[%(levelname).1s: %(asctime)s] %(message)s'
 DATE_FMT = '%H:%M:%S'
 
+# Size of the chunks in which files are read when hashing or streaming them
+CHUNK_SIZE = 1 << 16
+
+# Modification time given to every member of a tar build context
+TAR_MTIME = 0
+
 INT_RX = re.compile(r'\d+')
 
 
@@ -124,23 +152,92 @@ def check_docker_version(dclient):
                                             format_version(MAX_DOCKER_VERSION),
                                             format_version(server_version)))
 
-# TODO(mmuller): "ClientWrapper" is a pretty horrible kludge.  Rewrite it so
-# that it doesn't indiscriminately reconnect every time an attribute is
-# accessed.
-
-
 class ClientWrapper(object):
+    """A persistent, thread-safe proxy around docker.Client.
+
+    The underlying docker.Client (and with it, the HTTP connection pool and
+    any TLS session) is created on first use and shared by every caller,
+    including the log streaming threads. If the connection to the daemon
+    breaks, the client is discarded and rebuilt, and read-only calls are
+    retried once on the fresh client.
+    """
 
     def __init__(self, **params):
         self.__params = params
+        self.__client = None
+        self.__lock = threading.Lock()
+
+    def _get_client(self):
+        """Return the underlying docker.Client, creating it if necessary."""
+        with self.__lock:
+            if self.__client is None:
+                self.__client = docker.Client(**self.__params)
+                _bound_connection_pools(self.__client)
+            return self.__client
+
+    def reset(self):
+        """Drop the underlying client so that the next call reconnects."""
+        with self.__lock:
+            client, self.__client = self.__client, None
+        if client is not None and hasattr(client, 'close'):
+            try:
+                client.close()
+            except Exception:  # pylint: disable=broad-except
+                pass
 
     def __getattr__(self, attrname):
-        return getattr(docker.Client(**self.__params), attrname)
+        attr = getattr(self._get_client(), attrname)
+        if not callable(attr):
+            return attr
+
+        def call_with_reconnect(*args, **kwargs):
+            try:
+                return attr(*args, **kwargs)
+            except requests.exceptions.ConnectionError:
+                self.reset()
+                if attrname not in _RETRYABLE_CALLS:
+                    raise
+                get_logger().debug('Lost connection to the Docker daemon, '
+                                   'reconnecting.')
+                return getattr(self._get_client(), attrname)(*args, **kwargs)
+
+        return call_with_reconnect
+
+
+def _bound_connection_pools(client):
+    """Limit the number of pooled connections kept by a docker.Client.
+
+    Args:
+        client: (docker.Client) The client whose adapters should be
+            reconfigured.
+    """
+    for adapter in getattr(client, 'adapters', {}).values():
+        # The unix socket adapter manages its own pools.
+        if (isinstance(adapter, requests.adapters.HTTPAdapter) and
+                not isinstance(adapter, docker.unixconn.UnixAdapter)):
+            adapter.init_poolmanager(1, POOL_MAXSIZE)
+
+
+def clear_docker_clients():
+    """Forget all cached docker clients."""
+    with _docker_clients_lock:
+        clients = _docker_clients.values()
+        _docker_clients.clear()
+    for client in clients:
+        client.reset()
 
 
-def get_docker_client():
+def get_docker_client(version=DOCKER_API_VERSION):
     """Get the user's docker client.
 
+    Clients are cached per docker host, TLS configuration and API version,
+    so repeated calls share a single connection pool.
+
+    Args:
+        version: (basestring) The docker API version to speak. Only calls
+            that need a newer API than DOCKER_API_VERSION should ask for
+            one.
+
     Raises:
         AppstartAbort: If there was an error in connecting to the
             Docker Daemon.
@@ -153,6 +250,12 @@ def get_docker_client():
     cert_path = os.environ.get('DOCKER_CERT_PATH')
     tls_verify = int(os.environ.get('DOCKER_TLS_VERIFY', 0))
 
+    key = (host, cert_path, tls_verify, version)
+    with _docker_clients_lock:
+        client = _docker_clients.get(key)
+    if client is not None:
+        return client
+
     params = {}
     if host:
         params['base_url'] = (host.replace('tcp://', 'https://')
@@ -186,7 +289,7 @@ def get_docker_client():
             assert_hostname=False)
 
     # pylint: disable=star-args
-    client = ClientWrapper(version=DOCKER_API_VERSION,
+    client = ClientWrapper(version=version,
                            timeout=TIMEOUT_SECS,
                            **params)
     try:
@@ -194,7 +297,9 @@ def get_docker_client():
     except requests.exceptions.ConnectionError as excep:
         raise AppstartAbort('Failed to connect to Docker '
                             'Daemon due to: {0}'.format(excep.message))
-    return client
+
+    with _docker_clients_lock:
+        return _docker_clients.setdefault(key, client)
 
 
 def build_from_directory(dirname, image_name, nocache=False):
@@ -212,8 +317,14 @@ def build_from_directory(dirname, image_name, nocache=False):
         raise AppstartAbort(err.message)
 
 
-def make_tar_build_context(dockerfile, context_files):
-    """Compose tar file for the new devappserver layer's build context.
+def make_tar_build_context(dockerfile, context_files, compress=False):
+    """Compose the tar build context for the new devappserver layer.
+
+    The context is produced lazily, as a generator of tar blocks, so that it
+    can be streamed to the docker daemon (with chunked transfer encoding)
+    without ever being copied to disk or held in memory as a whole. Members
+    are emitted in sorted order with fixed ownership and mtimes, so the same
+    inputs always produce byte-identical archives.
 
     Args:
         dockerfile: (io.BytesIO or file) a file-like object
@@ -221,50 +332,152 @@ def make_tar_build_context(dockerfile, context_files):
         context_files: ({basestring: basestring, ...}) a dictionary
             mapping absolute filepaths to their destination name in
             the tar build context. This is used to specify other files
-            that should be added to the build context.
+            that should be added to the build context. If the destination
+            name is None, the filepath itself is used.
+        compress: (bool) Whether or not to gzip the archive. The docker
+            daemon detects compressed contexts on its own.
 
     Returns:
-        (tempfile.NamedTemporaryFile) a temporary tarfile
-        representing the docker build context.
+        (generator) A generator of strings that together form the tar
+        archive representing the docker build context.
     """
+    blocks = _iter_tar_blocks(dockerfile, context_files)
+    if compress:
+        return _gzip_blocks(blocks)
+    return blocks
 
-    f = tempfile.NamedTemporaryFile()
-    t = tarfile.open(mode='w', fileobj=f)
 
-    # Add dockerfile to top level under the name "Dockerfile"
-    if isinstance(dockerfile, io.BytesIO):
-        dfinfo = tarfile.TarInfo('Dockerfile')
-        dfinfo.size = len(dockerfile.getvalue())
-        dockerfile.seek(0)
-    else:
-        dfinfo = t.gettarinfo(fileobj=dockerfile, arcname='Dockerfile')
-    t.addfile(dfinfo, dockerfile)
+def _make_tar_info(arcname, size, mode):
+    """Make a reproducible TarInfo for a regular file.
 
-    # Open all of the context files and add them to the tarfile.
-    for path in context_files:
-        with open(path) as file_object:
-            file_info = t.gettarinfo(fileobj=file_object,
-                                     arcname=context_files[path])
-            t.addfile(file_info, file_object)
+    Args:
+        arcname: (basestring) The name of the file inside the archive.
+        size: (int) The size of the file, in bytes.
+        mode: (int) The permission bits of the file.
 
-    t.close()
-    f.seek(0)
-    return f
+    Returns:
+        (tarfile.TarInfo) The header for the file.
+    """
+    tinfo = tarfile.TarInfo(arcname)
+    tinfo.size = size
+    tinfo.mode = mode
+    tinfo.mtime = TAR_MTIME
+    tinfo.uid = tinfo.gid = 0
+    tinfo.uname = tinfo.gname = ''
+    return tinfo
+
+
+def _tar_padding(size):
+    """Return the NULs that pad a member of the given size to a full block."""
+    remainder = size % tarfile.BLOCKSIZE
+    if remainder:
+        return tarfile.NUL * (tarfile.BLOCKSIZE - remainder)
+    return ''
+
+
+def _iter_tar_blocks(dockerfile, context_files):
+    """Generate an uncompressed tar archive. See make_tar_build_context."""
+    dockerfile.seek(0)
+    contents = dockerfile.read()
+    yield _make_tar_info('Dockerfile', len(contents), 0644).tobuf()
+    yield contents + _tar_padding(len(contents))
+    total = tarfile.BLOCKSIZE + len(contents) + len(_tar_padding(len(contents)))
+
+    members = sorted(
+        ((context_files[path] or path).replace(os.sep, '/').lstrip('/'), path)
+        for path in context_files)
+    for arcname, path in members:
+        with open(path, 'rb') as file_object:
+            stat = os.fstat(file_object.fileno())
+            mode = 0755 if stat.st_mode & 0111 else 0644
+            header = _make_tar_info(arcname, stat.st_size, mode).tobuf()
+            yield header
+            total += len(header)
+
+            # Read exactly as many bytes as the header announced, even if the
+            # file changes underneath us, to keep the archive well formed.
+            remaining = stat.st_size
+            while remaining:
+                chunk = file_object.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    chunk = tarfile.NUL * min(CHUNK_SIZE, remaining)
+                remaining -= len(chunk)
+                yield chunk
+            padding = _tar_padding(stat.st_size)
+            yield padding
+            total += stat.st_size + len(padding)
+
+    # The archive ends with two empty blocks, and is padded to a full record.
+    total += 2 * tarfile.BLOCKSIZE
+    end = tarfile.NUL * (2 * tarfile.BLOCKSIZE)
+    remainder = total % tarfile.RECORDSIZE
+    if remainder:
+        end += tarfile.NUL * (tarfile.RECORDSIZE - remainder)
+    yield end
+
+
+def _gzip_blocks(blocks):
+    """Gzip a stream of strings, yielding compressed strings."""
+    # A wbits value of 16 + MAX_WBITS makes zlib emit a gzip header and
+    # trailer. The header has no timestamp, which keeps output reproducible.
+    compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED,
+                                  16 + zlib.MAX_WBITS)
+    for block in blocks:
+        compressed = compressor.compress(block)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def hash_build_context(dockerfile, context_files, base_image_id):
+    """Compute a digest identifying the result of a docker build.
 
+    Args:
+        dockerfile: (basestring) The text of the Dockerfile.
+        context_files: ({basestring: basestring, ...}) a dictionary
+            mapping absolute filepaths to their destination name in
+            the tar build context, as passed to make_tar_build_context.
+        base_image_id: (basestring) The ID of the image that the
+            Dockerfile builds from.
+
+    Returns:
+        (basestring) A hex digest of the base image, the Dockerfile, and the
+        names and contents of the context files.
+    """
+    digest = hashlib.sha256()
+    digest.update('base:{0}\0'.format(base_image_id))
+    digest.update('dockerfile:{0}\0'.format(len(dockerfile)))
+    digest.update(dockerfile.encode('utf-8'))
+
+    for path in sorted(context_files):
+        arcname = context_files[path] or path
+        with open(path, 'rb') as file_object:
+            file_object.seek(0, os.SEEK_END)
+            size = file_object.tell()
+            file_object.seek(0)
+            digest.update('file:{0}:{1}\0'.format(arcname, size))
+            for chunk in iter(lambda: file_object.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+
+    return digest.hexdigest()
 
-def add_files_from_static_dirs(file_dict, config_name):
-    """Add all files from static directories specified in the config file.
+
+def get_static_dirs(config_name):
+    """Get the static directories specified in the config file.
 
     Args:
-        file_dict: ({str: NoneType}) A dictionary who's keys are filenames.
         config_name: (str) Name of the config file.
 
     Raises:
         AppstartAbort: An invalid field type was discovered.
+
+    Returns:
+        ([str, ...]) The paths of the static directories.
     """
     config = yaml.load(open(config_name))
     root_dir = os.path.dirname(config_name)
     handlers = config.get('handlers')
+    static_dirs = []
     if handlers and isinstance(handlers, list):
         for handler in handlers:
             if not isinstance(handler, dict):
@@ -275,23 +488,98 @@ def add_files_from_static_dirs(file_dict, config_name):
                 if not isinstance(static_dir, basestring):
                     raise AppstartAbort('"handlers" section of {!r} contains a '
                                         'non-string static_dir.' % config_name)
-                print 'walking %s' % static_dir
-                for dirname, subdirs, files in os.walk(
-                    os.path.join(root_dir, static_dir)):
-                    for filename in files:
-                        file_dict[os.path.join(dirname, filename)] = None
+                static_dirs.append(os.path.join(root_dir, static_dir))
+    return static_dirs
+
+
+def add_files_from_static_dirs(file_dict, config_name):
+    """Add all files from static directories specified in the config file.
+
+    Args:
+        file_dict: ({str: NoneType}) A dictionary who's keys are filenames.
+        config_name: (str) Name of the config file.
+
+    Raises:
+        AppstartAbort: An invalid field type was discovered.
+    """
+    root_dir = os.path.dirname(config_name)
+    for static_dir in get_static_dirs(config_name):
+        print 'walking %s' % os.path.relpath(static_dir, root_dir)
+        for dirname, subdirs, files in os.walk(static_dir):
+            for filename in files:
+                file_dict[os.path.join(dirname, filename)] = None
 
 
 class TarWrapper(object):
     """A convenience wrapper around a tar archive.
 
-    Helps to list contents of directories and read contents of files.
+    Helps to list contents of directories and read contents of files. The
+    archive's members are indexed once, when the wrapper is created, so
+    lookups don't have to scan the whole archive.
     """
 
     def __init__(self, tar_file):
         """Initializer for TarWrapper."""
         self.tarfile = tar_file
 
+        # {basestring: tarfile.TarInfo} Members, keyed by normalized path.
+        # Later entries override earlier ones, like tarfile.getmember.
+        self._members = {}
+
+        # {basestring: [basestring, ...]} Names of the entries directly
+        # inside each directory, in archive order. Directories that have
+        # no member of their own (because the archive only contains the
+        # files inside them) are included as well.
+        self._children = {'': []}
+
+        # Paths that are listed in their parent's children already. Kept
+        # apart from the lists, which would be slow to search for
+        # directories with many entries.
+        registered = set()
+
+        for tinfo in tar_file.getmembers():
+            path = self._normalize(tinfo.name)
+            if not path:
+                continue
+            self._members[path] = tinfo
+            if tinfo.isdir():
+                self._children.setdefault(path, [])
+
+            # Register the path with its parent, then make sure that all
+            # of its ancestors are registered too.
+            while path and path not in registered:
+                registered.add(path)
+                parent, name = posixpath.split(path)
+                self._children.setdefault(parent, []).append(name)
+                path = parent
+
+    @staticmethod
+    def _normalize(path):
+        """Normalize a path to the form used as a key in the index."""
+        path = path.strip('/')
+        if not path:
+            return ''
+        path = posixpath.normpath(path)
+        return '' if path == '.' else path
+
+    def _is_dir(self, path):
+        if path in self._members:
+            return self._members[path].isdir()
+        return path in self._children
+
+    def exists(self, path):
+        """Check whether the archive contains a file or directory at path.
+
+        Args:
+            path: (basestring) The path, relative to the root of the tar
+                archive.
+
+        Returns:
+            (bool) Whether or not path exists in the archive.
+        """
+        path = self._normalize(path)
+        return path in self._members or path in self._children
+
     def list(self, path):
         """Return the contents of dir_path as a list of file/directory names.
 
@@ -311,33 +599,79 @@ class TarWrapper(object):
             The first element of the tuple is a list of files and the second
             a list of directories.
         """
-        tinfo = self.tarfile.getmember(path.lstrip('/'))
-        if not tinfo.isdir():
+        norm_path = self._normalize(path)
+        if not self.exists(norm_path):
+            raise KeyError('"{0}" not found in archive.'.format(path))
+        if not self._is_dir(norm_path):
             raise ValueError('"{0}" is not a directory.'.format(path))
 
-        if not path.endswith('/'):
-            path += '/'
-
         files = []
         dirs = []
+        for name in self._children[norm_path]:
+            child = posixpath.join(norm_path, name)
+            tinfo = self._members.get(child)
+            if tinfo is not None and tinfo.isfile():
+                files.append(name)
+            elif self._is_dir(child):
+                dirs.append(name)
 
-        # Find all files rooted at path.
-        names = [n for n in self.tarfile.getnames() if n.startswith(path)]
+        return files, dirs
 
-        # Calculate the number of components in the path.
-        path_len = len(path.strip(os.sep).split(os.sep))
+    def walk(self, path=''):
+        """Walk the directory tree rooted at path, like os.walk.
 
-        for name in names:
-            # If the name is one component longer, it must be directly inside
-            # the directory specified by path (as opposed to being inside a
-            # hierarchy of subdirectories that begin at path).
-            if len(name.split(os.sep)) - path_len == 1:
-                if self.tarfile.getmember(name).isfile():
-                    files.append(os.path.basename(name))
-                elif self.tarfile.getmember(name).isdir():
-                    dirs.append(os.path.basename(name))
+        Args:
+            path: (basestring) The path to the directory to start at,
+                relative to the root of the tar archive.
 
-        return files, dirs
+        Raises:
+            ValueError: If path resolves to something other than
+                a directory.
+            KeyError: If path cannot be found.
+
+        Yields:
+            (basestring, [basestring, ...], [basestring, ...]) For each
+            directory, top-down: its path, the names of its subdirectories
+            and the names of its files.
+        """
+        pending = [self._normalize(path)]
+        while pending:
+            dir_path = pending.pop()
+            files, dirs = self.list(dir_path)
+            yield dir_path, dirs, files
+            pending.extend(posixpath.join(dir_path, name)
+                           for name in reversed(dirs))
+
+    def glob(self, pattern):
+        """Return the paths in the archive that match a shell-style pattern.
+
+        As with the glob module, wildcards don't match across '/', so
+        'logs/*.log' only matches files directly inside 'logs'.
+
+        Args:
+            pattern: (basestring) The pattern, relative to the root of the
+                tar archive.
+
+        Returns:
+            ([basestring, ...]) The matching paths, sorted.
+        """
+        matches = ['']
+        for component in self._normalize(pattern).split('/'):
+            next_matches = []
+            for dir_path in matches:
+                if not self._is_dir(dir_path):
+                    continue
+                if _GLOB_MAGIC.search(component):
+                    next_matches.extend(
+                        posixpath.join(dir_path, name) for name in
+                        fnmatch.filter(self._children[dir_path], component))
+                else:
+                    # No wildcards, so there's no need to scan the children.
+                    child = posixpath.join(dir_path, component)
+                    if self.exists(child):
+                        next_matches.append(child)
+            matches = next_matches
+        return sorted(path for path in matches if path)
 
     def get_file(self, path):
         """Return a file-like object from within the tar archive.
@@ -354,8 +688,11 @@ class TarWrapper(object):
         Returns:
             (basestring) The contents of the file.
         """
-        tinfo = self.tarfile.getmember(path)
-        if not tinfo.isfile():
+        norm_path = self._normalize(path)
+        if not self.exists(norm_path):
+            raise KeyError('"{0}" not found in archive.'.format(path))
+        tinfo = self._members.get(norm_path)
+        if tinfo is None or not tinfo.isfile():
             raise ValueError('"{0}" is not a file.'.format(path))
         return self.tarfile.extractfile(tinfo)
 
@@ -0,0 +1,378 @@
+# Copyright 2015 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Validate several sandboxes at the same time.
+
+A batch file lists the sandboxes to validate, in YAML:
+
+    defaults:
+      application_id: ci
+    sandboxes:
+      - config_files: [frontend/app.yaml]
+      - name: backend
+        image_name: gcr.io/my-project/backend
+
+Each sandbox is given by keyword arguments of ContainerSandbox, on top of
+the defaults. Relative paths are relative to the batch file. Unless a
+sandbox asks for specific ports, docker picks free host ports for it, and
+its storage and container output go to a directory of its own, so that
+sandboxes don't get in each other's way.
+"""
+
+# This file conforms to the external style guide.
+# pylint: disable=bad-indentation, g-bad-import-order
+
+import collections
+import functools
+import inspect
+import os
+import re
+import time
+import traceback
+
+import yaml
+
+from .. import utils
+from ..sandbox import container_sandbox
+from ..sandbox import scheduler
+from ..utils import get_logger
+
+import contract
+import reports
+
+# Default number of sandboxes to validate at the same time.
+DEFAULT_JOBS = 4
+
+# Files that each sandbox's results are written to, in the sandbox's
+# directory under the output directory.
+LOG_FILE = 'validation.log'
+REPORT_FILE = 'report.json'
+
+# Options of ContainerSandbox that are paths on this machine.
+_PATH_OPTIONS = ('log_path', 'output_path', 'storage_path')
+
+# Characters that sandbox names are made of. Others are replaced by '_'.
+_NAME_UNSAFE_CHARS = re.compile(r'[^A-Za-z0-9_-]+')
+
+# The outcome of validating a single sandbox.
+#
+# success: (bool) Whether or not validation was successful.
+# error: (basestring or None) Why validation was aborted, if it was.
+# duration: (float) How long validation took, in seconds.
+SandboxResult = collections.namedtuple('SandboxResult',
+                                       ['success', 'error', 'duration'])
+
+
+def _default_name(options):
+    """Name a sandbox after its application directory or image."""
+    if options.get('config_files'):
+        return os.path.basename(os.path.dirname(options['config_files'][0]))
+    if options.get('image_name'):
+        # gcr.io/my-project/backend:latest -> backend
+        return options['image_name'].rsplit('/', 1)[-1].split(':')[0]
+    return 'sandbox'
+
+
+def load_batch_file(path):
+    """Read the sandboxes to validate from a batch file.
+
+    Args:
+        path: (basestring) The path of the batch file. See the module
+            docstring for its format.
+
+    Returns:
+        ([(basestring, dict), ...]) The name and ContainerSandbox keyword
+        arguments of each sandbox, in the order of the file. Sandboxes
+        without a name are named after their application directory or
+        image. Names are unique.
+
+    Raises:
+        utils.AppstartAbort: If the file can't be read or is malformed.
+    """
+    try:
+        with open(path) as batch_file:
+            batch = yaml.safe_load(batch_file)
+    except (IOError, yaml.YAMLError) as err:
+        raise utils.AppstartAbort('Could not read batch file {0}: '
+                                  '{1}'.format(path, err))
+    if (not isinstance(batch, dict) or
+            not isinstance(batch.get('sandboxes'), list)):
+        raise utils.AppstartAbort('{0}: expected a list of sandboxes under '
+                                  '"sandboxes".'.format(path))
+    defaults = batch.get('defaults') or {}
+    if not isinstance(defaults, dict):
+        raise utils.AppstartAbort('{0}: "defaults" should be a mapping of '
+                                  'sandbox options.'.format(path))
+
+    base_dir = os.path.dirname(os.path.abspath(path))
+    known_options = set(inspect.getargspec(
+        container_sandbox.ContainerSandbox.__init__).args[1:])
+    sandboxes = []
+    names = set()
+    for number, entry in enumerate(batch['sandboxes'], 1):
+        if not isinstance(entry, dict):
+            raise utils.AppstartAbort('{0}: sandbox {1} should be a mapping of '
+                                      'sandbox options.'.format(path, number))
+        options = dict(defaults)
+        options.update(entry)
+        name = options.pop('name', None)
+        unknown = sorted(set(options) - known_options)
+        if unknown:
+            raise utils.AppstartAbort('{0}: unknown options for sandbox {1}: '
+                                      '{2}'.format(path, number,
+                                                   ', '.join(unknown)))
+
+        config_files = options.get('config_files')
+        if isinstance(config_files, basestring):
+            config_files = [config_files]
+        if config_files:
+            options['config_files'] = [os.path.join(base_dir, config_file)
+                                       for config_file in config_files]
+        for option in _PATH_OPTIONS:
+            if options.get(option):
+                options[option] = os.path.join(base_dir, options[option])
+
+        name = _NAME_UNSAFE_CHARS.sub(
+            '_', str(name or _default_name(options))).strip('_') or 'sandbox'
+        unique_name = name
+        suffix = 1
+        while unique_name in names:
+            suffix += 1
+            unique_name = '{0}_{1}'.format(name, suffix)
+        names.add(unique_name)
+        sandboxes.append((unique_name, options))
+    return sandboxes
+
+
+class BatchValidator(object):
+    """Validates several sandboxes at the same time."""
+
+    def __init__(self, contract_module, sandboxes, output_dir,
+                 jobs=DEFAULT_JOBS):
+        """Initializer for BatchValidator.
+
+        Args:
+            contract_module: (module) The module with the contract clauses,
+                as for ContractValidator.
+            sandboxes: ([(basestring, dict), ...]) The unique name and
+                ContainerSandbox keyword arguments of each sandbox, as
+                returned by load_batch_file.
+            output_dir: (basestring) The directory that each sandbox gets a
+                directory in, named after the sandbox.
+            jobs: (int) The maximum number of sandboxes to validate at the
+                same time.
+        """
+        self.contract_module = contract_module
+        self.sandboxes = sandboxes
+        self.output_dir = output_dir
+        self.jobs = jobs
+
+        # {basestring: SandboxResult} The outcome of each sandbox, once it
+        # has been validated.
+        self.results = {}
+
+    def sandbox_directory(self, name):
+        """Get the directory of a sandbox's results, under output_dir."""
+        return os.path.join(self.output_dir, name)
+
+    def sandbox_kwargs(self, name, options):
+        """Complete the ContainerSandbox keyword arguments of a sandbox.
+
+        Args:
+            name: (basestring) The name of the sandbox.
+            options: (dict) The options of the sandbox from the batch file.
+
+        Returns:
+            (dict) The options, with free host ports and a storage and
+            output directory of the sandbox's own unless the options say
+            otherwise.
+        """
+        directory = self.sandbox_directory(name)
+        kwargs = {'application_port': container_sandbox.AUTO_PORT,
+                  'admin_port': container_sandbox.AUTO_PORT,
+                  'proxy_port': container_sandbox.AUTO_PORT,
+                  'storage_path': os.path.join(directory, 'storage'),
+                  'output_path': os.path.join(directory, 'output')}
+        kwargs.update(options)
+        return kwargs
+
+    def validate(self,
+                 tags=None,
+                 threshold='WARNING',
+                 verbose=False,
+                 parallel=1,
+                 report_file=None,
+                 report_format='json',
+                 soak_duration=0):
+        """Validate every sandbox.
+
+        The results of each sandbox are written to LOG_FILE and REPORT_FILE
+        in its directory rather than to the console, where they would be
+        interleaved. A summary is logged once all sandboxes are done.
+
+        Args:
+            tags: ([basestring, ...] or None) As for
+                ContractValidator.validate.
+            threshold: (basestring) As for ContractValidator.validate.
+            verbose: (bool) Whether or not to write debug messages to the
+                logs of the sandboxes.
+            parallel: (int) The maximum number of clauses to evaluate at
+                the same time, within each sandbox.
+            report_file: (basestring or None) If present, the path of a file
+                to write the merged report of all sandboxes to.
+            report_format: (basestring) The format of the merged report.
+                One of the keys of reports.REPORT_FORMATS.
+            soak_duration: (float) As for ContractValidator.validate.
+
+        Returns:
+            (bool) True if every sandbox passed validation. False otherwise.
+        """
+        if report_file and report_format not in reports.REPORT_FORMATS:
+            raise utils.AppstartAbort(
+                'Unknown report format: {0}'.format(report_format))
+        start_time = time.time()
+        self.results = {}
+
+        # Validators are made one at a time, since making them resolves the
+        # dependencies of the clauses shared by their contracts.
+        phases = scheduler.PhaseScheduler(max_workers=self.jobs)
+        for name, options in self.sandboxes:
+            try:
+                if not os.path.isdir(self.sandbox_directory(name)):
+                    os.makedirs(self.sandbox_directory(name))
+                validator = contract.ContractValidator(
+                    self.contract_module, name=name,
+                    **self.sandbox_kwargs(name, options))
+            except (utils.AppstartAbort, OSError, ValueError) as err:
+                self.results[name] = SandboxResult(
+                    False, str(err) or 'Could not make the sandbox.', 0)
+                continue
+            phases.add_phase(name, functools.partial(
+                self._validate_sandbox, name, validator, tags, threshold,
+                verbose, parallel, soak_duration))
+
+        get_logger().info('Validating %d sandboxes, %d at a time. Results '
+                          'go to %s', len(self.sandboxes), self.jobs,
+                          self.output_dir)
+        try:
+            phases.run()
+        finally:
+            self.log_summary()
+            if report_file:
+                self.write_report(report_file, report_format, start_time)
+        return self.all_passed()
+
+    def _validate_sandbox(self, name, validator, tags, threshold, verbose,
+                          parallel, soak_duration):
+        """Validate a single sandbox, recording its result.
+
+        Errors are recorded rather than raised, so that one broken sandbox
+        doesn't keep the others from being validated.
+        """
+        directory = self.sandbox_directory(name)
+        start = time.time()
+        success = False
+        error = None
+        try:
+            success = validator.validate(
+                tags, threshold,
+                logfile=os.path.join(directory, LOG_FILE),
+                verbose=verbose,
+                parallel=parallel,
+                report_file=os.path.join(directory, REPORT_FILE),
+                report_format='json',
+                quiet=True,
+                soak_duration=soak_duration)
+        except utils.AppstartAbort as err:
+            error = str(err) or 'Validation was aborted.'
+        except Exception:  # pylint: disable=broad-except
+            error = traceback.format_exc()
+        self.results[name] = SandboxResult(success, error, time.time() - start)
+        get_logger().info('%s: %s', name, 'PASSED' if success else 'FAILED')
+
+    def all_passed(self):
+        """Check whether every sandbox passed validation."""
+        return all(name in self.results and self.results[name].success
+                   for name, _ in self.sandboxes)
+
+    def log_summary(self):
+        """Log the outcome of each sandbox."""
+        get_logger().info('  BATCH VALIDATION  '.center(80, '-'))
+        for name, _ in self.sandboxes:
+            result = self.results.get(name)
+            if not result:
+                get_logger().warning('{0: <30} NOT RUN'.format(name))
+                continue
+            if result.success:
+                get_logger().info('{0: <30} PASSED in {1:.1f}s'.format(
+                    name, result.duration))
+                continue
+            get_logger().warning('{0: <30} FAILED in {1:.1f}s, see {2}'.format(
+                name, result.duration,
+                os.path.join(self.sandbox_directory(name), LOG_FILE)))
+            if result.error:
+                get_logger().warning('  %s', result.error.strip())
+        get_logger().info('-' * 80)
+
+    def write_report(self, report_file, report_format, start_time):
+        """Merge the reports of the sandboxes into a single report.
+
+        The execution plan steps and clause records get a 'sandbox' key.
+        Sandboxes that were aborted get an extra ERROR record that says
+        why.
+
+        Args:
+            report_file: (basestring) The path of the merged report.
+            report_format: (basestring) The format of the merged report.
+                One of the keys of reports.REPORT_FORMATS.
+            start_time: (float) When validation started, in seconds since
+                the epoch.
+        """
+        plan = []
+        records = []
+        for name, _ in self.sandboxes:
+            try:
+                sandbox_plan, sandbox_records, _ = reports.read_json_report(
+                    os.path.join(self.sandbox_directory(name), REPORT_FILE))
+            except IOError:
+                sandbox_plan, sandbox_records = None, []
+            for step in (sandbox_plan or {}).get('execution_plan', []):
+                plan.append(dict(step, sandbox=name))
+            for record in sandbox_records:
+                records.append(dict(record, sandbox=name))
+
+            result = self.results.get(name)
+            if result and result.error:
+                records.append({
+                    'name': 'Sandbox',
+                    'title': 'Validate the sandbox',
+                    'lifecycle_point': contract._TIMELINE_NUMBERS_TO_NAMES[
+                        contract.PRE_START],
+                    'outcome': reports.ERROR,
+                    'error_level': contract.LEVEL_NUMBERS_TO_NAMES[
+                        contract.FATAL],
+                    'start_time': None,
+                    'end_time': None,
+                    'duration': result.duration,
+                    'message': result.error,
+                    'metrics': None,
+                    'dependencies': [],
+                    'sandbox': name})
+
+        with open(report_file, 'w') as report_stream:
+            writer = reports.REPORT_FORMATS[report_format](report_stream)
+            writer.start(plan, start_time)
+            for record in records:
+                writer.add_result(record)
+            writer.finish(self.all_passed())
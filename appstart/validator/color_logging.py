@@ -26,8 +26,20 @@ import color_formatting
 _logger = None
 
 
-def get_validator_logger():
+def get_validator_logger(name=None):
+    """Get the logger that validation results are written to.
+
+    Args:
+        name: (basestring or None) The name of a validator that runs
+            alongside others. Each of them gets a logger of its own, so
+            that their handlers don't clash.
+
+    Returns:
+        (logging.Logger) The logger.
+    """
     global _logger
+    if name:
+        return logging.getLogger('appstart.validator.' + name)
     if not _logger:
         _logger = logging.getLogger('appstart.validator')
     return _logger
@@ -44,24 +56,26 @@ class LogfileHandler(logging.FileHandler):
 class LoggingStream(object):
     """A fake 'stream' to be used for logging in tests."""
 
-    def __init__(self, logfile, verbose_printing, formatter=None):
-        self.__logger = get_validator_logger()
+    def __init__(self, logfile, verbose_printing, formatter=None, name=None,
+                 console=True):
+        self.__logger = get_validator_logger(name)
         self.__logger.handlers = []
         self.__logger.setLevel(logging.DEBUG)
 
         # Don't send messages to root logger.
         self.__logger.propagate = False
 
-        # Stream handler prints to console.
-        stream_handler = logging.StreamHandler()
-        stream_handler.setLevel(logging.DEBUG if verbose_printing
-                                else logging.INFO)
-
-        # Color formatter replaces colors (like {red}, {warn}, etc) with ansi
-        # escape sequences.
-        stream_handler.setFormatter(fmt=formatter or
-                                    color_formatting.ColorFormatter())
-        self.__logger.addHandler(stream_handler)
+        if console:
+            # Stream handler prints to console.
+            stream_handler = logging.StreamHandler()
+            stream_handler.setLevel(logging.DEBUG if verbose_printing
+                                    else logging.INFO)
+
+            # Color formatter replaces colors (like {red}, {warn}, etc) with
+            # ansi escape sequences.
+            stream_handler.setFormatter(fmt=formatter or
+                                        color_formatting.ColorFormatter())
+            self.__logger.addHandler(stream_handler)
 
         if logfile:
             # This special logfile handler doesn't emit empty records.
@@ -50,20 +50,25 @@ at runtime. See README.md for more info.
 # pylint: disable=bad-indentation, g-bad-import-order
 
 import copy
+import functools
+import heapq
 import inspect
 import logging
 import os
-import subprocess
-import tempfile
+import threading
 import time
 import unittest
 import yaml
 
 from ..sandbox import container_sandbox
+from ..sandbox import scheduler
 from .. import utils
 
 import errors
 import color_logging
+import hooks
+import log_snapshot
+import reports
 
 ################################################################################
 # Error level descriptions                                                     #
@@ -96,18 +101,20 @@ LEVEL_NAMES_TO_NUMBERS = {name: val for val, name
 # Lifecycle timeline
 POST_STOP = 50
 STOP = 40
+LOAD = 35
 POST_START = 30
 START = 20
 PRE_START = 10
 
 # Tests will be executed in the order of lifecycle points.
-_TIMELINE = [PRE_START, START, POST_START, STOP, POST_STOP]
+_TIMELINE = [PRE_START, START, POST_START, LOAD, STOP, POST_STOP]
 
 # Singular points are lifecycle points that allow only one test.
 _SINGULAR_POINTS = [START, STOP]
 
 _TIMELINE_NUMBERS_TO_NAMES = {POST_STOP: 'Post Stop',
                               STOP: 'Stop',
+                              LOAD: 'Load',
                               POST_START: 'Post Start',
                               START: 'Start',
                               PRE_START: 'Pre Start'}
@@ -145,7 +152,11 @@ _DEFAULT_YAML_ATTRS = {'dependencies': [],
                        'before': [],
                        'after': [],
                        'tags': [],
-                       'error_level': 'UNUSED'}
+                       'error_level': 'UNUSED',
+                       'persistent': False,
+                       'timeout': None,
+                       'retries': 0,
+                       'max_parallel': None}
 
 
 class ContractTestResult(unittest.TextTestResult):
@@ -160,7 +171,8 @@ class ContractTestResult(unittest.TextTestResult):
     SKIP = 1
     PASS = 0
 
-    def __init__(self, success_set, threshold, *result_args, **result_kwargs):
+    def __init__(self, success_set, threshold, report_writer, *result_args,
+                 **result_kwargs):
         """Initializer for ContractTestResult.
 
         Args:
@@ -170,6 +182,8 @@ class ContractTestResult(unittest.TextTestResult):
                 LEVEL_NUMBERS_TO_NAMES.keys(). Validation will result in
                 failure if and only if a test with an error_level greater than
                 threshold fails.
+            report_writer: (reports.ReportWriter or None) If present, the
+                outcome of each test is also written to this report.
             *result_args: (list) Arguments to be passed to the
                 constructor for TextTestResult.
             **result_kwargs: (dict) Keyword arguments to be passed to the
@@ -181,6 +195,7 @@ class ContractTestResult(unittest.TextTestResult):
         self.success = True
         self.__threshold = threshold
         self.__success_set = success_set
+        self.__report_writer = report_writer
 
         # A list of successful tests.
         self.success_list = []
@@ -189,6 +204,28 @@ class ContractTestResult(unittest.TextTestResult):
         # frequency by level.
         self.error_stats = {}
 
+        # A list of hook clauses that have been evaluated.
+        self.hook_list = []
+
+        # A list of clauses that have recorded metrics.
+        self.metrics_list = []
+
+    def stopTest(self, test):
+        """Wrapper around TextTestResult's stopTest.
+
+        In addition, keep track of the hook clauses that were evaluated
+        and of the clauses that recorded metrics.
+
+        Args:
+            test: (ContractClause) A contract clause that has been
+                evaluated.
+        """
+        super(ContractTestResult, self).stopTest(test)
+        if test.hook_run:
+            self.hook_list.append(test)
+        if test.metrics:
+            self.metrics_list.append(test)
+
     def addSuccess(self, test):
         """Wrapper around TestResult's addSuccess.
 
@@ -204,6 +241,7 @@ class ContractTestResult(unittest.TextTestResult):
         self.success_list.append(test)
         message = self.__make_message(test, self.PASS)
         self.stream.writeln(message)
+        self.__report(test, reports.PASSED)
 
     def __update_error_stats(self, test):
         """Update the appropriate error level in self.error_stats.
@@ -220,10 +258,44 @@ class ContractTestResult(unittest.TextTestResult):
         if test.error_level >= self.__threshold:
             self.success = False
 
+    def __report(self, test, outcome, message=None):
+        """Write the outcome of test to the report, if there is one.
+
+        Args:
+            test: (ContractClause) A contract clause that has been
+                evaluated.
+            outcome: (basestring) One of the outcomes in reports.
+            message: (basestring or None) The failure message, traceback
+                or skip reason.
+        """
+        if not self.__report_writer:
+            return
+        duration = None
+        if test.start_time is not None and test.end_time is not None:
+            duration = test.end_time - test.start_time
+        hook_usage = None
+        if test.hook_run is not None:
+            hook_usage = test.hook_run.get_usage()
+        self.__report_writer.add_result({
+            'name': test.__class__.__name__,
+            'title': test.title,
+            'lifecycle_point': _TIMELINE_NUMBERS_TO_NAMES[
+                test.lifecycle_point],
+            'outcome': outcome,
+            'error_level': LEVEL_NUMBERS_TO_NAMES[test.error_level],
+            'start_time': test.start_time,
+            'end_time': test.end_time,
+            'duration': duration,
+            'message': message,
+            'metrics': test.metrics,
+            'hook_usage': hook_usage,
+            'dependencies': reports.dependency_chain(test.__class__)})
+
     def addSkip(self, test, reason):
         unittest.TestResult.addSkip(self, test, reason)
         message = self.__make_message(test, self.SKIP)
         self.stream.writeln(message, lvl=logging.DEBUG)
+        self.__report(test, reports.SKIPPED, reason)
 
     def addError(self, test, err):
         """Wrapper around grandparent's addError.
@@ -239,6 +311,7 @@ class ContractTestResult(unittest.TextTestResult):
         self.__update_error_stats(test)
         message = self.__make_message(test, self.ERROR)
         self.stream.writeln(message)
+        self.__report(test, reports.ERROR, self.errors[-1][1])
 
     def addFailure(self, test, err):
         """Modified version of grandparent's addFailure.
@@ -257,6 +330,7 @@ class ContractTestResult(unittest.TextTestResult):
         test.failure_message = str(err[1])
         message = self.__make_message(test, self.FAIL)
         self.stream.writeln(message)
+        self.__report(test, reports.FAILED, test.failure_message)
 
     def getDescription(self, test):
         """Get the description of a test."""
@@ -342,6 +416,35 @@ class ContractTestResult(unittest.TextTestResult):
             # Same sanitization as above.
             self.stream.writeln(err.replace('%', '%%'))
 
+    def print_hook_usage(self):
+        """Write the resources used by hook clauses, slowest first."""
+        if not self.hook_list:
+            return
+        self.stream.writeln(
+            ' %(bold)s Hook Usage %(end)s '.center(100, '-'),
+            lvl=logging.DEBUG)
+        for test in sorted(self.hook_list,
+                           key=lambda t: t.hook_run.wall_time,
+                           reverse=True):
+            self.stream.writeln('{0}: {1}'.format(
+                test.__class__.__name__, test.hook_run.describe_usage()),
+                                lvl=logging.DEBUG)
+        self.stream.writeln(lvl=logging.DEBUG)
+
+    def print_metrics(self):
+        """Write the metrics recorded by clauses."""
+        if not self.metrics_list:
+            return
+        self.stream.writeln(' %(bold)s Metrics %(end)s '.center(100, '-'))
+        for test in self.metrics_list:
+            self.stream.writeln('{0}: {1}'.format(
+                test.__class__.__name__,
+                ', '.join('{0}={1}'.format(
+                    name, '{0:.3f}'.format(value)
+                    if isinstance(value, float) else value)
+                          for name, value in sorted(test.metrics.iteritems()))))
+        self.stream.writeln()
+
     def print_skips(self):
         if self.skipped:
             self.stream.writeln(
@@ -356,6 +459,51 @@ class ContractTestResult(unittest.TextTestResult):
             self.stream.writeln(lvl=logging.DEBUG)
 
 
+class ClauseOutcome(unittest.TestResult):
+    """Record the outcome of a clause that's evaluated on a worker thread.
+
+    Clauses that run concurrently finish in no particular order. Their
+    outcomes are recorded here and replayed into the ContractTestResult in
+    the order of the contract, so that results are reported consistently.
+    """
+
+    # Methods of TestResult that unittest.TestCase.run may call.
+    _RECORDED_CALLS = ['startTest', 'stopTest', 'addSuccess', 'addError',
+                       'addFailure', 'addSkip', 'addExpectedFailure',
+                       'addUnexpectedSuccess']
+
+    def __init__(self, success_set):
+        """Initializer for ClauseOutcome.
+
+        Args:
+            success_set: (set) The set of test classes that have succeeded.
+                The clause's class is added as soon as it succeeds, since
+                its dependents may start before the outcome is replayed.
+        """
+        super(ClauseOutcome, self).__init__()
+        self.__success_set = success_set
+
+        # [(basestring, ContractClause, tuple), ...] Recorded calls.
+        self.calls = []
+
+        for name in self._RECORDED_CALLS:
+            setattr(self, name, functools.partial(self.__record, name))
+
+    def __record(self, name, test, *args):
+        if name == 'addSuccess':
+            self.__success_set.add(test.__class__)
+        self.calls.append((name, test, args))
+
+    def replay(self, result):
+        """Report the recorded outcome to result.
+
+        Args:
+            result: (unittest.TestResult) The result to report to.
+        """
+        for name, test, args in self.calls:
+            getattr(result, name)(test, *args)
+
+
 class ContractTestRunner(unittest.TextTestRunner):
     """Test runner for a single suite of runtime contract clauses.
 
@@ -363,7 +511,8 @@ class ContractTestRunner(unittest.TextTestRunner):
     ContractTestRunner corresponds to a single _TIMELINE point.
     """
 
-    def __init__(self, success_set, threshold, logfile, verbose_printing):
+    def __init__(self, success_set, threshold, logfile, verbose_printing,
+                 report_writer=None, name=None, quiet=False):
         """Create a ContractTestRunner.
 
         Args:
@@ -376,11 +525,19 @@ class ContractTestRunner(unittest.TextTestRunner):
             logfile: (basestring) The logfile to append messages to.
             verbose_printing: (bool) Whether or not to create a verbose
                 LoggingStream (one that prints to console verbosely).
+            report_writer: (reports.ReportWriter or None) If present, the
+                outcome of each test is also written to this report.
+            name: (basestring or None) The name of the validator, if it runs
+                alongside others. See color_logging.get_validator_logger.
+            quiet: (bool) Whether or not to leave messages out of the
+                console, and only write them to the logfile.
         """
         super(ContractTestRunner, self).__init__()
         self.__threshold = threshold
-        self.stream = color_logging.LoggingStream(logfile, verbose_printing)
+        self.stream = color_logging.LoggingStream(logfile, verbose_printing,
+                                                  name=name, console=not quiet)
         self.__success_set = success_set
+        self.__report_writer = report_writer
 
     def _makeResult(self):
         """Make a ContractTestResult to capture the test results.
@@ -390,11 +547,12 @@ class ContractTestRunner(unittest.TextTestRunner):
         """
         return ContractTestResult(self.__success_set,
                                   self.__threshold,
+                                  self.__report_writer,
                                   self.stream,
                                   self.descriptions,
                                   self.verbosity)
 
-    def run(self, tests, point):
+    def run(self, tests, point, parallel=1, prerequisites=None):
         """Run the test suite.
 
         This should be called once per point in _TIMELINE. This function
@@ -405,10 +563,23 @@ class ContractTestRunner(unittest.TextTestRunner):
             tests: (unittest.TestSuite) a suite of ContractClauses,
                 corresponding to a point in _TIMELINE.
             point: (basestring) the name of the point in _TIMELINE.
+            parallel: (int) The maximum number of clauses to evaluate at
+                the same time. If greater than 1, results are reported
+                once all clauses have been evaluated.
+            prerequisites: ({class: set} or None) The clauses that must
+                run before each clause, as worked out by the
+                ContractValidator. Required if parallel is greater than 1.
+
+        Raises:
+            ValueError: If parallel is greater than 1 and prerequisites
+                is None.
 
         Returns:
             (ContractTestResult) The result of the tests.
         """
+        if parallel > 1 and prerequisites is None:
+            raise ValueError('The prerequisites of the clauses are needed '
+                             'to evaluate them in parallel.')
         self.stream.writeln()
         self.stream.writeln('%(bold)sRunning tests: {0} %(end)s'.format(point))
         result = self._makeResult()
@@ -420,7 +591,11 @@ class ContractTestRunner(unittest.TextTestRunner):
         if start_test_run is not None:
             start_test_run()
         try:
-            tests(result)
+            if parallel > 1:
+                self._run_in_parallel(list(tests), result, parallel,
+                                      prerequisites)
+            else:
+                tests(result)
         finally:
             stop_test_run = getattr(result, 'stopTestRun', None)
             if stop_test_run is not None:
@@ -432,6 +607,8 @@ class ContractTestRunner(unittest.TextTestRunner):
 
         result.print_errors()
         result.print_skips()
+        result.print_hook_usage()
+        result.print_metrics()
 
         # Find out how many tests ran
         run = result.testsRun
@@ -454,6 +631,46 @@ class ContractTestRunner(unittest.TextTestRunner):
         self.stream.writeln('=' * 100)
         return result
 
+    def _run_in_parallel(self, clauses, result, parallel, prerequisites):
+        """Evaluate clauses concurrently, as their dependencies allow.
+
+        Args:
+            clauses: ([ContractClause, ...]) The clauses of a single point
+                in _TIMELINE. Clauses must come after the clauses they
+                depend on, as they do in the contract.
+            result: (ContractTestResult) The result to report to.
+            parallel: (int) The maximum number of clauses to evaluate at
+                the same time.
+            prerequisites: ({class: set}) The clauses that must run before
+                each clause.
+        """
+        phases = scheduler.PhaseScheduler(max_workers=parallel)
+
+        # {class: basestring} Phase names of the clauses.
+        names = {}
+        for clause in clauses:
+            clause_class = clause.__class__
+
+            # Clauses from earlier points in _TIMELINE have run already.
+            dependencies = [names[dep] for dep in prerequisites[clause_class]
+                            if dep in names]
+            names[clause_class] = str(len(names))
+            phases.add_phase(names[clause_class],
+                             functools.partial(self._evaluate, clause),
+                             dependencies)
+        try:
+            phases.run()
+        finally:
+            for clause in clauses:
+                outcome = phases.results.get(names[clause.__class__])
+                if outcome:
+                    outcome.replay(result)
+
+    def _evaluate(self, clause):
+        outcome = ClauseOutcome(self.__success_set)
+        clause(outcome)
+        return outcome
+
 
 class ContractClause(unittest.TestCase):
     """A single clause of the contract.
@@ -592,12 +809,63 @@ class ContractClause(unittest.TestCase):
         super(ContractClause, self).__init__('run_test')
         self.__sandbox = sandbox
 
+        # (log_snapshot.SnapshotCache or None) Set by the ContractValidator,
+        # so that clauses can share snapshots of the application's logs.
+        self.log_snapshots = None
+
+        # (hooks.HookRun or None) The outcome and resource usage of the
+        # clause's hook, for hook clauses that have been evaluated.
+        self.hook_run = None
+
+        # (float or None) When the clause's evaluation started and
+        # finished, in seconds since the epoch.
+        self.start_time = None
+        self.end_time = None
+
+        # ({basestring: object} or None) Measurements that the clause
+        # wants reported, such as latencies, keyed by name.
+        self.metrics = None
+
+        # (float) How long clauses that soak the application should keep
+        # at it, in seconds. Set by the ContractValidator. Zero means that
+        # such clauses are skipped.
+        self.soak_duration = 0
+
     def shortDescription(self):
         """Return a short description of the clause."""
         return '%s: %s' % (self.title, self.description)
 
+    @property
+    def sandbox(self):
+        """The sandbox that manages the container to be tested."""
+        return self.__sandbox
+
     def run_test(self):
-        self.evaluate_clause(self.__sandbox.app_container)
+        self.hook_run = None
+        self.metrics = None
+        self.start_time = time.time()
+        self.end_time = None
+        try:
+            self.evaluate_clause(self.__sandbox.app_container)
+        finally:
+            self.end_time = time.time()
+
+    def get_log_snapshot(self, app_container):
+        """Return a view of the logs that the application has written.
+
+        Clauses evaluated at the same lifecycle point share the snapshot,
+        so the logs are only collected from the container once.
+
+        Args:
+            app_container: (sandbox.container.Container) The container
+                to be tested
+
+        Returns:
+            (log_snapshot.LogSnapshot) The snapshot.
+        """
+        if self.log_snapshots is None:
+            return log_snapshot.LogSnapshot(app_container)
+        return self.log_snapshots.get(app_container)
 
     def evaluate_clause(self, app_container):
         """A test that checks if the container is fulfilling the clause.
@@ -613,25 +881,45 @@ class ContractClause(unittest.TestCase):
 class ContractValidator(object):
     """Coordinates the evaluation of multiple contract clauses."""
 
-    def __init__(self, contract_module, **sandbox_kwargs):
+    def __init__(self, contract_module, name=None, **sandbox_kwargs):
         """Initializer for ContractValidator.
 
         Args:
             contract_module: (module) A module that contains classes that
                 inherit from ContractClause. These classes will
                 be used to make the contract.
+            name: (basestring or None) A name for the validator, which
+                gives it a logger of its own. Validators that run at the
+                same time must have different names.
             **sandbox_kwargs: (dict) Keyword args for the ContainerSandbox.
         """
+        self.name = name
         self.contract = {}
         self.sandbox = container_sandbox.ContainerSandbox(
             **sandbox_kwargs)
 
-        # Set of clauses that have been added to the contract.
-        self.__added_clauses = set()
+        # [{basestring: object}, ...] The order in which the clauses are
+        # evaluated. See _construct_contract.
+        self.execution_plan = []
+
+        # {class: set} The clauses that must run before each clause of the
+        # contract. See _construct_contract.
+        self.prerequisites = {}
 
         # Set of clauses that have succeeded.
         self.__success_set = set()
 
+        # Snapshots of the application's logs, shared among clauses.
+        self.log_snapshots = log_snapshot.SnapshotCache()
+
+        # {basestring: hooks.HookWorker} Processes of persistent hook
+        # clauses, keyed by command. See hooks.py.
+        self.hook_workers = {}
+
+        # {basestring: (threading.BoundedSemaphore, int)} Limits on the
+        # number of concurrent processes of hook commands.
+        self.hook_limits = {}
+
         # Dict of clauses to add to the contract.
         self._clause_dict = {c.__name__: c
                              for c in self._extract_clauses(contract_module)}
@@ -647,8 +935,8 @@ class ContractValidator(object):
         # Normalize the dependency structure of the clauses
         self._normalize_clause_dict(self._clause_dict)
 
-        # Construct the contract. This involves a depth-first traversal of
-        # the clauses in self._clause_list.
+        # Construct the contract. This involves a topological sort of the
+        # clauses in self._clause_dict.
         self._construct_contract()
 
         # Tags identifying the clauses to be validated.
@@ -734,104 +1022,158 @@ class ContractValidator(object):
                     after_clause.before.add(clause)
 
     def _construct_contract(self):
-        """Recursively add clauses to the contract."""
-        for unused_name, clause in self._clause_dict.iteritems():
-            self._add_clause(clause, set(), [])
+        """Arrange the clauses into the contract and the execution plan.
+
+        The clauses are sorted topologically with Kahn's algorithm, so that
+        each clause comes after its dependencies and the clauses that must
+        run before it. Ties are broken by clause name, which makes the
+        order deterministic. Clauses that are only reachable as
+        dependencies of other clauses are added as well.
+
+        Raises:
+            errors.CircularDependencyError: If a dependency cycle is
+                detected, or if a clause has an earlier lifecycle_point
+                than a clause that must run before it.
+            ValueError: If more than one clause with a lifecycle_point in
+                _SINGULAR_POINTS is added.
+        """
+        # {class: set} The clauses that must run before each clause.
+        prerequisites = {}
+        pending = self._clause_dict.values()
+        while pending:
+            clause_class = pending.pop()
+            if clause_class in prerequisites:
+                continue
+            prerequisites[clause_class] = set(
+                dep for dep in clause_class.dependencies | clause_class.before
+                if self._owns(dep))
+            pending.extend(prerequisites[clause_class])
+
+        # {class: [class, ...]} The clauses that must run after each clause.
+        successors = dict((clause_class, []) for clause_class in prerequisites)
+        for clause_class, prereqs in prerequisites.iteritems():
+            for dep in prereqs:
+                # A clause must have either the same lifecycle point or a
+                # later one than all of the clauses it depends on.
+                if dep.lifecycle_point > clause_class.lifecycle_point:
+                    raise errors.CircularDependencyError(
+                        '{0}->{1}: Clause cannot have earlier lifecycle_point '
+                        'than a clause that must run before '
+                        'it.'.format(clause_class.__name__, dep.__name__))
+                successors[dep].append(clause_class)
+
+        in_degree = dict((clause_class, len(prereqs)) for clause_class, prereqs
+                         in prerequisites.iteritems())
+
+        # Heap of (name, tie breaker, class) for clauses that are ready.
+        ready = [(clause_class.__name__, index, clause_class)
+                 for index, clause_class in enumerate(prerequisites)
+                 if not in_degree[clause_class]]
+        heapq.heapify(ready)
+        order = []
+        while ready:
+            clause_class = heapq.heappop(ready)[2]
+            order.append(clause_class)
+            for succ in successors[clause_class]:
+                in_degree[succ] -= 1
+                if not in_degree[succ]:
+                    heapq.heappush(ready, (succ.__name__, len(order), succ))
+
+        if len(order) < len(prerequisites):
+            remaining = set(clause_class for clause_class, degree
+                            in in_degree.iteritems() if degree)
+            raise errors.CircularDependencyError(
+                'Circular dependency was detected: {0}'.format(
+                    self._describe_cycle(remaining, prerequisites)))
+
+        # {class: int} How many clauses of the same lifecycle point must
+        # run, one after the other, before each clause.
+        levels = {}
+        for clause_class in order:
+            point = clause_class.lifecycle_point
+            levels[clause_class] = 1 + max(
+                [-1] + [levels[dep] for dep in prerequisites[clause_class]
+                        if dep.lifecycle_point == point])
+            self._add_clause(clause_class)
+
+        # The execution plan lists, for each lifecycle point, the names of
+        # the clauses that can be evaluated once the previous levels are
+        # done.
+        self.execution_plan = []
+        for point in _TIMELINE:
+            clause_classes = [clause.__class__
+                              for clause in self.contract.get(point, [])]
+            if not clause_classes:
+                continue
+            plan_levels = [[] for _ in range(
+                1 + max(levels[c] for c in clause_classes))]
+            for clause_class in clause_classes:
+                plan_levels[levels[clause_class]].append(
+                    clause_class.__name__)
+            self.execution_plan.append({
+                'lifecycle_point': _TIMELINE_NUMBERS_TO_NAMES[point],
+                'levels': plan_levels})
+        self.prerequisites = prerequisites
+
+    def _owns(self, clause_class):
+        """Check whether a clause may be part of this validator's contract.
+
+        The clauses of the runtime contract are shared by all validators,
+        so resolving the dependents and after lists of one validator's hook
+        clauses adds them to those shared clauses, where other validators
+        must ignore them.
+
+        Args:
+            clause_class: (type) A subclass of ContractClause.
+
+        Returns:
+            (bool) False if the clause is a hook clause of another
+            validator.
+        """
+        return (clause_class._conf_file is None or
+                self._clause_dict.get(clause_class.__name__) is clause_class)
 
-    def display_loop(self, stack, cls):
-        """Display the loop in the dependency graph.
+    @staticmethod
+    def _describe_cycle(remaining, prerequisites):
+        """Find a dependency cycle and describe it.
 
         Args:
-            stack: ([class, ...]) A list of ContractClause classes,
-                corresponding to the path taken in the DFS of the test
-                dependencies.
-            cls: (class) The ContractClause class that demarks the beginning
-                of the cycle.
+            remaining: (set) The clause classes that could not be sorted.
+                Each of them has a prerequisite in the set.
+            prerequisites: ({class: set}) The clauses that must run before
+                each clause.
 
         Returns:
-            (basestring) The message indicating where the loop was.
+            (basestring) The loop, e.g. "Test1->Test2->Test1".
         """
-        # Get the index of the first occurence of cls
-        first = stack.index(cls)
-
-        # Start iterating over the stack, beginning with the first occurence of
-        # cls.
-        msg = ''
-        for item in stack[first:]:
-            msg = '{0}{1}->'.format(msg, item.__name__)
-        msg += cls.__name__
-        return msg
-
-    def _add_clause(self, clause_class, visited_classes, recursion_stack):
+        def by_name(clause_class):
+            return clause_class.__name__
+
+        path = [min(remaining, key=by_name)]
+        while path.count(path[-1]) < 2:
+            path.append(min(prerequisites[path[-1]] & remaining, key=by_name))
+        loop = path[path.index(path[-1]):]
+        return '->'.join(clause_class.__name__ for clause_class in loop)
+
+    def _add_clause(self, clause_class):
         """Add a clause to the validator.
 
-        Ensure that no dependency cycles occur.
+        Clauses must be added after the clauses they depend on.
 
         Args:
             clause_class: (ContractClause) A clause that the
                 container is expected to fulfill.
-            visited_classes: (set) A set of classes that have been
-                visited so far in the recursive traversal.
-            recursion_stack: ([ContractClause, ...] A list of ContractClauses,
-                representing the exact path that has been traversed
-                recursively so far. This is only used to print the loop, if
-                a loop is even found.
 
         Raises:
-            errors.CircularDepencencyError: If a circular dependency is
-                detected.
-            ValueError: If a clause has an earlier lifecycle_point than
-                another clause that it depends on OR if more than one
-                clause with a lifecycle_point in _SINGULAR_POINTS is
-                added.
+            ValueError: If more than one clause with a lifecycle_point in
+                _SINGULAR_POINTS is added.
         """
-        # Base case: the clause has been added already.
-        if clause_class in self.__added_clauses:
-            return
-
-        # If we've visited this class, there's a loop in the dependency
-        # structure.
-        if clause_class in visited_classes:
-
-            # In the case of a loop, print where it occurs so that the person
-            # writing the contract knows to get rid of it.
-            message = self.display_loop(recursion_stack, clause_class)
-            raise errors.CircularDependencyError(
-                'Circular dependency was detected: {0}'.format(message))
-
-        # Mark that we've visited the clause already. If we come back to
-        # the same clause later, we'll know that a cycle has occured.
-        visited_classes.add(clause_class)
-        recursion_stack.append(clause_class)
-
-        for dep in clause_class.dependencies | clause_class.before:
-            # A clause must have either the same lifecycle point or a later one
-            # than all of the clauses it depends on.
-            if dep.lifecycle_point > clause_class.lifecycle_point:
-                raise errors.CircularDependencyError(
-                    '{0}->{1}: Clause cannot have earlier lifecycle_point '
-                    'than a clause that must run before '
-                    'it.'.format(clause_class.__name__, dep.__name__))
-
-            # Recurse on all clauses that this clause depends on. We want to add
-            # these clauses to the contract before we add the current one.
-            # That's because the clauses upon which the current clause depends
-            # should be evaluated first.
-            self._add_clause(dep, visited_classes, recursion_stack)
-
-        # At this point, we've finished recursion and need to prepare to return
-        # and take a step backward in our DFS traversal. Therefore, remove the
-        # current clause from the set of visited clauses and pop the stack.
-        visited_classes.remove(clause_class)
-        recursion_stack.pop()
-
         # Construct an actual instance of this clause with the sandbox.
         clause = clause_class(self.sandbox)
 
         # Add the clause to the appropriate list. Note that the list may not yet
         # exist.
-        self.contract.setdefault(clause.lifecycle_point, [])
-        clause_list = self.contract.get(clause.lifecycle_point)
+        clause_list = self.contract.setdefault(clause.lifecycle_point, [])
 
         # Singular points are those for which only ONE clause can be present.
         if clause.lifecycle_point in _SINGULAR_POINTS and len(clause_list):
@@ -842,8 +1184,8 @@ class ContractValidator(object):
 
         clause.evaluate_clause = self._dependency_and_tag_wrapper(
             clause, clause.evaluate_clause)
+        clause.log_snapshots = self.log_snapshots
         clause_list.append(clause)
-        self.__added_clauses.add(clause_class)
 
     def _make_hook_clauses(self):
         """Construct the hook clauses to add to the contract.
@@ -928,6 +1270,43 @@ class ContractValidator(object):
         map(verify_has_key_and_set_defaults, keys)
         sandbox = self.sandbox
 
+        # Validate the limits on the hook's execution.
+        timeout = hook_config['timeout']
+        if timeout is not None and (isinstance(timeout, bool) or
+                                    not isinstance(timeout, (int, float)) or
+                                    timeout <= 0):
+            raise utils.AppstartAbort('{0}: timeout must be a positive '
+                                      'number of seconds'.format(yaml_file))
+        for key, minimum in (('retries', 0), ('max_parallel', 1)):
+            value = hook_config[key]
+            if value is not None and (isinstance(value, bool) or
+                                      not isinstance(value, int) or
+                                      value < minimum):
+                raise utils.AppstartAbort('{0}: {1} must be an integer no '
+                                          'less than {2}'.format(yaml_file,
+                                                                 key,
+                                                                 minimum))
+
+        # Persistent hooks that share a command share a process.
+        worker = None
+        if hook_config['persistent']:
+            worker = self.hook_workers.setdefault(
+                hook_config['command'],
+                hooks.HookWorker(hook_config['command']))
+
+        # Hooks that share a command also share the limit on how many
+        # processes may run at the same time.
+        limit = None
+        if hook_config['max_parallel'] is not None:
+            limit, max_parallel = self.hook_limits.setdefault(
+                hook_config['command'],
+                (threading.BoundedSemaphore(hook_config['max_parallel']),
+                 hook_config['max_parallel']))
+            if max_parallel != hook_config['max_parallel']:
+                raise utils.AppstartAbort(
+                    '{0}: hooks with the same command must have the same '
+                    'max_parallel'.format(yaml_file))
+
         # The new hook clause
         class NewClause(ContractClause):
             title = hook_config['title']
@@ -951,6 +1330,30 @@ class ContractValidator(object):
             _conf_file = yaml_file
 
             def evaluate_clause(self, app_container):
+                run = None
+                for _ in range(hook_config['retries'] + 1):
+                    attempt = self.run_hook(app_container)
+                    run = run.add_attempt(attempt) if run else attempt
+                    if run.result != hooks.FAIL:
+                        break
+
+                # Record the resources used, for the validation report.
+                self.hook_run = run
+
+                if run.result == hooks.SKIP:
+                    raise unittest.SkipTest(run.message)
+                self.assertEqual(run.result, hooks.PASS,
+                                 run.message or 'The hook reported a failure.')
+
+            def run_hook(self, app_container):
+                if worker:
+                    return worker.evaluate(
+                        {'clause': hook_config['name'],
+                         'container_id': app_container.get_id(),
+                         'container_host': app_container.host,
+                         'container_port': sandbox.port},
+                        timeout=timeout)
+
                 env = dict(os.environ)
 
                 # These environment variables will give the hook access
@@ -959,23 +1362,14 @@ class ContractValidator(object):
                 env['APP_CONTAINER_HOST'] = app_container.host
                 env['APP_CONTAINER_PORT'] = str(sandbox.port)
 
-                stdout = tempfile.TemporaryFile()
-
-                # Run the command and assert a 0 exit code.
-                return_code = subprocess.Popen(
-                    args=hook_config['command'],
-                    env=env,
-                    stdout=stdout,
-                    stderr=subprocess.STDOUT,
-                    shell=True).wait()
-
-                stdout.seek(0)
-
-                self.assertEqual(return_code,
-                                 0,
-                                 'Return code was {0}. Printing '
-                                 'stdout:\n{1}'.format(return_code,
-                                                       stdout.read()))
+                if limit:
+                    limit.acquire()
+                try:
+                    return hooks.run_command(hook_config['command'], env,
+                                             timeout=timeout)
+                finally:
+                    if limit:
+                        limit.release()
 
         NewClause.__name__ = hook_config['name']
 
@@ -1000,7 +1394,8 @@ class ContractValidator(object):
 
             # Check the dependencies at runtime. If any haven't passed, skip.
             for dependency_class in clause.dependencies:
-                if dependency_class not in self.__success_set:
+                if (dependency_class not in self.__success_set and
+                        self._owns(dependency_class)):
                     raise unittest.SkipTest(
                         '"{0}" did not pass'.format(dependency_class.title))
 
@@ -1048,11 +1443,22 @@ class ContractValidator(object):
             if clause.after:
                 print '\tAfter: {0}'.format(make_name_list(clause.after))
 
+        print 'Execution plan:'
+        for step in self.execution_plan:
+            print '\t{0}'.format(step['lifecycle_point'])
+            for level, names in enumerate(step['levels']):
+                print '\t\t{0}: {1}'.format(level, ', '.join(names))
+
     def validate(self,
                  tags=None,
                  threshold='WARNING',
                  logfile=None,
-                 verbose=False):
+                 verbose=False,
+                 parallel=1,
+                 report_file=None,
+                 report_format='json',
+                 quiet=False,
+                 soak_duration=0):
         """Evaluate all clauses.
 
         Args:
@@ -1069,28 +1475,75 @@ class ContractValidator(object):
                 some non-essential information is ommitted from the output
                 printed to stdout. Note that ALL information is logged to
                 the logfile, if one is specified.
+            parallel: (int) The maximum number of clauses to evaluate at
+                the same time. Clauses still run after the clauses they
+                depend on or have to run after.
+            report_file: (basestring or None) If present, the path of a file
+                to write a machine-readable report to. The report is written
+                as clauses are evaluated.
+            report_format: (basestring) The format of the report. One of
+                the keys of reports.REPORT_FORMATS.
+            quiet: (bool) Whether or not to keep the results out of the
+                console, writing them only to the logfile and the report.
+            soak_duration: (float) How long clauses that soak the
+                application should keep at it, in seconds. Such clauses
+                are skipped if it is 0.
 
         Returns:
             (bool) True if validation was successful. False otherwise.
         """
         self._tags.update(tags or set())
+        for clauses in self.contract.itervalues():
+            for clause in clauses:
+                clause.soak_duration = soak_duration
 
         # The threshold comes in as a string. Convert it to a numerical value.
         threshold = LEVEL_NAMES_TO_NUMBERS[threshold]
 
+        report_stream = report_writer = None
+        if report_file:
+            if report_format not in reports.REPORT_FORMATS:
+                raise utils.AppstartAbort(
+                    'Unknown report format: {0}'.format(report_format))
+            report_stream = open(report_file, 'w')
+            report_writer = reports.REPORT_FORMATS[report_format](
+                report_stream)
+            report_writer.start(self.execution_plan)
+
         test_runner = ContractTestRunner(self.__success_set,
                                          threshold=threshold,
                                          logfile=logfile,
-                                         verbose_printing=verbose)
+                                         verbose_printing=verbose,
+                                         report_writer=report_writer,
+                                         name=self.name,
+                                         quiet=quiet)
         validation_passed = True
         try:
+            # Start persistent hooks right away, so that they can warm up
+            # while the sandbox starts.
+            for worker in self.hook_workers.itervalues():
+                worker.start()
             self.sandbox.start()
+            self.log_snapshots.host_path = self.sandbox.get_host_log_path()
             for point in _TIMELINE:
                 if point not in self.contract: continue
+                self.log_snapshots.invalidate(point)
                 suite = unittest.TestSuite(self.contract.get(point))
-                res = test_runner.run(suite, _TIMELINE_NUMBERS_TO_NAMES[point])
+                res = test_runner.run(suite, _TIMELINE_NUMBERS_TO_NAMES[point],
+                                      parallel=parallel,
+                                      prerequisites=self.prerequisites)
                 validation_passed = validation_passed and res.success
+        except:  # pylint: disable=bare-except
+            # Don't report an interrupted validation as a success.
+            validation_passed = False
+            raise
         finally:
+            if report_writer:
+                report_writer.finish(validation_passed)
+                report_stream.close()
+            self.log_snapshots.invalidate()
+            for worker in self.hook_workers.itervalues():
+                worker.stop()
             self.sandbox.stop()
 
         return validation_passed
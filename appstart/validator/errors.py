@@ -26,3 +26,11 @@ class CircularDependencyError(utils.AppstartAbort):
 
 class ContractAttributeError(utils.AppstartAbort):
     pass
+
+
+class HookError(utils.AppstartAbort):
+    pass
+
+
+class HookTimeoutError(HookError):
+    pass
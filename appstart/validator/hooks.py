@@ -0,0 +1,385 @@
+# Copyright 2015 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Run the processes that evaluate hook clauses.
+
+By default, a hook clause's command is run once each time the clause is
+evaluated (see run_command), and passes if it exits with code 0.
+
+A hook clause whose configuration sets "persistent: true" is not run as a
+new process each time it's evaluated. Instead, its command is started once
+per validation, and hook clauses that share the command also share the
+process. For each clause, the process receives a request as a single line
+of JSON on stdin:
+
+    {"clause": "TestClause", "container_id": "...",
+     "container_host": "...", "container_port": 8080}
+
+and must answer with a single line of JSON on stdout:
+
+    {"result": "pass", "message": "..."}
+
+where result is one of "pass", "fail" or "skip". The process should exit
+once stdin is closed.
+"""
+
+# This file conforms to the external style guide.
+# pylint: disable=bad-indentation, g-bad-import-order
+
+import errno
+import json
+import os
+import select
+import signal
+import subprocess
+import tempfile
+import threading
+import time
+
+import errors
+
+# Results that a hook can report.
+PASS = 'pass'
+FAIL = 'fail'
+SKIP = 'skip'
+RESULTS = frozenset([PASS, FAIL, SKIP])
+
+# Seconds to wait for a hook process to exit after closing its stdin.
+STOP_TIMEOUT = 5
+
+# How often (in seconds) to check whether a hook process has exited. The
+# interval doubles after every check, up to _MAX_POLL_INTERVAL.
+_MIN_POLL_INTERVAL = 0.01
+_MAX_POLL_INTERVAL = 0.1
+
+
+class HookRun(object):
+    """The outcome of evaluating a hook clause, and the resources it used."""
+
+    def __init__(self, result=FAIL, message=''):
+        """Initializer for HookRun.
+
+        Args:
+            result: (basestring) One of RESULTS.
+            message: (basestring) The message reported by the hook.
+        """
+        self.result = result
+        self.message = message
+
+        # (int or None) Exit code of the hook's process, or the negated
+        # signal number if it was killed. None for persistent hooks.
+        self.return_code = None
+
+        # (bool) Whether the hook was killed for taking too long.
+        self.timed_out = False
+
+        # (int) How many times the hook was run.
+        self.attempts = 1
+
+        # (float) Seconds from start to finish, across all attempts.
+        self.wall_time = 0.0
+
+        # (float or None) Seconds of user and system CPU time, across all
+        # attempts. Unknown for persistent hooks, which run continuously.
+        self.cpu_time = None
+
+        # (int or None) Peak resident set size in kilobytes. Unknown for
+        # persistent hooks.
+        self.max_rss = None
+
+    def add_attempt(self, run):
+        """Fold a later attempt into this one.
+
+        Args:
+            run: (HookRun) The later attempt.
+
+        Returns:
+            (HookRun) run, with usage accumulated over both attempts.
+        """
+        run.attempts += self.attempts
+        run.wall_time += self.wall_time
+        if self.cpu_time is not None and run.cpu_time is not None:
+            run.cpu_time += self.cpu_time
+        if self.max_rss is not None and run.max_rss is not None:
+            run.max_rss = max(run.max_rss, self.max_rss)
+        return run
+
+    def get_usage(self):
+        """Return the resources used by the hook, for reports.
+
+        Returns:
+            ({basestring: object}) The attempts, wall_time, cpu_time,
+            max_rss, timed_out and return_code of the run.
+        """
+        return {'attempts': self.attempts,
+                'wall_time': self.wall_time,
+                'cpu_time': self.cpu_time,
+                'max_rss': self.max_rss,
+                'timed_out': self.timed_out,
+                'return_code': self.return_code}
+
+    def describe_usage(self):
+        """Summarize the resources used by the hook in a single line."""
+        usage = ['{0:.2f}s wall time'.format(self.wall_time)]
+        if self.cpu_time is not None:
+            usage.append('{0:.2f}s CPU time'.format(self.cpu_time))
+        if self.max_rss is not None:
+            usage.append('{0:.1f} MB peak RSS'.format(self.max_rss / 1024.0))
+        if self.attempts > 1:
+            usage.append('{0} attempts'.format(self.attempts))
+        if self.timed_out:
+            usage.append('timed out')
+        return ', '.join(usage)
+
+
+def _kill_group(pid):
+    """Kill the process group led by pid, including any subprocesses."""
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except OSError:
+        pass
+
+
+def _wait4(pid, options):
+    while True:
+        try:
+            return os.wait4(pid, options)
+        except OSError as err:
+            if err.errno != errno.EINTR:
+                raise
+
+
+def run_command(command, env, timeout=None):
+    """Run a hook's command once, as a new process group.
+
+    Args:
+        command: (basestring) The shell command to run.
+        env: ({basestring: basestring}) The environment of the command.
+        timeout: (float or None) The number of seconds after which the
+            command and all of its subprocesses are killed.
+
+    Returns:
+        (HookRun) The outcome. The hook passes iff it exits with code 0.
+    """
+    run = HookRun()
+    output = tempfile.TemporaryFile()
+    start = time.time()
+    process = subprocess.Popen(args=command,
+                               env=env,
+                               stdout=output,
+                               stderr=subprocess.STDOUT,
+                               close_fds=True,
+                               preexec_fn=os.setsid,
+                               shell=True)
+
+    # wait4 reports the resources used by the process, which Popen.wait
+    # doesn't. The hook is in a process group of its own, out of reach of
+    # Ctrl-C, so it's killed here if waiting is interrupted.
+    try:
+        if timeout is None:
+            _, status, usage = _wait4(process.pid, 0)
+        else:
+            deadline = start + timeout
+            delay = _MIN_POLL_INTERVAL
+            while True:
+                pid, status, usage = _wait4(process.pid, os.WNOHANG)
+                if pid:
+                    break
+                if time.time() >= deadline:
+                    run.timed_out = True
+                    _kill_group(process.pid)
+                    _, status, usage = _wait4(process.pid, 0)
+                    break
+                time.sleep(min(delay, max(deadline - time.time(), 0)))
+                delay = min(delay * 2, _MAX_POLL_INTERVAL)
+    except BaseException:
+        _kill_group(process.pid)
+        process.wait()
+        output.close()
+        raise
+
+    if os.WIFSIGNALED(status):
+        run.return_code = -os.WTERMSIG(status)
+    else:
+        run.return_code = os.WEXITSTATUS(status)
+
+    # The process has been reaped, so Popen mustn't wait for it again.
+    process.returncode = run.return_code
+    run.wall_time = time.time() - start
+    run.cpu_time = usage.ru_utime + usage.ru_stime
+    run.max_rss = usage.ru_maxrss
+
+    output.seek(0)
+    if run.timed_out:
+        run.message = 'Timed out after {0} seconds.'.format(timeout)
+    elif run.return_code:
+        run.message = 'Return code was {0}.'.format(run.return_code)
+    else:
+        run.result = PASS
+    if run.message:
+        run.message += ' Printing stdout:\n{0}'.format(output.read())
+    output.close()
+    return run
+
+
+class HookWorker(object):
+    """A persistent hook process, evaluating clauses on request."""
+
+    def __init__(self, command):
+        """Initializer for HookWorker.
+
+        Args:
+            command: (basestring) The shell command that starts the hook.
+        """
+        self.command = command
+        self._process = None
+        self._stderr = None
+        self._buffer = ''
+
+        # Requests are answered one at a time.
+        self._lock = threading.RLock()
+
+    def start(self):
+        """Start the hook process, unless it's running already."""
+        with self._lock:
+            if self._process is not None:
+                return
+            self._stderr = tempfile.TemporaryFile()
+            self._buffer = ''
+
+            # Have the shell replace itself with the command, so that
+            # closing stdin reaches the hook itself. The hook leads a new
+            # process group, so that it can be killed along with any
+            # subprocesses it started.
+            self._process = subprocess.Popen(args='exec ' + self.command,
+                                             stdin=subprocess.PIPE,
+                                             stdout=subprocess.PIPE,
+                                             stderr=self._stderr,
+                                             close_fds=True,
+                                             preexec_fn=os.setsid,
+                                             shell=True)
+
+    def evaluate(self, request, timeout=None):
+        """Send a request to the hook and wait for its answer.
+
+        If the hook exits, answers with something other than a valid
+        result or doesn't answer in time, the clause fails and the process
+        is killed. It's started again for the next request.
+
+        Args:
+            request: (dict) The request, which must be serializable as JSON.
+            timeout: (float or None) The number of seconds to wait for the
+                answer.
+
+        Returns:
+            (HookRun) The outcome reported by the hook.
+        """
+        with self._lock:
+            start = time.time()
+            try:
+                run = self._evaluate(request, timeout)
+            except errors.HookError as err:
+                run = HookRun(FAIL, self._describe_failure(err.message))
+                run.timed_out = isinstance(err, errors.HookTimeoutError)
+                self._kill()
+            except BaseException:
+                # Like Ctrl-C, which doesn't reach the hook's process group.
+                if self._process is not None:
+                    self._kill()
+                raise
+            run.wall_time = time.time() - start
+            return run
+
+    def _evaluate(self, request, timeout):
+        self.start()
+        try:
+            self._process.stdin.write(json.dumps(request) + '\n')
+            self._process.stdin.flush()
+        except IOError as err:
+            raise errors.HookError('Could not send request: {0}'.format(err))
+
+        line = self._read_line(timeout)
+        if not line:
+            raise errors.HookError('Hook exited before answering.')
+        try:
+            reply = json.loads(line)
+            result = reply['result']
+        except (ValueError, TypeError, KeyError):
+            raise errors.HookError('Invalid answer: {0}'.format(line.strip()))
+        if result not in RESULTS:
+            raise errors.HookError('Unknown result: {0}'.format(result))
+        return HookRun(result, reply.get('message') or '')
+
+    def _read_line(self, timeout):
+        """Read a line from the hook's stdout.
+
+        Raises:
+            errors.HookTimeoutError: If no full line arrived in time.
+
+        Returns:
+            (basestring) The line, or whatever was left if the hook exited.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        fd = self._process.stdout.fileno()
+        while '\n' not in self._buffer:
+            wait = (None if deadline is None
+                    else max(deadline - time.time(), 0))
+            readable, _, _ = select.select([fd], [], [], wait)
+            if not readable:
+                raise errors.HookTimeoutError(
+                    'Hook did not answer within {0} seconds.'.format(timeout))
+            chunk = os.read(fd, 4096)
+            if not chunk:
+                line, self._buffer = self._buffer, ''
+                return line
+            self._buffer += chunk
+        line, self._buffer = self._buffer.split('\n', 1)
+        return line + '\n'
+
+    def _describe_failure(self, message):
+        """Append the hook's stderr to message."""
+        self._stderr.seek(0)
+        stderr = self._stderr.read()
+        self._stderr.seek(0, 2)
+        if stderr:
+            message = '{0} Printing stderr:\n{1}'.format(message, stderr)
+        return message
+
+    def _kill(self):
+        """Kill the hook process, along with its subprocesses."""
+        _kill_group(self._process.pid)
+        self._reap()
+
+    def _reap(self):
+        self._process.wait()
+        self._process.stdout.close()
+        self._stderr.close()
+        self._process = None
+
+    def stop(self):
+        """Ask the hook process to exit, killing it if it doesn't."""
+        with self._lock:
+            if self._process is None:
+                return
+            try:
+                self._process.stdin.close()
+            except IOError:
+                pass
+            deadline = time.time() + STOP_TIMEOUT
+            while self._process.poll() is None and time.time() < deadline:
+                time.sleep(_MAX_POLL_INTERVAL)
+            if self._process.poll() is None:
+                self._kill()
+            else:
+                self._reap()
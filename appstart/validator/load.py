@@ -0,0 +1,247 @@
+# Copyright 2015 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Drive HTTP requests at the application and measure its latency.
+
+run_load sends many concurrent requests as fast as the application answers
+them. run_probes sends one request at a time at a steady cadence, as a
+health checker does.
+"""
+
+# This file conforms to the external style guide.
+# pylint: disable=bad-indentation, g-bad-import-order
+
+import math
+import threading
+import time
+import requests
+
+
+class LoadResult(object):
+    """Latencies and errors of the requests sent by run_load."""
+
+    def __init__(self):
+        # [float, ...] The latencies of successful requests, in seconds.
+        self.latencies = []
+
+        # (int) The number of requests that failed or returned an error
+        # status code.
+        self.errors = 0
+
+        # (float) The time it took to send all requests, in seconds.
+        self.duration = 0.0
+
+    @property
+    def requests(self):
+        """The number of requests sent."""
+        return len(self.latencies) + self.errors
+
+    @property
+    def throughput(self):
+        """The number of requests completed per second."""
+        if not self.duration:
+            return 0.0
+        return self.requests / self.duration
+
+    @property
+    def error_rate(self):
+        """The fraction of requests that failed."""
+        if not self.requests:
+            return 0.0
+        return float(self.errors) / self.requests
+
+    def percentile(self, percent):
+        """Return a percentile of the latencies of successful requests.
+
+        Args:
+            percent: (float) The percentile, between 0 and 100.
+
+        Returns:
+            (float or None) The latency in seconds, by the nearest-rank
+            method, or None if no request succeeded.
+        """
+        if not self.latencies:
+            return None
+        latencies = sorted(self.latencies)
+        rank = int(math.ceil(percent / 100.0 * len(latencies)))
+        return latencies[max(rank, 1) - 1]
+
+    def get_metrics(self):
+        """Summarize the result.
+
+        Returns:
+            ({basestring: float}) The metrics, keyed by name. Latencies
+            are in seconds.
+        """
+        return {'requests': self.requests,
+                'p50': self.percentile(50),
+                'p95': self.percentile(95),
+                'p99': self.percentile(99),
+                'throughput': self.throughput,
+                'error_rate': self.error_rate}
+
+
+def run_load(url, num_requests, concurrency, timeout=None):
+    """Send GET requests to a url from several threads at once.
+
+    Each thread keeps its connection to the server open between requests.
+
+    Args:
+        url: (basestring) The url to request.
+        num_requests: (int) The total number of requests to send.
+        concurrency: (int) The number of requests to have in flight at
+            the same time.
+        timeout: (float or None) How long to wait for each response, in
+            seconds. Requests that time out count as errors.
+
+    Returns:
+        (LoadResult) The latencies and errors.
+    """
+    result = LoadResult()
+    lock = threading.Lock()
+
+    # The number of requests that are yet to be sent, in a list so that
+    # the workers can decrement it.
+    remaining = [num_requests]
+
+    def worker():
+        session = requests.Session()
+        latencies = []
+        errors = 0
+        try:
+            while True:
+                with lock:
+                    if not remaining[0]:
+                        break
+                    remaining[0] -= 1
+                start = time.time()
+                try:
+                    response = session.get(url, timeout=timeout)
+                    response.content  # pylint: disable=pointless-statement
+                except requests.RequestException:
+                    errors += 1
+                    continue
+                if response.status_code >= 400:
+                    errors += 1
+                else:
+                    latencies.append(time.time() - start)
+        finally:
+            session.close()
+            with lock:
+                result.latencies.extend(latencies)
+                result.errors += errors
+
+    threads = [threading.Thread(target=worker)
+               for _ in range(min(concurrency, num_requests))]
+    start = time.time()
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+    result.duration = time.time() - start
+    return result
+
+
+class ProbeResult(LoadResult):
+    """Latencies and outcomes of the probes sent by run_probes."""
+
+    def __init__(self):
+        super(ProbeResult, self).__init__()
+
+        # [bool, ...] Whether each probe succeeded, in the order they were
+        # sent.
+        self.outcomes = []
+
+    @property
+    def max_consecutive_failures(self):
+        """The length of the longest run of failed probes."""
+        longest = current = 0
+        for success in self.outcomes:
+            current = 0 if success else current + 1
+            longest = max(longest, current)
+        return longest
+
+    @property
+    def flaps(self):
+        """The number of times a failed probe followed a successful one."""
+        return sum(1 for previous, success in zip(self.outcomes,
+                                                  self.outcomes[1:])
+                   if previous and not success)
+
+    @property
+    def jitter(self):
+        """The mean difference between consecutive latencies, in seconds.
+
+        Only successful probes are considered. None if fewer than two
+        probes succeeded.
+        """
+        if len(self.latencies) < 2:
+            return None
+        return (sum(abs(b - a) for a, b in zip(self.latencies,
+                                               self.latencies[1:])) /
+                (len(self.latencies) - 1))
+
+    def get_metrics(self):
+        metrics = super(ProbeResult, self).get_metrics()
+        del metrics['throughput']
+        metrics.update({'jitter': self.jitter,
+                        'flaps': self.flaps,
+                        'max_consecutive_failures':
+                            self.max_consecutive_failures})
+        return metrics
+
+
+def run_probes(url, interval, duration, timeout=None):
+    """Send GET requests to a url, one at a time, at a steady cadence.
+
+    A probe succeeds if the server responds with status code 200 before
+    the timeout. Probes are sent every interval seconds, regardless of how
+    long the previous one took, unless it took longer than the interval.
+
+    Args:
+        url: (basestring) The url to request.
+        interval: (float) The time between the start of two probes, in
+            seconds.
+        duration: (float) How long to keep probing, in seconds. At least
+            one probe is sent.
+        timeout: (float or None) How long to wait for each response, in
+            seconds.
+
+    Returns:
+        (ProbeResult) The latencies and outcomes.
+    """
+    result = ProbeResult()
+    session = requests.Session()
+    num_probes = max(int(math.ceil(duration / float(interval))), 1)
+    start = time.time()
+    try:
+        for i in range(num_probes):
+            time.sleep(max(start + i * interval - time.time(), 0))
+            probe_start = time.time()
+            try:
+                response = session.get(url, timeout=timeout)
+                response.content  # pylint: disable=pointless-statement
+                success = response.status_code == 200
+            except requests.RequestException:
+                success = False
+            if success:
+                result.latencies.append(time.time() - probe_start)
+            else:
+                result.errors += 1
+            result.outcomes.append(success)
+    finally:
+        session.close()
+    result.duration = time.time() - start
+    return result
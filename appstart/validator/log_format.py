@@ -0,0 +1,563 @@
+# Copyright 2015 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Streaming validation of structured log files.
+
+Log files can grow to millions of lines during a load test, so they're read
+in large chunks rather than line by line, and every line is checked against
+a schema that's compiled once. Instead of stopping at the first bad line,
+all violations are counted, and the first few are kept as examples.
+
+Access logs can grow even larger, so they can also be sampled (see
+sample_lines).
+"""
+
+# This file conforms to the external style guide.
+# pylint: disable=bad-indentation, g-bad-import-order
+
+import calendar
+import collections
+import itertools
+import json
+import json.scanner
+import random
+import re
+
+from .. import utils
+
+# Kinds of violations.
+INVALID_JSON = 'invalid json'
+NOT_AN_OBJECT = 'not an object'
+MISSING_FIELD = 'missing field'
+BAD_FIELD = 'bad field'
+
+# The default number of violations to keep as examples.
+MAX_VIOLATIONS = 20
+
+# The size of the chunks that log files are read in.
+READ_SIZE = 16 * utils.CHUNK_SIZE
+
+# Violations longer than this are truncated in the report.
+_MAX_LINE_LENGTH = 200
+
+# A line of the Common Log Format, optionally followed by the referer and
+# user agent of the Combined (NCSA extended) Log Format. Quoted fields may
+# contain escaped quotes.
+_NCSA_LINE = re.compile(r'(?P<host>\S+) (?P<ident>\S+) (?P<user>\S+) '
+                        r'\[(?P<timestamp>[^\]]*)\] '
+                        r'"(?P<request>(?:[^"\\]|\\.)*)" '
+                        r'(?P<status>\S+) (?P<bytes>\S+)'
+                        r'(?: "(?:[^"\\]|\\.)*" "(?:[^"\\]|\\.)*")?\s*$')
+
+# e.g. 10/Oct/2000:13:55:36 -0700
+_NCSA_TIMESTAMP = re.compile(r'(\d{2})/([A-Z][a-z]{2})/(\d{4}):'
+                             r'(\d{2}):(\d{2}):(\d{2}) [+-](\d{2})(\d{2})$')
+
+# e.g. GET /index.html HTTP/1.1. The protocol is absent from HTTP/0.9
+# requests.
+_REQUEST = re.compile(r"[-!#$%&'*+.^_`|~0-9A-Za-z]+ \S+(?: HTTP/\d+\.\d+)?$")
+
+_STATUS = re.compile(r'[1-5]\d\d$')
+_BYTES = re.compile(r'(?:\d+|-)$')
+
+# Fields of the W3C Extended Log Format are separated by whitespace. Strings
+# are quoted, with quotes escaped by doubling them.
+_W3C_FIELD = re.compile(r'"(?:[^"]|"")*"|\S+')
+_W3C_DATE = re.compile(r'(\d{4})-(\d{2})-(\d{2})$')
+_W3C_TIME = re.compile(r'(\d{2}):(\d{2})(?::(\d{2})(?:\.\d+)?)?$')
+_W3C_TIME_TAKEN = re.compile(r'\d+(?:\.\d+)?$')
+
+_MONTHS = {name: number for number, name in enumerate(calendar.month_abbr)
+           if name}
+
+
+class LogReport(object):
+    """The result of validating a log file."""
+
+    def __init__(self, max_violations):
+        """Initializer for LogReport.
+
+        Args:
+            max_violations: (int) The number of violations to keep as
+                examples. The rest are only counted.
+        """
+        self.max_violations = max_violations
+
+        # (int) The number of lines that were checked.
+        self.lines = 0
+
+        # {basestring: int} The number of violations of each kind.
+        self.counts = {}
+
+        # [(int, basestring, basestring), ...] The line number, kinds and
+        # description of the first max_violations violations.
+        self.violations = []
+
+        # (int) The number of improperly formatted lines.
+        self.total = 0
+
+        # (bool) Whether only a sample of the lines was checked.
+        self.sampled = False
+
+    def add(self, line_number, kinds, detail, line):
+        """Record an improperly formatted line.
+
+        Args:
+            line_number: (int) The number of the offending line, from 1.
+                Negative numbers count from the end of the file.
+            kinds: ([basestring, ...]) The kinds of violation in the line.
+            detail: (basestring) What's wrong with the line.
+            line: (basestring) The offending line.
+        """
+        self.total += 1
+        for kind in kinds:
+            self.counts[kind] = self.counts.get(kind, 0) + 1
+        if len(self.violations) < self.max_violations:
+            if len(line) > _MAX_LINE_LENGTH:
+                line = line[:_MAX_LINE_LENGTH] + '...'
+            self.violations.append((line_number, ', '.join(kinds),
+                                    '{0}: "{1}"'.format(detail, line)))
+
+    def describe(self):
+        """Describe the violations, for a failure message.
+
+        Returns:
+            (basestring) The description.
+        """
+        lines = ['{0} of {1} {2}lines are improperly formatted ({3}).'.format(
+            self.total, self.lines, 'sampled ' if self.sampled else '',
+            ', '.join('{0}: {1}'.format(kind, count)
+                      for kind, count in sorted(self.counts.iteritems())))]
+        for line_number, _, detail in self.violations:
+            if line_number < 0:
+                lines.append('Line {0} from the end: {1}'.format(-line_number,
+                                                                 detail))
+            else:
+                lines.append('Line {0}: {1}'.format(line_number, detail))
+        if self.total > len(self.violations):
+            lines.append('({0} more)'.format(
+                self.total - len(self.violations)))
+        return '\n'.join(lines)
+
+
+class JsonLogValidator(object):
+    """Check that every line of a log is a JSON object with some fields.
+
+    Most lines of a log are valid, so they're checked on a fast path: the
+    first byte is checked, the line is parsed with json's scanner directly
+    and the schema is checked with set operations. Lines that don't pass are
+    checked again on a slower path, which finds the actual violation. It
+    scans the line's text for required field names before parsing it, since
+    lines that aren't JSON at all tend to come in large numbers.
+    """
+
+    def __init__(self, schema, max_violations=MAX_VIOLATIONS):
+        """Initializer for JsonLogValidator.
+
+        Args:
+            schema: ({basestring: list or None}) The fields each entry must
+                have. If the value of a field is a list, the field must be
+                an object with exactly those fields.
+            max_violations: (int) The number of violations to keep as
+                examples.
+        """
+        self._max_violations = max_violations
+        self._scan_once = json.scanner.make_scanner(json.JSONDecoder())
+        self._fields = sorted(schema)
+        self._field_set = frozenset(schema)
+        self._nested = [(field, frozenset(schema[field]),
+                         sorted(schema[field]))
+                        for field in self._fields
+                        if schema[field] is not None]
+
+        # Field names, as they appear in the raw text of an entry.
+        self._tokens = [(field, '"{0}"'.format(field))
+                        for field in self._fields]
+
+    def _is_valid(self, entry):
+        """Check a parsed object against the schema."""
+        if not self._field_set.issubset(entry):
+            return False
+        for field, subfields, _ in self._nested:
+            value = entry[field]
+            if (type(value) is not dict or len(value) != len(subfields) or
+                not subfields.issubset(value)):
+                return False
+        return True
+
+    def _check(self, line):
+        """Check a single line thoroughly.
+
+        Returns:
+            ((basestring, basestring) or None) The kind and description of
+            the violation, or None if the line is valid.
+        """
+        stripped = line.strip()
+        if not stripped.startswith('{'):
+            try:
+                self._scan_once(stripped, 0)
+            except (StopIteration, ValueError):
+                return INVALID_JSON, 'Not valid JSON'
+            return NOT_AN_OBJECT, 'Not a JSON object'
+
+        # Unless a field name is escaped, it appears verbatim in the line.
+        if '\\' not in stripped:
+            for field, token in self._tokens:
+                if token not in stripped:
+                    return MISSING_FIELD, 'Missing "{0}" field'.format(field)
+
+        try:
+            entry, end = self._scan_once(stripped, 0)
+        except (StopIteration, ValueError):
+            return INVALID_JSON, 'Not valid JSON'
+        if end != len(stripped):
+            return INVALID_JSON, 'Not valid JSON'
+
+        for field in self._fields:
+            if field not in entry:
+                return MISSING_FIELD, 'Missing "{0}" field'.format(field)
+        for field, subfields, names in self._nested:
+            value = entry[field]
+            if not isinstance(value, dict) or frozenset(value) != subfields:
+                return BAD_FIELD, '"{0}" must have fields {1}'.format(
+                    field, names)
+        return None
+
+    def validate(self, logfile):
+        """Check every line of a log file.
+
+        Blank lines are ignored.
+
+        Args:
+            logfile: (file-like object) The log file to be checked.
+
+        Returns:
+            (LogReport) The violations that were found.
+        """
+        report = LogReport(self._max_violations)
+        scan_once = self._scan_once
+        is_valid = self._is_valid
+        line_number = 0
+        blank_lines = 0
+        remainder = ''
+        while True:
+            chunk = logfile.read(READ_SIZE)
+            lines = (remainder + chunk).split('\n')
+
+            # The last line may continue in the next chunk.
+            remainder = lines.pop() if chunk else ''
+            for line in lines:
+                line_number += 1
+
+                # The fast path.
+                if line[:1] == '{':
+                    try:
+                        entry, end = scan_once(line, 0)
+                    except (StopIteration, ValueError):
+                        pass
+                    else:
+                        if end == len(line) and is_valid(entry):
+                            continue
+                elif not line or line.isspace():
+                    blank_lines += 1
+                    continue
+
+                violation = self._check(line)
+                if violation:
+                    report.add(line_number, [violation[0]], violation[1],
+                               line)
+            if not chunk:
+                report.lines = line_number - blank_lines
+                return report
+
+
+class _LineReader(object):
+    """Read the lines of a file in large chunks, keeping count."""
+
+    def __init__(self, logfile):
+        self._logfile = logfile
+
+        # (int) The number of lines read so far.
+        self.line_number = 0
+
+        # (int) The offset of the end of the last line read.
+        self.offset = 0
+
+    def __iter__(self):
+        """Iterate over the lines of the file.
+
+        Yields:
+            (int, basestring) The number of the line, from 1, and the line,
+            without its newline.
+        """
+        remainder = ''
+        while True:
+            chunk = self._logfile.read(READ_SIZE)
+            lines = (remainder + chunk).split('\n')
+            if chunk:
+                remainder = lines.pop()
+            elif not lines[-1]:
+                # The file ends with a newline.
+                lines.pop()
+            for line in lines:
+                self.line_number += 1
+                self.offset += len(line) + 1
+                yield self.line_number, line
+            if not chunk:
+                return
+
+
+def _read_last_lines(logfile, count, start, first_line_number):
+    """Read the last lines of a file, by seeking backwards from its end.
+
+    Args:
+        logfile: (file-like object) A seekable file.
+        count: (int) The number of lines to read.
+        start: (int) The offset before which lines must not be read.
+        first_line_number: (int) The number of the line at start.
+
+    Returns:
+        ([(int, basestring), ...]) The lines and their numbers. If lines
+        between start and the lines that were read were skipped, their
+        numbers are unknown, so they count from the end of the file
+        instead: -1 is the last line.
+    """
+    logfile.seek(0, 2)
+    position = logfile.tell()
+    data = ''
+    while position > start and data.count('\n') <= count:
+        step = min(READ_SIZE, position - start)
+        position -= step
+        logfile.seek(position)
+        data = logfile.read(step) + data
+
+    all_lines = data.split('\n')
+    if all_lines[-1] == '':
+        all_lines.pop()
+    if position > start:
+        # The first line is probably incomplete.
+        all_lines = all_lines[1:]
+    lines = all_lines[-count:]
+    if position > start:
+        return [(i - len(lines), line) for i, line in enumerate(lines)]
+    skipped = len(all_lines) - len(lines)
+    return [(first_line_number + skipped + i, line)
+            for i, line in enumerate(lines)]
+
+
+def sample_lines(logfile, first=0, last=0, random_lines=0, seed=None):
+    """Choose lines of a file to check.
+
+    The first and last lines are read directly, so that the time it takes
+    doesn't depend on the size of the file. Picking random lines requires
+    reading the whole file, though only the chosen lines are returned.
+    If no sampling parameters are given, all lines are returned.
+
+    Args:
+        logfile: (file-like object) The file to sample.
+        first: (int) The number of lines to take from the beginning.
+        last: (int) The number of lines to take from the end.
+        random_lines: (int) The number of lines to take from the rest of
+            the file, chosen uniformly at random.
+        seed: (hashable or None) Seed for choosing random lines.
+
+    Yields:
+        (int, basestring) Line numbers and lines, in the order they appear.
+        Line numbers are negative if they count from the end of the file.
+    """
+    reader = _LineReader(logfile)
+    lines = iter(reader)
+    if not (first or last or random_lines):
+        for item in lines:
+            yield item
+        return
+
+    for item in itertools.islice(lines, first):
+        yield item
+
+    if not random_lines:
+        if not last:
+            return
+        try:
+            tail = _read_last_lines(logfile, last, reader.offset,
+                                    reader.line_number + 1)
+        except (AttributeError, IOError):
+            # The file isn't seekable, so read through to its end.
+            tail = collections.deque(lines, maxlen=last)
+        for item in tail:
+            yield item
+        return
+
+    # Reservoir sampling, of the lines that don't make it to the tail.
+    rng = random.Random(seed)
+    tail = collections.deque(maxlen=last)
+    reservoir = []
+    seen = 0
+    for item in lines:
+        if last:
+            evicted = tail[0] if len(tail) == last else None
+            tail.append(item)
+            if evicted is None:
+                continue
+            item = evicted
+        seen += 1
+        if len(reservoir) < random_lines:
+            reservoir.append(item)
+        else:
+            index = rng.randint(0, seen - 1)
+            if index < random_lines:
+                reservoir[index] = item
+    for item in sorted(reservoir) + list(tail):
+        yield item
+
+
+class AccessLogValidator(object):
+    """Check that an access log is in a well known format.
+
+    Lines are parsed as Common Log Format, optionally with the referer and
+    user agent fields of the Combined Log Format. Once a W3C Extended Log
+    Format "#Fields" directive is seen, lines are parsed according to it
+    instead. The date, time, status and byte count fields are checked,
+    along with the request line of the Common Log Format.
+
+    When sampling, directives are only seen if they're in the sample, so
+    they should be at the top of the log.
+    """
+
+    def __init__(self, max_violations=MAX_VIOLATIONS):
+        """Initializer for AccessLogValidator.
+
+        Args:
+            max_violations: (int) The number of violations to keep as
+                examples.
+        """
+        self._max_violations = max_violations
+
+    @staticmethod
+    def _is_valid_date(year, month, day):
+        return 1 <= month <= 12 and 1 <= day <= calendar.monthrange(year,
+                                                                     month)[1]
+
+    @staticmethod
+    def _is_valid_time(hours, minutes, seconds):
+        # Leap seconds are allowed.
+        return hours < 24 and minutes < 60 and seconds <= 60
+
+    def _check_ncsa(self, line):
+        """Check a line of the Common or Combined Log Format.
+
+        Returns:
+            ([basestring, ...]) The names of the fields that are invalid.
+        """
+        match = _NCSA_LINE.match(line)
+        if not match:
+            return ['structure']
+
+        bad_fields = []
+        timestamp = _NCSA_TIMESTAMP.match(match.group('timestamp'))
+        if not (timestamp and
+                timestamp.group(2) in _MONTHS and
+                self._is_valid_date(int(timestamp.group(3)),
+                                    _MONTHS[timestamp.group(2)],
+                                    int(timestamp.group(1))) and
+                self._is_valid_time(*[int(timestamp.group(i))
+                                      for i in (4, 5, 6)]) and
+                int(timestamp.group(7)) <= 14 and
+                int(timestamp.group(8)) < 60):
+            bad_fields.append('timestamp')
+        request = match.group('request')
+        if request != '-' and not _REQUEST.match(request):
+            bad_fields.append('request')
+        if not _STATUS.match(match.group('status')):
+            bad_fields.append('status')
+        if not _BYTES.match(match.group('bytes')):
+            bad_fields.append('bytes')
+        return bad_fields
+
+    def _check_w3c(self, line, fields):
+        """Check a line of the W3C Extended Log Format.
+
+        Args:
+            line: (basestring) The line.
+            fields: ([basestring, ...]) The field identifiers, from the last
+                "#Fields" directive.
+
+        Returns:
+            ([basestring, ...]) The names of the fields that are invalid.
+        """
+        values = _W3C_FIELD.findall(line)
+        if len(values) != len(fields):
+            return ['structure']
+
+        bad_fields = []
+        for field, value in zip(fields, values):
+            if value == '-':
+                continue
+            if field == 'date':
+                match = _W3C_DATE.match(value)
+                valid = match and self._is_valid_date(
+                    *[int(group) for group in match.groups()])
+            elif field == 'time':
+                match = _W3C_TIME.match(value)
+                valid = match and self._is_valid_time(
+                    *[int(group or 0) for group in match.groups()])
+            elif field == 'time-taken':
+                valid = _W3C_TIME_TAKEN.match(value)
+            elif field.endswith('status'):
+                valid = _STATUS.match(value)
+            elif field.endswith('bytes'):
+                valid = _BYTES.match(value)
+            else:
+                valid = True
+            if not valid:
+                bad_fields.append(field)
+        return bad_fields
+
+    def validate(self, logfile, first=0, last=0, random_lines=0, seed=None):
+        """Check the lines of an access log.
+
+        Blank lines are ignored. By default, all lines are checked. See
+        sample_lines for the sampling parameters.
+
+        Args:
+            logfile: (file-like object) The log file to be checked.
+            first: (int) The number of lines to check at the beginning.
+            last: (int) The number of lines to check at the end.
+            random_lines: (int) The number of other lines to check.
+            seed: (hashable or None) Seed for choosing random lines.
+
+        Returns:
+            (LogReport) The violations that were found.
+        """
+        report = LogReport(self._max_violations)
+        report.sampled = bool(first or last or random_lines)
+        w3c_fields = None
+        for line_number, line in sample_lines(logfile, first, last,
+                                              random_lines, seed):
+            if not line or line.isspace():
+                continue
+            if line.startswith('#'):
+                if line.startswith('#Fields:'):
+                    w3c_fields = line[len('#Fields:'):].split()
+                continue
+
+            report.lines += 1
+            if w3c_fields is None:
+                bad_fields = self._check_ncsa(line)
+            else:
+                bad_fields = self._check_w3c(line, w3c_fields)
+            if bad_fields:
+                report.add(line_number, bad_fields,
+                           'Invalid {0}'.format(', '.join(bad_fields)), line)
+        return report
@@ -0,0 +1,230 @@
+# Copyright 2015 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Shared, read-only views of the application's log directory.
+
+Several clauses of the runtime contract inspect the logs that the
+application writes to LOG_LOCATION. Rather than have each of them copy the
+directory out of the container, they read through a LogSnapshot, which is
+shared by all clauses of a lifecycle point (see SnapshotCache).
+"""
+
+# This file conforms to the external style guide.
+# pylint: disable=bad-indentation, g-bad-import-order
+
+import os
+import posixpath
+import shutil
+import tempfile
+import threading
+
+from ..sandbox import container
+from .. import utils
+from ..utils import get_logger
+
+# Absolute path to directory where the application is expected to write logs.
+LOG_LOCATION = '/var/log/app_engine'
+
+
+class LogSnapshot(object):
+    """A view of LOG_LOCATION inside the application container.
+
+    If the directory is bind mounted from a path that's readable on this
+    machine, files are read from there directly. Otherwise, the directory is
+    copied out of the container once, the first time it's needed.
+
+    All paths are absolute paths inside the container.
+    """
+
+    def __init__(self, app_container, host_path=None):
+        """Initializer for LogSnapshot.
+
+        Args:
+            app_container: (sandbox.container.Container) The container that
+                writes the logs.
+            host_path: (basestring or None) The local path where
+                LOG_LOCATION is mounted, if any.
+        """
+        self._app_container = app_container
+        self._host_path = host_path
+        self._tar = None
+        self._missing = False
+        self._lock = threading.Lock()
+
+    def _relative(self, path):
+        """Return path relative to LOG_LOCATION.
+
+        Raises:
+            ValueError: If path is not inside LOG_LOCATION.
+        """
+        path = posixpath.normpath(path)
+        if path == LOG_LOCATION:
+            return ''
+        if not path.startswith(LOG_LOCATION + '/'):
+            raise ValueError('"{0}" is not inside {1}.'.format(path,
+                                                                LOG_LOCATION))
+        return path[len(LOG_LOCATION) + 1:]
+
+    def _get_tar(self):
+        """Copy LOG_LOCATION out of the container, if not done already.
+
+        Returns:
+            (utils.TarWrapper or None) The archive, or None if LOG_LOCATION
+            doesn't exist in the container.
+        """
+        with self._lock:
+            if self._tar is None and not self._missing:
+                get_logger().debug('Copying %s out of the application '
+                                   'container', LOG_LOCATION)
+                try:
+                    self._tar = self._app_container.extract_tar(LOG_LOCATION)
+                except IOError:
+                    self._missing = True
+            return self._tar
+
+    def _arcname(self, path):
+        return posixpath.join(posixpath.basename(LOG_LOCATION),
+                              self._relative(path))
+
+    def _host_name(self, path):
+        return os.path.join(self._host_path, self._relative(path))
+
+    def exists(self, path):
+        """Check whether a file or directory exists at path.
+
+        Args:
+            path: (basestring) The path, inside LOG_LOCATION.
+
+        Returns:
+            (bool) Whether or not path exists.
+        """
+        if self._host_path:
+            return os.path.exists(self._host_name(path))
+        tar = self._get_tar()
+        return bool(tar) and tar.exists(self._arcname(path))
+
+    def list(self, path):
+        """List the contents of a directory.
+
+        Args:
+            path: (basestring) The path to the directory, inside
+                LOG_LOCATION.
+
+        Raises:
+            IOError: If path doesn't exist.
+            ValueError: If path is not a directory.
+
+        Returns:
+            ([basestring, ...], [basestring, ...]) The names of the files
+            and of the directories inside path.
+        """
+        if self._host_path:
+            host_name = self._host_name(path)
+            if not os.path.exists(host_name):
+                raise IOError('No such directory: {0}'.format(path))
+            if not os.path.isdir(host_name):
+                raise ValueError('"{0}" is not a directory.'.format(path))
+            names = sorted(os.listdir(host_name))
+            return ([n for n in names
+                     if os.path.isfile(os.path.join(host_name, n))],
+                    [n for n in names
+                     if os.path.isdir(os.path.join(host_name, n))])
+
+        if not self.exists(path):
+            raise IOError('No such directory: {0}'.format(path))
+        return self._get_tar().list(self._arcname(path))
+
+    def open(self, path):
+        """Open a file for reading.
+
+        Args:
+            path: (basestring) The path to the file, inside LOG_LOCATION.
+
+        Raises:
+            IOError: If path doesn't exist.
+            ValueError: If path is not a file.
+
+        Returns:
+            (file-like object) The contents of the file.
+        """
+        if self._host_path:
+            host_name = self._host_name(path)
+            if os.path.isdir(host_name):
+                raise ValueError('"{0}" is not a file.'.format(path))
+            return open(host_name)
+
+        if not self.exists(path):
+            raise IOError('No such file: {0}'.format(path))
+
+        # Members of the archive share its underlying file, so they can't
+        # be read from several threads at once. Hand out a copy instead.
+        with self._lock:
+            member = self._tar.get_file(self._arcname(path))
+            logfile = tempfile.SpooledTemporaryFile(
+                max_size=container.TAR_SPOOL_MAX_SIZE)
+            shutil.copyfileobj(member, logfile, utils.CHUNK_SIZE)
+        logfile.seek(0)
+        return logfile
+
+
+class SnapshotCache(object):
+    """Hands out one LogSnapshot per container and lifecycle point.
+
+    The application keeps writing logs while the validator runs, so a
+    snapshot is only reused by clauses of the same lifecycle point.
+    """
+
+    def __init__(self, host_path=None):
+        """Initializer for SnapshotCache.
+
+        Args:
+            host_path: (basestring or None) The local path where
+                LOG_LOCATION is mounted, if any.
+        """
+        self.host_path = host_path
+        self._point = None
+
+        # {basestring: LogSnapshot} Snapshots of the current lifecycle
+        # point, keyed by container id.
+        self._snapshots = {}
+        self._lock = threading.Lock()
+
+    def invalidate(self, point=None):
+        """Discard the snapshots, unless they were taken for point.
+
+        Args:
+            point: (int or None) The lifecycle point about to be evaluated.
+                If None, snapshots are discarded unconditionally.
+        """
+        with self._lock:
+            if point is None or point != self._point:
+                self._snapshots = {}
+            self._point = point
+
+    def get(self, app_container):
+        """Return the snapshot of app_container's logs.
+
+        Args:
+            app_container: (sandbox.container.Container) The container
+                that writes the logs.
+
+        Returns:
+            (LogSnapshot) The snapshot for the current lifecycle point.
+        """
+        with self._lock:
+            snapshot = self._snapshots.get(app_container.get_id())
+            if snapshot is None:
+                snapshot = LogSnapshot(app_container, self.host_path)
+                self._snapshots[app_container.get_id()] = snapshot
+            return snapshot
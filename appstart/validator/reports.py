@@ -0,0 +1,263 @@
+# Copyright 2015 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Machine-readable reports of validation results.
+
+A report writer receives one record per evaluated clause, as soon as its
+outcome is known, and writes it to a stream right away. That way, a report
+is useful even if validation is interrupted.
+
+Records are dicts with the following keys:
+    name: (basestring) The name of the clause.
+    title: (basestring) The title of the clause.
+    lifecycle_point: (basestring) The name of the clause's lifecycle point.
+    outcome: (basestring) One of PASSED, FAILED, ERROR or SKIPPED.
+    error_level: (basestring) The name of the clause's error level.
+    start_time: (float or None) When evaluation started, in seconds since
+        the epoch.
+    end_time: (float or None) When evaluation finished.
+    duration: (float or None) The time evaluation took, in seconds.
+    message: (basestring or None) The failure message, traceback or skip
+        reason.
+    metrics: ({basestring: object} or None) Measurements recorded by the
+        clause, such as latencies.
+    hook_usage: ({basestring: object} or None) For hook clauses that have
+        been run, the resources the hook used. See hooks.HookRun.get_usage.
+    dependencies: ([basestring, ...]) The names of all clauses that the
+        clause depends on, directly or not, nearest first.
+    sandbox: (basestring) Only in reports that merge the results of
+        several sandboxes: the name of the sandbox that the clause was
+        evaluated against. Steps of the execution plan have it too. See
+        batch.py.
+"""
+
+# This file conforms to the external style guide.
+# pylint: disable=bad-indentation, g-bad-import-order
+
+import json
+import time
+from xml.sax import saxutils
+
+PASSED = 'PASSED'
+FAILED = 'FAILED'
+ERROR = 'ERROR'
+SKIPPED = 'SKIPPED'
+
+
+def dependency_chain(clause_class):
+    """List the clauses that a clause depends on, directly or not.
+
+    Args:
+        clause_class: (type) A subclass of contract.ContractClause.
+
+    Returns:
+        ([basestring, ...]) The names of the dependencies, in breadth-first
+        order. Dependencies at the same depth are sorted by name.
+    """
+    chain = []
+    seen = set()
+    frontier = [clause_class]
+    while frontier:
+        next_frontier = []
+        for cls in frontier:
+            for dep in sorted(cls.dependencies, key=lambda c: c.__name__):
+                if dep not in seen:
+                    seen.add(dep)
+                    chain.append(dep.__name__)
+                    next_frontier.append(dep)
+        frontier = next_frontier
+    return chain
+
+
+def read_json_report(path):
+    """Read a report written by JsonReportWriter.
+
+    Args:
+        path: (basestring) The path of the report.
+
+    Returns:
+        (dict or None, [dict, ...], dict or None) The plan object, the
+        clause records and the summary object. A report that was cut short
+        may lack a summary, or even a plan.
+
+    Raises:
+        IOError: If the report can't be read.
+    """
+    plan = summary = None
+    records = []
+    with open(path) as report:
+        for line in report:
+            try:
+                obj = json.loads(line)
+            except ValueError:
+                # The last line may be incomplete.
+                break
+            obj_type = obj.pop('type', None)
+            if obj_type == 'plan':
+                plan = obj
+            elif obj_type == 'clause':
+                records.append(obj)
+            elif obj_type == 'summary':
+                summary = obj
+    return plan, records, summary
+
+
+class ReportWriter(object):
+    """Base class for report writers."""
+
+    def __init__(self, stream):
+        """Initializer for ReportWriter.
+
+        Args:
+            stream: (file-like object) The stream to write the report to.
+        """
+        self._stream = stream
+        self._start_time = None
+
+    def _write(self, data):
+        self._stream.write(data)
+        self._stream.flush()
+
+    def start(self, execution_plan, start_time=None):
+        """Begin the report.
+
+        Args:
+            execution_plan: ([dict, ...]) The execution plan of the
+                contract, as in ContractValidator.execution_plan.
+            start_time: (float or None) When validation started, in seconds
+                since the epoch. Now, if None.
+        """
+        self._start_time = start_time or time.time()
+
+    def add_result(self, record):
+        """Write the outcome of a single clause.
+
+        Args:
+            record: (dict) The outcome, as described in the module
+                docstring.
+        """
+        raise NotImplementedError('add_result must be implemented by '
+                                  'classes that extend ReportWriter')
+
+    def finish(self, success):
+        """End the report.
+
+        Args:
+            success: (bool) Whether or not validation was successful.
+        """
+        raise NotImplementedError('finish must be implemented by '
+                                  'classes that extend ReportWriter')
+
+
+class JsonReportWriter(ReportWriter):
+    """Write the report as JSON, one object per line.
+
+    The first line describes the execution plan, and the last one
+    summarizes the validation. Every line in between is a clause record.
+    Each object has a "type" key, which is one of "plan", "clause" or
+    "summary".
+    """
+
+    def _write_object(self, obj):
+        self._write(json.dumps(obj, sort_keys=True) + '\n')
+
+    def start(self, execution_plan, start_time=None):
+        super(JsonReportWriter, self).start(execution_plan, start_time)
+        self._write_object({'type': 'plan',
+                            'start_time': self._start_time,
+                            'execution_plan': execution_plan})
+
+    def add_result(self, record):
+        obj = dict(record)
+        obj['type'] = 'clause'
+        self._write_object(obj)
+
+    def finish(self, success):
+        end_time = time.time()
+        self._write_object({'type': 'summary',
+                            'success': success,
+                            'end_time': end_time,
+                            'duration': end_time - self._start_time})
+
+
+class JUnitReportWriter(ReportWriter):
+    """Write the report in the JUnit XML format.
+
+    Each lifecycle point becomes a <testsuite>, and each clause a
+    <testcase>. In merged reports, suites are named after the sandbox as
+    well, as in "frontend.Post Start". Since the report is written
+    incrementally, test suites don't carry the usual count attributes.
+    """
+
+    def __init__(self, stream):
+        super(JUnitReportWriter, self).__init__(stream)
+        self._suite = None
+
+    def start(self, execution_plan, start_time=None):
+        super(JUnitReportWriter, self).start(execution_plan, start_time)
+        self._write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                    '<testsuites>\n')
+
+    def _close_suite(self):
+        if self._suite is not None:
+            self._write('  </testsuite>\n')
+            self._suite = None
+
+    def add_result(self, record):
+        suite = record['lifecycle_point']
+        if record.get('sandbox'):
+            suite = '{0}.{1}'.format(record['sandbox'], suite)
+        if suite != self._suite:
+            self._close_suite()
+            self._suite = suite
+            self._write('  <testsuite name={0}>\n'.format(
+                saxutils.quoteattr(suite)))
+
+        lines = ['    <testcase classname={0} name={1} time="{2:.3f}">'.format(
+            saxutils.quoteattr(suite),
+            saxutils.quoteattr(record['name']),
+            record['duration'] or 0)]
+        message = record['message'] or ''
+        summary = saxutils.quoteattr(message.splitlines()[0]
+                                     if message else '')
+        if record['outcome'] == SKIPPED:
+            lines.append('      <skipped message={0}/>'.format(summary))
+        elif record['outcome'] in (FAILED, ERROR):
+            tag = 'failure' if record['outcome'] == FAILED else 'error'
+            lines.append('      <{0} type={1} message={2}>{3}</{0}>'.format(
+                tag, saxutils.quoteattr(record['error_level']), summary,
+                saxutils.escape(message)))
+        properties = sorted((record.get('metrics') or {}).items())
+        properties.extend(
+            ('hook_' + name, value)
+            for name, value in sorted((record.get('hook_usage') or
+                                       {}).items()))
+        if properties:
+            lines.append('      <properties>')
+            lines.extend(
+                '        <property name={0} value={1}/>'.format(
+                    saxutils.quoteattr(name), saxutils.quoteattr(str(value)))
+                for name, value in properties)
+            lines.append('      </properties>')
+        lines.append('    </testcase>\n')
+        self._write('\n'.join(lines))
+
+    def finish(self, success):
+        self._close_suite()
+        self._write('</testsuites>\n')
+
+
+# {basestring: type} Report writers, by the name of their format.
+REPORT_FORMATS = {'json': JsonReportWriter,
+                  'junit': JUnitReportWriter}
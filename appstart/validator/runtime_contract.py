@@ -6,12 +6,14 @@
 # see: https://www.python.org/dev/peps/pep-0008/.
 # pylint: disable=bad-indentation, g-bad-import-order
 
-import json
 import os
-import re
 import requests
+import unittest
 
 import contract
+import load
+import log_format
+import log_snapshot
 
 
 # Fields that diagnostic log entries are required to have.
@@ -20,8 +22,12 @@ _DIAGNOSTIC_FIELDS = ['timestamp', 'severity', 'thread', 'message']
 # Fields that a diagnostic log's timestamp are supposed to have.
 _TIMESTAMP_FIELDS = ['seconds', 'nanos']
 
+# The schema that diagnostic log entries are checked against.
+_DIAGNOSTIC_SCHEMA = dict.fromkeys(_DIAGNOSTIC_FIELDS)
+_DIAGNOSTIC_SCHEMA['timestamp'] = _TIMESTAMP_FIELDS
+
 # Absolute path to directory where the application is expected to write logs.
-_LOG_LOCATION = '/var/log/app_engine'
+_LOG_LOCATION = log_snapshot.LOG_LOCATION
 
 # Diagnostic log location
 _DLOG_LOCATION = os.path.join(_LOG_LOCATION, 'app.log.json')
@@ -50,62 +56,134 @@ class LogFormatChecker(object):
           - thread
           - message
 
-    For access logs, it seems that they're supposed to be
-    in Common Log or Extended format. It's not immediately clear if or how
-    this is enforced.
+    Access logs must be in the Common Log Format, the Combined (NCSA
+    extended) Log Format or the W3C Extended Log Format. Large access logs
+    are sampled.
     """
 
+    # The number of improperly formatted lines to report. The rest are only
+    # counted.
+    max_log_violations = log_format.MAX_VIOLATIONS
+
+    # The number of access log lines to check at the beginning and at the
+    # end of the log, and the number to choose at random from the rest.
+    # Choosing lines at random requires reading the whole log, so it's off
+    # by default. If all are 0, every line is checked.
+    access_log_first_lines = 10000
+    access_log_last_lines = 10000
+    access_log_random_lines = 0
+
     def check_json_log_format(self, logfile):
         """Check if a log file conforms to the proper json format.
 
         Args:
             logfile: (file-like object) The log file to be checked.
         """
-        for line in logfile:
-            if line:
-                try:
-                    logmsg = json.loads(line)
-                except ValueError:
-                    self.fail('Improperly formatted line: "{0}"'.format(line))
-
-                for field in _DIAGNOSTIC_FIELDS:
-                    self.assertIn(
-                        field,
-                        logmsg,
-                        'Log message missing "{0}" field: {1}'.format(field,
-                                                                      line))
-
-                ts = logmsg['timestamp']
-                if not isinstance(ts, dict) or ts.keys() != _TIMESTAMP_FIELDS:
-                    self.fail('{0}\nTimestamps must have fields: '
-                              '"{1}"'.format(line, _TIMESTAMP_FIELDS))
+        validator = log_format.JsonLogValidator(_DIAGNOSTIC_SCHEMA,
+                                                self.max_log_violations)
+        report = validator.validate(logfile)
+        if report.total:
+            self.fail(report.describe())
 
     def check_access_log_format(self, logfile):
         """Check if a log file conforms to the Common Log or Extended formats.
 
-        (Currently not implemented)
+        Only a sample of the lines is checked, as configured by the
+        access_log_* attributes.
 
         Args:
             logfile: (file-like object) The log file to be checked.
         """
-
-        # TODO(gouzenko): *ACTUALLY* figure out how to do this in the best way
-        common_log_format = re.compile(r'(\S*) '
-                                       r'(\S*) '
-                                       r'(\S*) '
-                                       r'\[([^]]*)\] '
-                                       r'"([^"]*)" '
-                                       r'(\S*) '
-                                       r'(\S*)')
-        full_line = False
-        for line in logfile:
-            if line:
-                full_line = True
-                match = common_log_format.match(line)
-                if not match:
-                    self.fail('Improperly formatted line:"{0}"'.format(line))
-        if not full_line:
+        validator = log_format.AccessLogValidator(self.max_log_violations)
+        report = validator.validate(logfile,
+                                    first=self.access_log_first_lines,
+                                    last=self.access_log_last_lines,
+                                    random_lines=self.access_log_random_lines)
+        if not report.lines:
             self.fail('No access logs found in log file.')
+        if report.total:
+            self.fail(report.describe())
+
+
+def _latency_problems(metrics, max_p50, max_p95, max_p99):
+    """Compare latency percentiles to their thresholds.
+
+    Args:
+        metrics: ({basestring: float}) Metrics with p50, p95 and p99
+            latencies, as from load.LoadResult.get_metrics.
+        max_p50: (float or None) The threshold on the p50 latency, in
+            seconds. None is not checked.
+        max_p95: (float or None) Likewise, for p95.
+        max_p99: (float or None) Likewise, for p99.
+
+    Returns:
+        ([basestring, ...]) A description of each exceeded threshold.
+    """
+    problems = []
+    for name, threshold in (('p50', max_p50), ('p95', max_p95),
+                            ('p99', max_p99)):
+        latency = metrics[name]
+        if threshold is not None and latency is not None and (
+            latency > threshold):
+            problems.append('{0} latency of {1:.3f}s is above '
+                            '{2:.3f}s'.format(name, latency, threshold))
+    return problems
+
+
+class LoadTester(object):
+    """Class to give clauses the ability to put the application under load.
+
+    Clauses set the amount of load and the thresholds that the results are
+    held to with class attributes. A threshold of None is not checked.
+    """
+
+    # The path to request, and how many requests to send, how many at once.
+    load_path = '/_ah/health'
+    load_requests = 500
+    load_concurrency = 10
+
+    # How long to wait for a single response, in seconds.
+    load_timeout = 10
+
+    # Thresholds on latency percentiles, in seconds.
+    max_p50_latency = None
+    max_p95_latency = None
+    max_p99_latency = 1.0
+
+    # Thresholds on requests per second and on the fraction of requests
+    # that fail.
+    min_throughput = None
+    max_error_rate = 0.01
+
+    def check_load(self, host, port):
+        """Send load to the application and check the results.
+
+        The results are recorded in the clause's metrics.
+
+        Args:
+            host: (basestring) The host to send requests to.
+            port: (int) The port to send requests to.
+        """
+        url = 'http://{0}:{1}{2}'.format(host, port, self.load_path)
+        result = load.run_load(url, self.load_requests,
+                               self.load_concurrency,
+                               timeout=self.load_timeout)
+        self.metrics = result.get_metrics()
+
+        problems = _latency_problems(self.metrics, self.max_p50_latency,
+                                     self.max_p95_latency,
+                                     self.max_p99_latency)
+        if (self.min_throughput is not None and
+            result.throughput < self.min_throughput):
+            problems.append('Throughput of {0:.1f} requests/s is below '
+                            '{1:.1f}'.format(result.throughput,
+                                             self.min_throughput))
+        if (self.max_error_rate is not None and
+            result.error_rate > self.max_error_rate):
+            problems.append('{0} of {1} requests to {2} failed'.format(
+                result.errors, result.requests, url))
+        if problems:
+            self.fail('\n'.join(problems))
 
 
 class HealthChecksEnabledClause(contract.ContractClause):
@@ -114,7 +192,9 @@ class HealthChecksEnabledClause(contract.ContractClause):
     description = 'Container can enable health checks in configuration'
     lifecycle_point = contract.PRE_START
     error_level = contract.UNUSED
-    tags = {'health'}
+
+    # The soak depends on this clause, so it runs for '--tags soak' too.
+    tags = {'health', 'soak'}
 
     def evaluate_clause(self, app_container):
         self.assertTrue(app_container.configuration.health_checks_enabled)
@@ -128,11 +208,11 @@ class HealthCheckClause(contract.ContractClause):
     lifecycle_point = contract.POST_START
     error_level = contract.FATAL
     dependencies = {HealthChecksEnabledClause}
-    tags = {'health'}
+    tags = {'health', 'soak'}
 
     def evaluate_clause(self, app_container):
         url = 'http://{0}:{1}/_ah/health'.format(app_container.host,
-                                                 8080)
+                                                 self.sandbox.port)
         rep = requests.get(url)
         self.assertEqual(rep.status_code,
                          200,
@@ -141,6 +221,63 @@ class HealthCheckClause(contract.ContractClause):
                          'health checks.')
 
 
+class HealthCheckSoakClause(contract.ContractClause):
+    """Validate that the application stays healthy under steady probing.
+
+    Probes '_ah/health' at the interval and with the timeout that the
+    production health checker uses, as configured in the application's
+    configuration file, for soak_duration seconds. The clause is skipped
+    unless a soak duration is given with --soak_duration.
+    """
+
+    title = 'Health check stability'
+    description = ('Endpoint /_ah/health must keep responding promptly with '
+                   'status code 200 when probed like the health checker does')
+    lifecycle_point = contract.LOAD
+    error_level = contract.WARNING
+    dependencies = {HealthCheckClause}
+    tags = {'health', 'soak'}
+
+    # Thresholds on latency percentiles, in seconds. A threshold of None is
+    # not checked. Probes that take longer than the health check timeout
+    # fail regardless.
+    max_p50_latency = None
+    max_p95_latency = 0.5
+    max_p99_latency = None
+
+    # The number of times the application may go from healthy to failing.
+    # A single blip is tolerated, like the health checker does.
+    max_flaps = 1
+
+    def evaluate_clause(self, app_container):
+        if not self.soak_duration:
+            raise unittest.SkipTest('No soak duration was given. Use '
+                                    '--soak_duration to probe the health '
+                                    'check endpoint.')
+        options = app_container.configuration.health_check_options
+        url = 'http://{0}:{1}/_ah/health'.format(app_container.host,
+                                                 self.sandbox.port)
+        result = load.run_probes(url, options['check_interval_sec'],
+                                 self.soak_duration,
+                                 timeout=options['timeout_sec'])
+        self.metrics = result.get_metrics()
+
+        problems = _latency_problems(self.metrics, self.max_p50_latency,
+                                     self.max_p95_latency,
+                                     self.max_p99_latency)
+        if result.max_consecutive_failures >= options['unhealthy_threshold']:
+            problems.append(
+                '{0} consecutive health checks failed; the health checker '
+                'marks an instance unhealthy after {1}'.format(
+                    result.max_consecutive_failures,
+                    options['unhealthy_threshold']))
+        if self.max_flaps is not None and result.flaps > self.max_flaps:
+            problems.append('Health checks started failing {0} times after '
+                            'succeeding'.format(result.flaps))
+        if problems:
+            self.fail('\n'.join(problems))
+
+
 class AccessLogLocationClause(contract.ContractClause):
     """Validate that the application writes access logs to correct location.
 
@@ -155,9 +292,7 @@ class AccessLogLocationClause(contract.ContractClause):
     tags = {'logging'}
 
     def evaluate_clause(self, app_container):
-        try:
-            _ = app_container.extract_tar(_ALOG_LOCATION)
-        except IOError:
+        if not self.get_log_snapshot(app_container).exists(_ALOG_LOCATION):
             self.fail('No log file found at {0}'.format(_ALOG_LOCATION))
 
 
@@ -178,8 +313,7 @@ class AccessLogFormatClause(contract.ContractClause, LogFormatChecker):
     tags = {'logging'}
 
     def evaluate_clause(self, app_container):
-        logfile_tar = app_container.extract_tar(_ALOG_LOCATION)
-        logfile = logfile_tar.get_file(os.path.basename(_ALOG_LOCATION))
+        logfile = self.get_log_snapshot(app_container).open(_ALOG_LOCATION)
         self.check_access_log_format(logfile)
 
 
@@ -196,9 +330,7 @@ class CustomLogLocationClause(contract.ContractClause):
     tags = {'logging'}
 
     def evaluate_clause(self, app_container):
-        try:
-            _ = app_container.extract_tar(_CLOG_LOCATION)
-        except IOError:
+        if not self.get_log_snapshot(app_container).exists(_CLOG_LOCATION):
             self.fail('Custom logs directory not found at '
                       '{0}'.format(_CLOG_LOCATION))
 
@@ -216,14 +348,12 @@ class CustomLogFormatClause(contract.ContractClause, LogFormatChecker):
     tags = {'logging'}
 
     def evaluate_clause(self, app_container):
-        custom_logs_tar = app_container.extract_tar(_CLOG_LOCATION)
-        custom_logs_root = os.path.basename(_CLOG_LOCATION)
-        files, dirs = custom_logs_tar.list(custom_logs_root)
+        snapshot = self.get_log_snapshot(app_container)
+        files, dirs = snapshot.list(_CLOG_LOCATION)
 
         for f in files:
             if f.endswith('.log.json'):
-                logfile = custom_logs_tar.get_file(
-                    os.path.join(custom_logs_root, f))
+                logfile = snapshot.open(os.path.join(_CLOG_LOCATION, f))
                 self.check_json_log_format(logfile)
 
             elif not f.endswith('.log'):
@@ -251,9 +381,7 @@ class DiagnosticLogLocationClause(contract.ContractClause):
     tags = {'logging'}
 
     def evaluate_clause(self, app_container):
-        try:
-            _ = app_container.extract_tar(_DLOG_LOCATION)
-        except (ValueError, IOError):
+        if not self.get_log_snapshot(app_container).exists(_DLOG_LOCATION):
             self.fail('Could not find log file at {0}'.format(_DLOG_LOCATION))
 
 
@@ -268,11 +396,83 @@ class DiagnosticLogFormatClause(contract.ContractClause, LogFormatChecker):
     tags = {'logging'}
 
     def evaluate_clause(self, app_container):
-        logfile_tar = app_container.extract_tar(_DLOG_LOCATION)
-        logfile = logfile_tar.get_file(os.path.basename(_DLOG_LOCATION))
+        logfile = self.get_log_snapshot(app_container).open(_DLOG_LOCATION)
         self.check_json_log_format(logfile)
 
 
+class DirectLoadClause(contract.ContractClause, LoadTester):
+    """Validate that the application performs well under load."""
+
+    title = 'Load on the application'
+    description = ('Latencies and error rate of concurrent requests sent '
+                   'directly to the application must be within bounds')
+    lifecycle_point = contract.LOAD
+    error_level = contract.WARNING
+    dependencies = {HealthCheckClause}
+    tags = {'load'}
+
+    def evaluate_clause(self, app_container):
+        self.check_load(app_container.host, self.sandbox.port)
+
+
+class ProxyLoadClause(contract.ContractClause, LoadTester):
+    """Validate that the application performs well behind devappserver."""
+
+    title = 'Load through the proxy'
+    description = ('Latencies and error rate of concurrent requests sent '
+                   'through the devappserver proxy must be within bounds')
+    lifecycle_point = contract.LOAD
+    error_level = contract.WARNING
+    dependencies = {HealthCheckClause}
+    before = {DirectLoadClause}
+    tags = {'load'}
+
+    def evaluate_clause(self, app_container):
+        if not self.sandbox.run_devappserver:
+            raise unittest.SkipTest('The api server is not running.')
+        self.check_load(app_container.host, self.sandbox.proxy_port)
+
+
+class ResourceUsageClause(contract.ContractClause):
+    """Validate that the application's memory usage stays within bounds.
+
+    Memory usage is taken from the sandbox's resource usage samples (see
+    sandbox/stats.py), leaving out those taken while the application was
+    warming up. Since the clause runs after the load clauses, the samples
+    cover the application under load.
+    """
+
+    title = 'Resource usage'
+    description = 'Memory usage of the application must be within bounds'
+    lifecycle_point = contract.LOAD
+    error_level = contract.UNUSED
+    before = {DirectLoadClause, ProxyLoadClause}
+    tags = {'load'}
+
+    # How long the application has to warm up after it starts, in seconds.
+    warmup_time = 10
+
+    # Threshold on the peak memory usage after warmup, in megabytes.
+    max_memory_mb = 512
+
+    def evaluate_clause(self, app_container):
+        collector = self.sandbox.stats
+        if not collector:
+            raise unittest.SkipTest('Resource usage is not being sampled.')
+        samples = collector.samples('app')
+        summary = samples and collector.summarize(
+            'app', since=samples[0].time + self.warmup_time)
+        if not summary:
+            raise unittest.SkipTest('No resource usage samples were taken '
+                                    'after warmup.')
+        self.metrics = summary
+        if (self.max_memory_mb is not None and
+            summary['memory_peak'] > self.max_memory_mb):
+            self.fail('Memory usage peaked at {0:.1f}MB, above '
+                      '{1:.1f}MB'.format(summary['memory_peak'],
+                                         self.max_memory_mb))
+
+
 class HostnameClause(contract.ContractClause):
     """Validate that container executes /bin/hostname cleanly."""
 
@@ -302,7 +502,7 @@ class StartClause(contract.ContractClause):
 
     def evaluate_clause(self, app_container):
         url = 'http://{0}:{1}/_ah/start'.format(app_container.host,
-                                                8080)
+                                                self.sandbox.port)
         r = requests.get(url)
         self.assertIn(r.status_code,
                       _STATUS_CODES,
@@ -323,7 +523,8 @@ class StopClause(contract.ContractClause):
 
     def evaluate_clause(self, app_container):
         """Ensure that the status code is not 500."""
-        url = 'http://{0}:{1}/_ah/stop'.format(app_container.host, 8080)
+        url = 'http://{0}:{1}/_ah/stop'.format(app_container.host,
+                                               self.sandbox.port)
         r = requests.get(url)
         self.assertIn(r.status_code,
                       _STATUS_CODES,
@@ -19,8 +19,12 @@ This class is used for unit testing ContainerSandbox.
 # This file conforms to the external style guide.
 # pylint: disable=bad-indentation
 
+import io
+import os
+import posixpath
 import requests
 import stubout
+import tarfile
 import unittest
 import uuid
 
@@ -34,10 +38,23 @@ DEFAULT_IMAGES = [constants.DEVAPPSERVER_IMAGE,
 images = list(DEFAULT_IMAGES)
 containers = []
 removed_containers = []
+builds = []
+
+# {basestring: (dict, [basestring, ...])} The container and command of each
+# exec instance.
+execs = {}
+
+# The first host port handed out for port bindings without a host port.
+FIRST_AUTO_PORT = 32768
+next_auto_port = FIRST_AUTO_PORT
 
 
 def reset():
-    global containers, images, removed_containers
+    global builds, containers, execs, images, next_auto_port
+    global removed_containers
+    builds = []
+    execs = {}
+    next_auto_port = FIRST_AUTO_PORT
     containers = []
     images = list(DEFAULT_IMAGES)
     removed_containers = []
@@ -100,14 +117,23 @@ class FakeDockerClient(object):
             raise KeyError('appstart must specify nocache in builds.')
 
         # "Store" the newly "built" image
+        builds.append(kwargs['tag'])
         images.append(kwargs['tag'])
         return BUILD_RES
 
+    def inspect_image(self, image):
+        """Imitate docker.Client.inspect_image."""
+        if image not in images:
+            raise docker.errors.APIError('the specified image does not exist.',
+                                         requests.Response())
+        return {'Id': 'id-' + image, 'RepoTags': [image]}
+
     def inspect_container(self, container_id):
         cont = find_container(container_id)
         return {'Name': cont['Name'],
                 'Id': cont['Id'],
-                'State': {'Running': cont['Running']}}
+                'State': {'Running': cont['Running']},
+                'NetworkSettings': {'Ports': cont['Ports']}}
 
     def create_container(self, **kwargs):
         """Imitiate docker.Client.create_container."""
@@ -126,7 +152,17 @@ class FakeDockerClient(object):
         new_container = {'Id': container_id,
                          'Running': False,
                          'Options': kwargs,
-                         'Name': kwargs['name']}
+                         'Name': kwargs['name'],
+                         # {basestring: basestring} Contents of files in the
+                         # container, keyed by absolute path.
+                         'Files': {},
+                         # [dict, ...] Stats objects to stream from stats.
+                         'Stats': [],
+                         # (int) How many times the container was restarted.
+                         'Restarts': 0,
+                         # {basestring: [dict]} Published ports, once the
+                         # container has started.
+                         'Ports': {}}
         containers.append(new_container)
         return {'Id': container_id, 'Warnings': None}
 
@@ -135,28 +171,140 @@ class FakeDockerClient(object):
         cont_to_kill = find_container(cont_id)
         cont_to_kill['Running'] = False
 
-    def remove_container(self, cont_id):
+    def remove_container(self, cont_id, force=False):
         """Imitate docker.Client.remove_container."""
         cont_to_rm = find_container(cont_id)
+        if force:
+            cont_to_rm['Running'] = False
         if cont_to_rm['Running']:
             raise RuntimeError('tried to remove a running container.')
         removed_containers.append(cont_to_rm)
         containers.remove(cont_to_rm)
 
+    def copy(self, cont_id, resource):
+        """Imitate docker.Client.copy, using the container's 'Files'."""
+        cont = find_container(cont_id)
+        resource = resource.rstrip('/')
+        paths = sorted(path for path in cont['Files']
+                       if path == resource or path.startswith(resource + '/'))
+        if not paths:
+            raise docker.errors.APIError('Could not find the file.',
+                                         requests.Response())
+
+        # Like docker, name the members relative to the resource's parent.
+        fileobj = io.BytesIO()
+        tar = tarfile.open(mode='w', fileobj=fileobj)
+        for path in paths:
+            tinfo = tarfile.TarInfo(
+                os.path.relpath(path, os.path.dirname(resource)))
+            tinfo.size = len(cont['Files'][path])
+            tar.addfile(tinfo, io.BytesIO(cont['Files'][path]))
+        tar.close()
+        fileobj.seek(0)
+        return fileobj
+
     def start(self, cont_id, **kwargs):  # pylint: disable=unused-argument
         """Imitate docker.Client.start."""
+        global next_auto_port
         cont_to_start = find_container(cont_id)
         cont_to_start['Running'] = True
 
+        # Like docker, pick host ports for bindings that don't have one.
+        host_config = cont_to_start['Options'].get('host_config') or {}
+        for spec, bindings in (host_config.get('PortBindings') or
+                               {}).iteritems():
+            cont_to_start['Ports'][spec] = []
+            for binding in bindings:
+                host_port = binding['HostPort']
+                if not host_port:
+                    host_port = str(next_auto_port)
+                    next_auto_port += 1
+                cont_to_start['Ports'][spec].append(
+                    {'HostIp': binding['HostIp'] or '0.0.0.0',
+                     'HostPort': host_port})
+
+    def restart(self, cont_id, timeout=10):  # pylint: disable=unused-argument
+        """Imitate docker.Client.restart."""
+        cont_to_restart = find_container(cont_id)
+        cont_to_restart['Running'] = True
+        cont_to_restart['Restarts'] += 1
+
+    def put_archive(self, cont_id, path, data):
+        """Imitate docker.Client.put_archive, using the container's 'Files'."""
+        cont = find_container(cont_id)
+        tar = tarfile.open(fileobj=data, mode='r')
+        for tinfo in tar:
+            if tinfo.isfile():
+                cont['Files'][posixpath.join(path, tinfo.name)] = (
+                    tar.extractfile(tinfo).read())
+        return True
+
+    def exec_create(self, container, cmd, **unused_kwargs):
+        """Imitate docker.Client.exec_create, for 'rm -rf' commands."""
+        cont = find_container(container)
+        if not cont['Running']:
+            raise docker.errors.APIError('container is not running.',
+                                         requests.Response())
+        exec_id = str(uuid.uuid4())
+        execs[exec_id] = (cont, cmd)
+        return {'Id': exec_id}
+
+    def exec_start(self, exec_id):
+        """Imitate docker.Client.exec_start, deleting from 'Files'."""
+        cont, cmd = execs[exec_id]
+        if cmd[:2] == ['rm', '-rf']:
+            for resource in cmd[2:]:
+                for path in list(cont['Files']):
+                    if path == resource or path.startswith(resource + '/'):
+                        del cont['Files'][path]
+        return ''
+
+    def exec_inspect(self, exec_id):
+        """Imitate docker.Client.exec_inspect."""
+        return {'ExitCode': 0, 'ProcessConfig': {
+            'arguments': execs[exec_id][1]}}
+
+    def events(self, filters=None, **kwargs):  # pylint: disable=unused-argument
+        """Imitate docker.Client.events.
+
+        A 'die' event is produced for every stopped container matching the
+        filters. Unlike the real event stream, this one does not block.
+        """
+        wanted = (filters or {}).get('container')
+        for cont in list(containers):
+            if not cont['Running'] and (not wanted or cont['Id'] in wanted):
+                yield {'status': 'die', 'id': cont['Id']}
+
+    def logs(self, container, stream=False, **unused_kwargs):
+        """Imitate docker.Client.logs, for containers without logs."""
+        find_container(container)
+        return iter([]) if stream else ''
+
+    def stats(self, container, decode=None):  # pylint: disable=unused-argument
+        """Imitate docker.Client.stats, using the container's 'Stats'.
+
+        Unlike the real stats stream, this one ends once the container's
+        stats objects are exhausted.
+        """
+        cont = find_container(container)
+        for stats in list(cont['Stats']):
+            yield stats
+
+    def containers(self, **kwargs):
+        """Imitate docker.Client.containers."""
+        return [{'Id': cont['Id'], 'Names': ['/' + cont['Name']]}
+                for cont in containers
+                if kwargs.get('all') or cont['Running']]
+
     def images(*args, **kwargs):
         return [{'RepoTags': [image_name]} for image_name in images]
 
 
 
 def find_container(cont_id):
-    """Helper function to find a container based on id."""
+    """Helper function to find a container based on id or name."""
     for cont in containers:
-        if cont['Id'] == cont_id:
+        if cont['Id'] == cont_id or cont['Name'] == cont_id:
             return cont
     raise docker.errors.APIError('container was not found.', requests.Response())
 
@@ -166,9 +314,11 @@ class FakeDockerTestBase(unittest.TestCase):
     def setUp(self):
         self.stubs = stubout.StubOutForTesting()
         self.stubs.Set(docker, 'Client', FakeDockerClient)
+        utils.clear_docker_clients()
         reset()
 
     def tearDown(self):
         """Restore docker.Client and requests.get."""
         reset()
+        utils.clear_docker_clients()
         self.stubs.UnsetAll()
@@ -177,6 +177,42 @@ class ConfigurationTest(unittest.TestCase):
             with self.assertRaises(utils.AppstartAbort):
                 configuration.ApplicationConfiguration(conf_file_name)
 
+    def test_health_check_options(self):
+        yaml_file = textwrap.dedent("""\
+                        vm: true
+                        health_check:
+                            check_interval_sec: 2
+                            unhealthy_threshold: 3""")
+        conf = configuration.ApplicationConfiguration(
+            self._make_yaml_config(yaml_file))
+        self.assertEqual(conf.health_check_options['check_interval_sec'], 2)
+        self.assertEqual(conf.health_check_options['unhealthy_threshold'], 3)
+        self.assertEqual(conf.health_check_options['timeout_sec'], 4)
+
+        xml_file = textwrap.dedent("""\
+                       <appengine-web-app xmlns="http://appengine.google.com/ns/1.0">
+                           <vm>true</vm>
+                           <health-check>
+                               <check-interval-sec> 7 </check-interval-sec>
+                               <timeout-sec>1</timeout-sec>
+                           </health-check>
+                       </appengine-web-app>""")
+        conf = configuration.ApplicationConfiguration(
+            self._make_xml_configs(xml_file))
+        self.assertEqual(conf.health_check_options,
+                         dict(configuration.HEALTH_CHECK_DEFAULTS,
+                              check_interval_sec=7, timeout_sec=1))
+
+    def test_bad_health_check_option(self):
+        for value in ('0', 'soon'):
+            yaml_file = textwrap.dedent("""\
+                            vm: true
+                            health_check:
+                                timeout_sec: {0}""".format(value))
+            with self.assertRaises(utils.AppstartAbort):
+                configuration.ApplicationConfiguration(
+                    self._make_yaml_config(yaml_file))
+
     def test_malformed_yaml(self):
         yaml_file = 'malformed yaml file'
         conf_file_name = self._make_yaml_config(yaml_file)
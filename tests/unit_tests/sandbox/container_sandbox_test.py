@@ -5,8 +5,11 @@
 
 import logging
 import os
+import shutil
 import stubout
 import tempfile
+import threading
+import time
 import unittest
 
 import docker
@@ -14,10 +17,15 @@ import mox
 
 from appstart.sandbox import container_sandbox
 from appstart.sandbox import container
+from appstart.sandbox import log_store
+from appstart.sandbox import log_stream
 from appstart import utils
 
 from fakes import fake_docker
 
+# The real ContainerSandbox.start_log_stream, which most tests fake out.
+_start_log_stream = container_sandbox.ContainerSandbox.start_log_stream
+
 
 class TestBase(fake_docker.FakeDockerTestBase):
 
@@ -51,14 +59,15 @@ class CreateAndRemoveContainersTest(TestBase):
                        'ping_application_container',
                        lambda self: True)
 
-        # Fake out stream_logs, as this will try to start another thread.
-        self.stubs.Set(container.Container,
-                       'stream_logs',
-                       lambda unused_self, unused_stream=True: None)
+        # Fake out following logs, as this would connect to the daemon and
+        # start threads. See test_log_stream.
+        self.stubs.Set(container_sandbox.ContainerSandbox,
+                       'start_log_stream',
+                       lambda unused_self: None)
 
     def test_start_from_conf(self):
         """Test ContainerSandbox.start."""
-        sb = container_sandbox.ContainerSandbox(self.conf_file.name)
+        sb = container_sandbox.ContainerSandbox([self.conf_file.name])
         sb.start()
 
         self.assertIsNotNone(sb.app_container)
@@ -67,13 +76,340 @@ class CreateAndRemoveContainersTest(TestBase):
 
     def test_start_no_api_server(self):
         """Test ContainerSandbox.start (with no api server)."""
-        sb = container_sandbox.ContainerSandbox(self.conf_file.name,
-                                                        run_api_server=False)
+        sb = container_sandbox.ContainerSandbox([self.conf_file.name],
+                                                run_api_server=False)
         sb.start()
         self.assertIsNotNone(sb.app_container)
         self.assertIsNotNone(sb.app_container)
         self.assertIsNone(sb.devappserver_container)
 
+    def test_auto_ports(self):
+        sb = container_sandbox.ContainerSandbox(
+            [self.conf_file.name], application_port=0, admin_port=8000,
+            proxy_port=0, extra_ports={9000: 0})
+        sb.start()
+        published = sb.devappserver_container.host_ports()
+        self.assertEqual(published[8080], sb.port)
+        self.assertEqual(published[sb.internal_proxy_port], sb.proxy_port)
+        self.assertEqual(published[9000], sb.extra_ports[9000])
+        self.assertEqual(sb.admin_port, 8000)
+        self.assertEqual(len(set([sb.port, sb.proxy_port,
+                                  sb.extra_ports[9000]])), 3)
+        self.assertNotIn(0, published.values())
+        sb.stop()
+
+        sb = container_sandbox.ContainerSandbox([self.conf_file.name],
+                                                application_port=0,
+                                                run_api_server=False)
+        sb.start()
+        self.assertEqual(sb.app_container.host_ports(), {8080: sb.port})
+        self.assertNotEqual(sb.port, 0)
+        sb.stop()
+
+    def test_unique_names(self):
+        first = container_sandbox.ContainerSandbox([self.conf_file.name])
+        second = container_sandbox.ContainerSandbox([self.conf_file.name])
+        first.start()
+        second.start()
+        names = [cont['Name'] for cont in fake_docker.containers]
+        self.assertEqual(len(names), 6)
+        self.assertEqual(len(set(names)), 6)
+        self.assertNotEqual(first.output_path, second.output_path)
+        first.stop()
+        second.stop()
+
+    def test_time_to_ready(self):
+        sb = container_sandbox.ContainerSandbox([self.conf_file.name])
+        sb.start()
+        self.assertIsNotNone(sb.time_to_ready)
+        self.assertLess(sb.time_to_ready, 1)
+
+    def test_stats_collector(self):
+        sb = container_sandbox.ContainerSandbox([self.conf_file.name])
+        sb.start()
+        self.assertEqual(sorted(sb.stats.buffers), ['app', 'devappserver'])
+        sb.stop()
+
+        sb = container_sandbox.ContainerSandbox([self.conf_file.name],
+                                                run_api_server=False,
+                                                stats_interval=0)
+        sb.start()
+        self.assertIsNone(sb.stats)
+        sb.stop()
+
+    def test_log_stream(self):
+        self.stubs.Set(log_stream.LogMultiplexer,
+                       'follow',
+                       lambda unused_self, cont, name=None, since=None: None)
+        output_path = tempfile.mkdtemp()
+        sb = container_sandbox.ContainerSandbox([self.conf_file.name],
+                                                output_path=output_path)
+        sb.start()
+        _start_log_stream(sb)
+        sb.logs.queue.put(log_stream.LogLine('app', 'stdout', 1000, 'hi'))
+        sb.stop()
+        self.assertFalse(sb._log_consumer.is_alive())
+        self.assertEqual(list(log_store.search(output_path)),
+                         [log_stream.LogLine('app', 'stdout', 1000, 'hi')])
+        shutil.rmtree(output_path)
+
+    def test_log_stream_flushes_busy_output(self):
+        self.stubs.Set(log_stream.LogMultiplexer,
+                       'follow',
+                       lambda unused_self, cont, name=None, since=None: None)
+        self.stubs.Set(log_store, 'FLUSH_INTERVAL', 0)
+        output_path = tempfile.mkdtemp()
+        sb = container_sandbox.ContainerSandbox([self.conf_file.name],
+                                                output_path=output_path)
+        sb.start()
+        _start_log_stream(sb)
+
+        # Lines are stored before the queue goes idle.
+        sb.logs.queue.put(log_stream.LogLine('app', 'stdout', 1000, 'hi'))
+        deadline = time.time() + log_stream.POLL_INTERVAL / 2
+        while not list(log_store.search(output_path)):
+            self.assertLess(time.time(), deadline)
+            time.sleep(0.01)
+
+        # An error while flushing stops storing, but not consuming.
+        def broken_flush(unused_self):
+            raise IOError('disk full')
+        self.stubs.Set(log_store.LogStore, 'flush_stale', broken_flush)
+        sb.logs.queue.put(log_stream.LogLine('app', 'stdout', 1001, 'bye'))
+        time.sleep(log_stream.POLL_INTERVAL * 2)
+        self.assertTrue(sb._log_consumer.is_alive())
+        self.assertTrue(sb.logs.queue.empty())
+        sb.stop()
+        shutil.rmtree(output_path)
+
+    def _write_app_file(self, relpath, contents):
+        path = os.path.join(os.path.dirname(self.conf_file.name), relpath)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write(contents)
+        return path
+
+    def test_apply_changes(self):
+        self._write_app_file('app.yaml', 'vm: true\n'
+                             'handlers:\n'
+                             '- url: /static\n'
+                             '  static_dir: static\n')
+        self._write_app_file('Dockerfile', 'FROM python\n'
+                             'ADD requirements.txt /app/\n'
+                             'RUN pip install -r /app/requirements.txt\n'
+                             'ADD . /app/\n')
+        self._write_app_file('.dockerignore', 'notes.txt\n')
+        sb = container_sandbox.ContainerSandbox([self.conf_file.name])
+        sb.start()
+        app = fake_docker.find_container(sb.app_container.get_id())
+        das = fake_docker.find_container(sb.devappserver_container.get_id())
+
+        # Source files are copied into the running container, which is
+        # restarted rather than rebuilt.
+        main_py = self._write_app_file('main.py', 'print "v2"')
+        plan = sb.apply_changes(['main.py', 'notes.txt'])
+        self.assertIsNone(plan.rebuild)
+        self.assertEqual(plan.app_files, {'/app/main.py': main_py})
+        self.assertEqual(app['Files'], {'/app/main.py': 'print "v2"'})
+        self.assertEqual(app['Restarts'], 1)
+        self.assertEqual(fake_docker.find_container(sb.app_container.get_id()),
+                         app)
+
+        # Static files go to devappserver too, without restarting it.
+        self._write_app_file('static/site.css', 'body {}')
+        sb.apply_changes(['static/site.css'])
+        self.assertEqual(das['Files'], {'/app/static/site.css': 'body {}'})
+        self.assertEqual(das['Restarts'], 0)
+        self.assertEqual(app['Restarts'], 2)
+
+        os.remove(main_py)
+        plan = sb.apply_changes(['main.py'])
+        self.assertEqual(plan.app_deleted, ['/app/main.py'])
+        self.assertNotIn('/app/main.py', app['Files'])
+
+        # Files that a RUN instruction may use, and config files, take a
+        # rebuild.
+        self._write_app_file('requirements.txt', 'flask')
+        plan = sb.apply_changes(['requirements.txt', 'main.py'])
+        self.assertEqual(plan.rebuild, 'requirements.txt')
+        self.assertIn(app, fake_docker.removed_containers)
+        self.assertEqual(sb.apply_changes(['app.yaml']).rebuild, 'app.yaml')
+        sb.stop()
+
+    def test_apply_changes_to_stopped_container(self):
+        self._write_app_file('Dockerfile', 'FROM python\nADD . /app/\n')
+        sb = container_sandbox.ContainerSandbox([self.conf_file.name])
+        sb.start()
+        app_id = sb.app_container.get_id()
+        app = fake_docker.find_container(app_id)
+        app['Running'] = False
+
+        # Files can be copied into a stopped container, but not deleted.
+        self._write_app_file('main.py', '')
+        self.assertIsNone(sb.apply_changes(['main.py']).rebuild)
+        self.assertTrue(app['Running'])
+        app['Running'] = False
+        self.assertEqual(sb.apply_changes(['gone.py']).rebuild,
+                         '/app/gone.py')
+        self.assertNotEqual(sb.app_container.get_id(), app_id)
+        sb.stop()
+
+    def test_watch(self):
+        self._write_app_file('Dockerfile', 'FROM python\nADD . /app/\n')
+        test = self
+        batches = [set(['main.py']), set(), set(['Dockerfile']),
+                   set(['main.py'])]
+
+        class FakeWatcher(object):
+
+            def __init__(self, directory, debounce):
+                test.assertEqual(directory,
+                                 os.path.dirname(test.conf_file.name))
+                self.closed = False
+                test.watcher = self
+
+            def wait_for_changes(self):
+                if not batches:
+                    raise KeyboardInterrupt()
+                return batches.pop(0)
+
+            def close(self):
+                self.closed = True
+
+        self.stubs.Set(container_sandbox.file_watcher, 'DirectoryWatcher',
+                       FakeWatcher)
+        self._write_app_file('main.py', '')
+        sb = container_sandbox.ContainerSandbox([self.conf_file.name])
+        sb.start()
+        first_id = sb.app_container.get_id()
+        first_app = fake_docker.find_container(first_id)
+        real_start = sb.start
+
+        def failing_start():
+            real_start()
+            if batches == [set(['main.py'])]:
+                # Like a failed start, tear the sandbox down.
+                sb.stop()
+                raise utils.AppstartAbort('The application server timed '
+                                          'out.')
+
+        sb.start = failing_start
+        self.assertRaises(KeyboardInterrupt, sb.watch)
+        self.assertTrue(self.watcher.closed)
+
+        # The first change was applied in place, and the second rebuilt the
+        # sandbox, which failed. The next change started it again.
+        self.assertEqual(first_app['Restarts'], 1)
+        self.assertIn(first_app, fake_docker.removed_containers)
+        self.assertNotEqual(sb.app_container.get_id(), first_id)
+        sb.stop()
+
+    def test_keep_warm(self):
+        sb = container_sandbox.ContainerSandbox([self.conf_file.name],
+                                                keep_warm=True)
+        sb.start()
+        das_id = sb.devappserver_container.get_id()
+        pinger_id = sb.pinger_container.get_id()
+        self.assertFalse(sb.reused_warm_containers)
+        sb.stop()
+
+        # Only the application container is gone.
+        self.assertEqual(sorted(c['Id'] for c in fake_docker.containers),
+                         sorted([das_id, pinger_id]))
+        warm = container_sandbox.find_warm_containers(sb.dclient)
+        self.assertEqual(len(warm), 2)
+        self.assertTrue(all(name.startswith(
+            container_sandbox.WARM_CONTAINER_PREFIX) for name, _ in warm))
+
+        sb = container_sandbox.ContainerSandbox([self.conf_file.name],
+                                                keep_warm=True)
+        sb.start()
+        self.assertTrue(sb.reused_warm_containers)
+        self.assertEqual(sb.devappserver_container.get_id(), das_id)
+        self.assertEqual(sb.pinger_container.get_id(), pinger_id)
+        pinger = fake_docker.find_container(pinger_id)
+        self.assertEqual(pinger['Options']['name'], warm[1][0])
+        sb.stop()
+
+        # Clearing the datastore takes a new devappserver, and so a new
+        # pinger.
+        sb = container_sandbox.ContainerSandbox([self.conf_file.name],
+                                                keep_warm=True,
+                                                clear_datastore=True)
+        sb.start()
+        self.assertFalse(sb.reused_warm_containers)
+        self.assertNotEqual(sb.devappserver_container.get_id(), das_id)
+        self.assertNotEqual(sb.pinger_container.get_id(), pinger_id)
+        sb.stop()
+        self.assertEqual(len(fake_docker.containers), 2)
+
+        self.assertEqual(len(container_sandbox.remove_warm_containers(
+            sb.dclient)), 2)
+        self.assertEqual(fake_docker.containers, [])
+
+    def test_keep_warm_after_config_change(self):
+        sb = container_sandbox.ContainerSandbox([self.conf_file.name],
+                                                keep_warm=True)
+        sb.start()
+        old_ids = set([sb.devappserver_container.get_id(),
+                       sb.pinger_container.get_id()])
+        sb.stop()
+
+        # The new configuration takes a new devappserver, which needs the
+        # host ports that the old one holds.
+        with open(self.conf_file.name, 'a') as conf_file:
+            conf_file.write('\nenv_variables:\n  CHANGED: "yes"\n')
+        sb = container_sandbox.ContainerSandbox([self.conf_file.name],
+                                                keep_warm=True)
+        sb.start()
+        self.assertFalse(sb.reused_warm_containers)
+        sb.stop()
+        self.assertEqual(len(container_sandbox.find_warm_containers(
+            sb.dclient)), 2)
+        self.assertFalse(old_ids & set(c['Id'] for c in fake_docker.containers))
+
+        # Warm containers on other host ports are left alone.
+        sb = container_sandbox.ContainerSandbox([self.conf_file.name],
+                                                keep_warm=True,
+                                                application_port=9080,
+                                                admin_port=9000,
+                                                proxy_port=9088)
+        sb.start()
+        sb.stop()
+        self.assertEqual(len(container_sandbox.find_warm_containers(
+            sb.dclient)), 4)
+
+    def test_wait_for_start_detects_death(self):
+        sb = container_sandbox.ContainerSandbox([self.conf_file.name],
+                                                timeout=30)
+        sb.start()
+        self.stubs.Set(container.PingerContainer,
+                       'ping_application_container',
+                       lambda self: False)
+        fake_docker.find_container(sb.app_container.get_id())['Running'] = (
+            False)
+
+        start = time.time()
+        with self.assertRaises(utils.AppstartAbort):
+            sb.wait_for_start()
+        self.assertLess(time.time() - start, 5)
+
+    def test_devappserver_image_cache(self):
+        """Unchanged config files should not rebuild the devappserver image."""
+        sb = container_sandbox.ContainerSandbox([self.conf_file.name])
+        first_image = sb.build_devappserver_image()
+        self.assertEqual(fake_docker.builds, [first_image])
+
+        self.assertEqual(sb.build_devappserver_image(), first_image)
+        self.assertEqual(fake_docker.builds, [first_image])
+
+        with open(self.conf_file.name, 'a') as conf_file:
+            conf_file.write('\nthreadsafe: true')
+        second_image = sb.build_devappserver_image()
+        self.assertNotEqual(second_image, first_image)
+        self.assertEqual(fake_docker.builds, [first_image, second_image])
+
     def test_start_from_image(self):
         sb = container_sandbox.ContainerSandbox(image_name='test_image')
         with self.assertRaises(utils.AppstartAbort):
@@ -118,7 +454,7 @@ class ExitTest(TestBase):
         """
         super(ExitTest, self).setUp()
         self.sandbox = container_sandbox.ContainerSandbox(
-            self.conf_file.name)
+            [self.conf_file.name])
         # Add the containers to the sandbox. Mock them out (we've tested the
         # containers elsewhere, and we just need the appropriate methods to be
         # called).
@@ -131,27 +467,52 @@ class ExitTest(TestBase):
         self.sandbox.pinger_container = (
             self.mocker.CreateMock(container.PingerContainer))
 
-        # TODO(gouzenko): Figure out how to make order not matter (among the
-        # three containers).
-        self.sandbox.app_container.running().AndReturn(True)
+        # Containers are removed concurrently, so the order among the three
+        # containers doesn't matter.
         self.sandbox.app_container.get_id().AndReturn('456')
-        self.sandbox.app_container.kill()
-        self.sandbox.app_container.remove()
+        self.sandbox.app_container.remove(force=True)
 
-        self.sandbox.devappserver_container.running().AndReturn(True)
         self.sandbox.devappserver_container.get_id().AndReturn('123')
-        self.sandbox.devappserver_container.kill()
-        self.sandbox.devappserver_container.remove()
+        self.sandbox.devappserver_container.remove(force=True)
 
-        self.sandbox.pinger_container.running().AndReturn(True)
-        self.sandbox.pinger_container.get_id().AndReturn('123')
-        self.sandbox.pinger_container.kill()
-        self.sandbox.pinger_container.remove()
+        self.sandbox.pinger_container.get_id().AndReturn('789')
+        self.sandbox.pinger_container.remove(force=True)
         self.mocker.ReplayAll()
 
     def test_stop(self):
         self.sandbox.stop()
 
+    def test_stop_reports_failures(self):
+        self.mocker.ResetAll()
+        self.mocker.UnsetStubs()
+        hang = threading.Event()
+
+        class StuckContainer(object):
+
+            def get_id(self):
+                return 'stuck'
+
+            def remove(self, force=False):  # pylint: disable=unused-argument
+                hang.wait(5)
+
+        class BrokenContainer(object):
+
+            def get_id(self):
+                return 'broken'
+
+            def remove(self, force=False):  # pylint: disable=unused-argument
+                raise docker.errors.APIError('daemon is busy', None)
+
+        self.sandbox.app_container = StuckContainer()
+        self.sandbox.devappserver_container = BrokenContainer()
+        self.sandbox.pinger_container = None
+
+        start = time.time()
+        failed = self.sandbox.stop_and_remove_containers(timeout=0.1)
+        hang.set()
+        self.assertEqual(failed, ['broken', 'stuck'])
+        self.assertLess(time.time() - start, 2)
+
     def test_exception_handling(self):
         """Test the case where an exception was raised in start().
 
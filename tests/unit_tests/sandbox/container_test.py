@@ -17,6 +17,11 @@
 # This file conforms to the external style guide.
 # pylint: disable=bad-indentation, g-bad-import-order
 
+import json
+import socket
+import struct
+import threading
+import time
 import unittest
 
 from appstart.sandbox import container
@@ -111,5 +116,118 @@ class TestContainer(fake_docker.FakeDockerTestBase):
                          fake_docker.containers[0]['Id'],
                          'Container IDs do not match')
 
+    def test_extract_tar(self):
+        fake_docker.containers[0]['Files'].update({
+            '/logs/a.log': 'a' * 100,
+            '/logs/custom/b.log': 'b'})
+
+        # Force the archive to be spilled to disk.
+        self.stubs.Set(container, 'TAR_SPOOL_MAX_SIZE', 10)
+        tar = self.cont.extract_tar('/logs')
+        self.assertEqual(tar.list('logs'), (['a.log'], ['custom']))
+        self.assertEqual(tar.get_file('logs/custom/b.log').read(), 'b')
+
+        with self.assertRaises(IOError):
+            self.cont.extract_tar('/missing')
+
+
+class TestContainerEventWatcher(fake_docker.FakeDockerTestBase):
+
+    def setUp(self):
+        super(TestContainerEventWatcher, self).setUp()
+        self.dclient = fake_docker.FakeDockerClient()
+        fake_docker.images.append('temp')
+        self.cont = container.Container(self.dclient)
+        self.cont.create(name='temp', image='temp')
+
+        # [{basestring: object}, ...] The arguments of each events request.
+        self.requests = []
+        real_events = self.dclient.events
+
+        def events(**kwargs):
+            self.requests.append(kwargs)
+            return real_events(**kwargs)
+
+        self.stubs.Set(self.dclient, 'events', events)
+
+    def test_dead_container(self):
+        watcher = container.ContainerEventWatcher(self.dclient, [self.cont])
+        watcher.start()
+        watcher.wait(5)
+        self.assertIs(watcher.dead_container, self.cont)
+        self.assertTrue(watcher.available)
+
+    def test_stop(self):
+        self.cont.start()
+        until = int(time.time()) + 60
+        watcher = container.ContainerEventWatcher(self.dclient, [self.cont],
+                                                  until=until)
+        watcher.start()
+        watcher.wait(0.5)
+        watcher.stop()
+
+        # No request outlives the watcher by more than EVENT_WINDOW.
+        time.sleep(container.EVENT_WINDOW + 0.5)
+        count = len(self.requests)
+        time.sleep(container.EVENT_WINDOW + 0.5)
+        self.assertEqual(len(self.requests), count)
+        self.assertTrue(all(request['until'] < until
+                            for request in self.requests))
+        self.assertIsNone(watcher.dead_container)
+        self.assertTrue(watcher.available)
+
+
+class TestPingerAgent(fake_docker.FakeDockerTestBase):
+
+    def setUp(self):
+        super(TestPingerAgent, self).setUp()
+        self.client_end, self.agent_end = socket.socketpair()
+        client_end = self.client_end
+
+        class AgentDockerClient(fake_docker.FakeDockerClient):
+
+            def inspect_container(self, container_id):
+                res = super(AgentDockerClient, self).inspect_container(
+                    container_id)
+                res['Config'] = {'Entrypoint': ['python', '/pinger.py',
+                                                container.AGENT_FLAG]}
+                return res
+
+            def attach_socket(self, unused_container, params=None):
+                return client_end
+
+        fake_docker.images.append('pinger')
+        self.pinger = container.PingerContainer(AgentDockerClient())
+        self.pinger.create(name='pinger', image='pinger')
+
+    def tearDown(self):
+        super(TestPingerAgent, self).tearDown()
+        self.agent_end.close()
+
+    def _answer(self, results):
+        """Answer one probe request, the way the agent would."""
+        request = json.loads(self.agent_end.recv(4096))
+        self.assertEqual(sorted(request['ports']), sorted(map(int, results)))
+        payload = json.dumps({'results': results}) + '\n'
+
+        # Send some stderr noise, then split stdout over two frames.
+        self.agent_end.sendall(struct.pack('>BxxxL', 2, 5) + 'noise')
+        for chunk in (payload[:5], payload[5:]):
+            self.agent_end.sendall(struct.pack('>BxxxL', 1, len(chunk)) +
+                                   chunk)
+
+    def test_probe_with_agent(self):
+        self.assertTrue(self.pinger.start_agent())
+        thread = threading.Thread(target=self._answer,
+                                  args=({'8080': True, '8081': False},))
+        thread.start()
+        self.assertEqual(self.pinger.probe([8080, 8081]),
+                         {8080: True, 8081: False})
+        thread.join()
+
+    def test_no_agent(self):
+        self.stubs.Set(self.pinger, '_dclient', fake_docker.FakeDockerClient())
+        self.assertFalse(self.pinger.start_agent())
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,86 @@
+# Copyright 2015 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for appstart.sandbox.file_watcher."""
+
+# This file conforms to the external style guide.
+# pylint: disable=bad-indentation, g-bad-import-order
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from appstart.sandbox import file_watcher
+
+
+class DirectoryWatcherTest(unittest.TestCase):
+
+    use_inotify = False
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self._write('main.py', 'v1')
+        os.mkdir(os.path.join(self.directory, '.git'))
+        self.watcher = file_watcher.DirectoryWatcher(
+            self.directory, debounce=0.1, poll_interval=0.05,
+            use_inotify=self.use_inotify)
+
+    def tearDown(self):
+        self.watcher.close()
+        shutil.rmtree(self.directory)
+
+    def _write(self, relpath, contents):
+        with open(os.path.join(self.directory, relpath), 'w') as f:
+            f.write(contents)
+
+    def test_batches(self):
+        self.assertEqual(self.watcher.wait_for_changes(timeout=0.1), set())
+
+        self._write('main.py', 'v2 is longer')
+        self._write('new.py', '')
+        self._write('.git/index', '')
+        self._write('main.py.swp', '')
+        self.assertEqual(self.watcher.wait_for_changes(timeout=2),
+                         set(['main.py', 'new.py']))
+
+        os.remove(os.path.join(self.directory, 'new.py'))
+        self.assertEqual(self.watcher.wait_for_changes(timeout=2),
+                         set(['new.py']))
+
+    def test_new_directory(self):
+        os.mkdir(os.path.join(self.directory, 'lib'))
+        self._write('lib/util.py', '')
+        changes = self.watcher.wait_for_changes(timeout=2)
+        self.assertIn(os.path.join('lib', 'util.py'), changes)
+
+        # Files in the new directory are watched too.
+        self._write('lib/util.py', 'changed')
+        self.assertIn(os.path.join('lib', 'util.py'),
+                      self.watcher.wait_for_changes(timeout=2))
+
+
+@unittest.skipUnless(sys.platform.startswith('linux'), 'Needs inotify')
+class InotifyDirectoryWatcherTest(DirectoryWatcherTest):
+
+    use_inotify = True
+
+    def test_uses_inotify(self):
+        self.assertIsInstance(self.watcher._backend,
+                              file_watcher._InotifyBackend)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+# Copyright 2015 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for appstart.sandbox.hot_reload."""
+
+# This file conforms to the external style guide.
+# pylint: disable=bad-indentation, g-bad-import-order
+
+import os
+import shutil
+import tarfile
+import tempfile
+import unittest
+
+from appstart.sandbox import hot_reload
+
+
+class DockerfileMapTest(unittest.TestCase):
+
+    def setUp(self):
+        self.context_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.context_dir)
+
+    def _write(self, name, contents):
+        with open(os.path.join(self.context_dir, name), 'w') as f:
+            f.write(contents)
+
+    def _map(self, dockerfile, dockerignore=None):
+        self._write('Dockerfile', dockerfile)
+        if dockerignore is not None:
+            self._write('.dockerignore', dockerignore)
+        return hot_reload.DockerfileMap(self.context_dir)
+
+    def test_destinations(self):
+        dockerfile_map = self._map(
+            '# Comment\n'
+            'FROM gcr.io/google_appengine/python-compat\n'
+            'WORKDIR /srv\n'
+            'COPY ["conf/settings.py", "settings.py"]\n'
+            'ADD static/ public\n'
+            'ADD *.cfg lib/a.py \\\n'
+            '    etc/\n'
+            'ADD . /app/\n')
+        self.assertEqual(dockerfile_map.destinations('main.py'),
+                         ['/app/main.py'])
+        self.assertEqual(dockerfile_map.destinations('conf/settings.py'),
+                         ['/app/conf/settings.py', '/srv/settings.py'])
+        self.assertEqual(dockerfile_map.destinations('static/css/site.css'),
+                         ['/app/static/css/site.css',
+                          '/srv/public/css/site.css'])
+        self.assertEqual(dockerfile_map.destinations('logging.cfg'),
+                         ['/app/logging.cfg', '/srv/etc/logging.cfg'])
+        self.assertEqual(dockerfile_map.destinations('lib/a.py'),
+                         ['/app/lib/a.py', '/srv/etc/a.py'])
+        self.assertFalse(dockerfile_map.is_build_input('main.py'))
+
+    def test_build_inputs(self):
+        dockerfile_map = self._map(
+            'FROM gcr.io/google_appengine/python-compat\n'
+            'ADD requirements.txt /app/\n'
+            'ADD vendor.tar.gz /opt/\n'
+            'RUN pip install -r /app/requirements.txt\n'
+            'ADD . /app\n')
+        self.assertTrue(dockerfile_map.is_build_input('Dockerfile'))
+        self.assertTrue(dockerfile_map.is_build_input('.dockerignore'))
+        self.assertTrue(dockerfile_map.is_build_input('requirements.txt'))
+        self.assertTrue(dockerfile_map.is_build_input('vendor.tar.gz'))
+        self.assertFalse(dockerfile_map.is_build_input('main.py'))
+        self.assertEqual(dockerfile_map.destinations('requirements.txt'),
+                         ['/app/requirements.txt'])
+
+    def test_dockerignore(self):
+        dockerfile_map = self._map('FROM python\nADD . /app\nRUN make\n',
+                                   'build\n*.log\n!keep.log\n')
+        self.assertEqual(dockerfile_map.destinations('build/out.o'), [])
+        self.assertEqual(dockerfile_map.destinations('debug.log'), [])
+        self.assertFalse(dockerfile_map.is_build_input('debug.log'))
+        self.assertEqual(dockerfile_map.destinations('keep.log'),
+                         ['/app/keep.log'])
+
+    def test_no_dockerfile(self):
+        dockerfile_map = hot_reload.DockerfileMap(self.context_dir)
+        self.assertEqual(dockerfile_map.destinations('main.py'), [])
+        self.assertFalse(dockerfile_map.is_build_input('main.py'))
+
+    def test_make_archive(self):
+        self._write('main.py', 'print "hi"\n')
+        archive = hot_reload.make_archive({
+            '/app/main.py': os.path.join(self.context_dir, 'main.py'),
+            '/app/gone.py': os.path.join(self.context_dir, 'gone.py')})
+        tar = tarfile.open(fileobj=archive)
+        self.assertEqual(tar.getnames(), ['app/main.py'])
+        tinfo = tar.getmember('app/main.py')
+        self.assertEqual((tinfo.uid, tinfo.uname), (0, 'root'))
+        self.assertEqual(tar.extractfile(tinfo).read(), 'print "hi"\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,165 @@
+# Copyright 2015 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for appstart.sandbox.log_store."""
+
+# This file conforms to the external style guide.
+# pylint: disable=bad-indentation, g-bad-import-order
+
+import gzip
+import os
+import re
+import shutil
+import stubout
+import tempfile
+import unittest
+
+from appstart.sandbox import log_store
+from appstart.sandbox import log_stream
+
+
+def _line(container, timestamp, text, stream='stdout'):
+    return log_stream.LogLine(container, stream, timestamp, text)
+
+
+class LogStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.stubs = stubout.StubOutForTesting()
+        self.stubs.Set(log_store, 'BLOCK_SIZE', 100)
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.stubs.UnsetAll()
+        shutil.rmtree(self.directory)
+
+    def _search(self, **kwargs):
+        return [(l.container, l.timestamp, l.text)
+                for l in log_store.search(self.directory, **kwargs)]
+
+    def test_write_and_search(self):
+        store = log_store.LogStore(self.directory)
+        for i in range(20):
+            store.write(_line('app', 1000 + i, 'app line {0}'.format(i)))
+        store.write(_line('devappserver', 1005.5, 'api ready', 'stderr'))
+        store.flush()
+
+        self.assertEqual(log_store.list_containers(self.directory),
+                         ['app', 'devappserver'])
+        lines = list(log_store.search(self.directory))
+        self.assertEqual(len(lines), 21)
+        self.assertEqual([l.timestamp for l in lines],
+                         sorted(l.timestamp for l in lines))
+        self.assertEqual(lines[6], _line('devappserver', 1005.5, 'api ready',
+                                         'stderr'))
+
+        self.assertEqual(self._search(since=1017),
+                         [('app', 1017, 'app line 17'),
+                          ('app', 1018, 'app line 18'),
+                          ('app', 1019, 'app line 19')])
+        self.assertEqual(self._search(containers=['devappserver']),
+                         [('devappserver', 1005.5, 'api ready')])
+        self.assertEqual(self._search(pattern=re.compile(r'line 1\d$'),
+                                      until=1012),
+                         [('app', 1010, 'app line 10'),
+                          ('app', 1011, 'app line 11'),
+                          ('app', 1012, 'app line 12')])
+
+        # Segments can be read whole, like any gzip file.
+        with gzip.open(os.path.join(self.directory, 'app',
+                                    '000000.log.gz')) as segment:
+            self.assertEqual(len(segment.read().splitlines()), 20)
+
+    def test_index_is_sparse(self):
+        store = log_store.LogStore(self.directory)
+        for i in range(20):
+            store.write(_line('app', 1000 + i, 'app line {0}'.format(i)))
+        store.flush()
+        with open(os.path.join(self.directory, 'app', '000000.idx')) as index:
+            blocks = [line.split() for line in index]
+        self.assertGreater(len(blocks), 1)
+        self.assertLess(len(blocks), 20)
+
+        # Blocks that end before the requested time aren't decompressed.
+        decompressed = []
+        real_decompress = log_store.zlib.decompress
+
+        def decompress(data, wbits):
+            decompressed.append(data)
+            return real_decompress(data, wbits)
+
+        self.stubs.Set(log_store.zlib, 'decompress', decompress)
+        self.assertEqual(len(self._search(since=1019)), 1)
+        self.assertEqual(len(decompressed), 1)
+
+    def test_rotation(self):
+        store = log_store.LogStore(self.directory, segment_size=100,
+                                   max_segments=3)
+        for i in range(100):
+            store.write(_line('app', 1000 + i, 'app line {0}'.format(i)))
+        store.flush()
+        names = sorted(os.listdir(os.path.join(self.directory, 'app')))
+        self.assertEqual(len(names), 6)
+        self.assertFalse(os.path.exists(os.path.join(self.directory, 'app',
+                                                     '000000.log.gz')))
+
+        # The newest lines are kept, and still in order.
+        lines = self._search()
+        self.assertEqual(lines[-1], ('app', 1099, 'app line 99'))
+        self.assertEqual([l[1] for l in lines], range(1100 - len(lines), 1100))
+
+        # A new store continues after the existing segments.
+        store = log_store.LogStore(self.directory, segment_size=100,
+                                   max_segments=3)
+        store.write(_line('app', 2000, 'restarted'))
+        store.flush()
+        self.assertEqual(self._search(since=2000),
+                         [('app', 2000, 'restarted')])
+
+    def test_carriage_returns(self):
+        store = log_store.LogStore(self.directory)
+        store.write(_line('app', 1000.5, '10%\r20%\r30% done'))
+        store.write(_line('app', 1001, ''))
+        store.flush()
+        self.assertEqual(self._search(), [('app', 1000.5, '10%\r20%\r30% done'),
+                                          ('app', 1001, '')])
+
+    def test_flush_stale(self):
+        store = log_store.LogStore(self.directory)
+        store.write(_line('app', 1000, 'pending'))
+        store.flush_stale()
+        self.assertEqual(self._search(), [])
+        self.stubs.Set(log_store, 'FLUSH_INTERVAL', 0)
+        store.flush_stale()
+        self.assertEqual(self._search(), [('app', 1000, 'pending')])
+
+    def test_find_latest(self):
+        self.assertIsNone(log_store.find_latest(self.directory))
+        self.assertIsNone(log_store.find_latest(
+            os.path.join(self.directory, 'missing')))
+        older = os.path.join(self.directory, 'older')
+        newer = os.path.join(self.directory, 'newer')
+        os.mkdir(older)
+        os.mkdir(newer)
+        os.utime(older, (1000, 1000))
+        self.assertEqual(log_store.find_latest(self.directory), newer)
+
+    def test_format_line(self):
+        formatted = log_store.format_line(_line('app', 1000.25, 'hi',
+                                                'stderr'))
+        self.assertTrue(formatted.endswith('.250 app stderr: hi'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,218 @@
+# Copyright 2015 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for appstart.sandbox.log_stream."""
+
+# This file conforms to the external style guide.
+# pylint: disable=bad-indentation, g-bad-import-order
+
+import socket
+import stubout
+import struct
+import urlparse
+import unittest
+
+from appstart.sandbox import log_stream
+
+
+def _frame(stream_type, data):
+    return struct.pack('>BxxxL', stream_type, len(data)) + data
+
+
+def _chunked(*pieces):
+    return ''.join('{0:x}\r\n{1}\r\n'.format(len(p), p) for p in pieces)
+
+
+_HEADERS = ('HTTP/1.1 200 OK\r\n'
+            'Content-Type: application/vnd.docker.raw-stream\r\n'
+            'Transfer-Encoding: chunked\r\n\r\n')
+
+
+class _FakeClient(object):
+
+    def __init__(self, tty=False):
+        self.tty = tty
+
+    def inspect_container(self, unused_cont_id):
+        return {'Config': {'Tty': self.tty}}
+
+    def _url(self, pathfmt, *args):
+        return 'http+docker://localunixsocket/v1.17' + pathfmt.format(*args)
+
+
+class _FakeContainer(object):
+
+    def __init__(self, name):
+        self.name = name
+        self.is_running = True
+
+    def get_id(self):
+        return 'id-' + self.name
+
+    def running(self):
+        return self.is_running
+
+
+class LogMultiplexerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.stubs = stubout.StubOutForTesting()
+        self.stubs.Set(log_stream, 'RECONNECT_DELAY', 0)
+        self.stubs.Set(log_stream, 'POLL_INTERVAL', 0.05)
+
+        # [(basestring, socket.socket), ...] The requests that were sent,
+        # and the daemon's end of each connection.
+        self.connections = []
+
+        def open_connection(unused_dclient, unused_url):
+            ours, theirs = socket.socketpair()
+            self.connections.append(theirs)
+            return ours
+
+        self.stubs.Set(log_stream, '_open_connection', open_connection)
+
+    def tearDown(self):
+        for sock in self.connections:
+            sock.close()
+        self.stubs.UnsetAll()
+
+    def _request(self, index):
+        """Read the request sent over a connection, and return its params."""
+        request = ''
+        while '\r\n\r\n' not in request:
+            request += self.connections[index].recv(1024)
+        path = request.split(' ')[1]
+        return dict(urlparse.parse_qsl(urlparse.urlparse(path).query))
+
+    def _wait_for_connections(self, count):
+        for _ in range(100):
+            if len(self.connections) >= count:
+                return
+            self.multiplexer._stopped.wait(0.02)
+        self.fail('Expected {0} connections'.format(count))
+
+    def _get(self, count):
+        return [self.multiplexer.queue.get(timeout=5) for _ in range(count)]
+
+    def test_demultiplex(self):
+        self.multiplexer = log_stream.LogMultiplexer(_FakeClient())
+        self.multiplexer.follow(_FakeContainer('app'))
+        self._wait_for_connections(1)
+        params = self._request(0)
+        self.assertEqual(params['follow'], '1')
+        self.assertEqual(params['timestamps'], '1')
+        self.assertNotIn('since', params)
+
+        body = _chunked(
+            _frame(1, '2015-10-10T12:00:00.5Z hello\n'),
+            _frame(2, '2015-10-10T12:00:01.000000001Z oops\n')[:10])
+        body += _chunked(
+            _frame(2, '2015-10-10T12:00:01.000000001Z oops\n')[10:],
+            _frame(1, '2015-10-10T12:00:02Z part'),
+            _frame(1, 'ial\r\n'))
+
+        # Send the response one byte at a time, to cut it everywhere.
+        for char in _HEADERS + body:
+            self.connections[0].sendall(char)
+
+        lines = self._get(3)
+        self.assertEqual([(l.container, l.stream, l.text) for l in lines],
+                         [('app', 'stdout', 'hello'),
+                          ('app', 'stderr', 'oops'),
+                          ('app', 'stdout', 'partial')])
+        self.assertEqual(lines[0].timestamp, 1444478400.5)
+        self.assertAlmostEqual(lines[1].timestamp, 1444478401.000000001)
+        self.multiplexer.stop()
+        self.assertEqual(list(self.multiplexer.lines()), [])
+
+    def test_interleaved_streams(self):
+        """Lines out of order or sharing a timestamp are all kept."""
+        self.multiplexer = log_stream.LogMultiplexer(_FakeClient())
+        self.multiplexer.follow(_FakeContainer('app'))
+        self._wait_for_connections(1)
+        self._request(0)
+        self.connections[0].sendall(_HEADERS + _chunked(
+            _frame(1, '2015-10-10T12:00:00.2Z out\n'),
+            _frame(2, '2015-10-10T12:00:00.1Z err\n'),
+            _frame(1, '2015-10-10T12:00:00.2Z same time\n')))
+        self.assertEqual([(l.stream, l.text) for l in self._get(3)],
+                         [('stdout', 'out'), ('stderr', 'err'),
+                          ('stdout', 'same time')])
+        self.multiplexer.stop()
+
+    def test_resume(self):
+        cont = _FakeContainer('app')
+        self.multiplexer = log_stream.LogMultiplexer(_FakeClient(tty=True))
+        self.multiplexer.follow(cont)
+        self._wait_for_connections(1)
+        self._request(0)
+        self.connections[0].sendall(
+            'HTTP/1.1 200 OK\r\n\r\n'
+            '2015-10-10T12:00:00.1Z one\n'
+            '2015-10-10T12:00:00.2Z two\n')
+        self.assertEqual([l.text for l in self._get(2)], ['one', 'two'])
+
+        # The container is still running, so the connection is reopened
+        # and the lines that were seen already are skipped.
+        self.connections[0].close()
+        self._wait_for_connections(2)
+        self.assertEqual(self._request(1)['since'], '1444478400')
+        self.connections[1].sendall(
+            'HTTP/1.1 200 OK\r\n\r\n'
+            '2015-10-10T12:00:00.1Z one\n'
+            '2015-10-10T12:00:00.2Z two\n'
+            '2015-10-10T12:00:00.3Z three\n')
+        self.assertEqual([l.text for l in self._get(1)], ['three'])
+
+        cont.is_running = False
+        self.connections[1].close()
+        self.multiplexer._stopped.wait(0.3)
+        self.assertEqual(len(self.connections), 2)
+        self.multiplexer.stop()
+
+    def test_backpressure(self):
+        self.multiplexer = log_stream.LogMultiplexer(_FakeClient(tty=True),
+                                                     queue_size=1)
+        self.multiplexer.follow(_FakeContainer('app'))
+        self._wait_for_connections(1)
+        self._request(0)
+        self.connections[0].sendall(
+            'HTTP/1.1 200 OK\r\n\r\n' +
+            ''.join('2015-10-10T12:00:0{0}Z {0}\n'.format(i)
+                    for i in range(5)))
+
+        # The lines wait for the consumer rather than being dropped.
+        lines = []
+        for line in self.multiplexer.lines():
+            lines.append(line.text)
+            if len(lines) == 5:
+                break
+        self.assertEqual(lines, ['0', '1', '2', '3', '4'])
+        self.multiplexer.stop()
+
+    def test_error_status(self):
+        cont = _FakeContainer('app')
+        cont.is_running = False
+        self.multiplexer = log_stream.LogMultiplexer(_FakeClient())
+        self.multiplexer.follow(cont)
+        self._wait_for_connections(1)
+        self._request(0)
+        self.connections[0].sendall('HTTP/1.1 404 Not Found\r\n\r\n')
+        self.multiplexer._stopped.wait(0.3)
+        self.assertEqual(self.multiplexer._followers, [])
+        self.multiplexer.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+# Copyright 2015 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for appstart.sandbox.scheduler."""
+
+# This file conforms to the external style guide.
+# pylint: disable=bad-indentation, g-bad-import-order
+
+import threading
+import unittest
+
+from appstart.sandbox import scheduler
+
+
+class PhaseSchedulerTest(unittest.TestCase):
+
+    def test_dependency_order(self):
+        order = []
+        phases = scheduler.PhaseScheduler()
+        phases.add_phase('a', lambda: order.append('a'))
+        phases.add_phase('b', lambda: order.append('b'), dependencies=['a'])
+        phases.add_phase('c', lambda: order.append('c'),
+                         dependencies=['a', 'b'])
+        phases.run()
+        self.assertEqual(order, ['a', 'b', 'c'])
+        self.assertEqual(set(phases.timings), {'a', 'b', 'c'})
+
+    def test_independent_phases_overlap(self):
+        # Each phase waits for the other to have started. This can only
+        # succeed if both run at the same time.
+        barrier = [threading.Event(), threading.Event()]
+
+        def phase(index):
+            barrier[index].set()
+            return barrier[1 - index].wait(5) or False
+
+        phases = scheduler.PhaseScheduler()
+        phases.add_phase('first', lambda: phase(0))
+        phases.add_phase('second', lambda: phase(1))
+        phases.run()
+        self.assertEqual(phases.results, {'first': True, 'second': True})
+
+    def test_error_stops_dependents(self):
+        ran = []
+
+        def fail():
+            raise ValueError('boom')
+
+        phases = scheduler.PhaseScheduler()
+        phases.add_phase('fail', fail)
+        phases.add_phase('after', lambda: ran.append('after'),
+                         dependencies=['fail'])
+        with self.assertRaises(ValueError):
+            phases.run()
+        self.assertEqual(ran, [])
+
+    def test_unknown_dependency(self):
+        phases = scheduler.PhaseScheduler()
+        with self.assertRaises(ValueError):
+            phases.add_phase('a', lambda: None, dependencies=['b'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,158 @@
+# Copyright 2015 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for appstart.sandbox.stats."""
+
+# This file conforms to the external style guide.
+# pylint: disable=bad-indentation, g-bad-import-order
+
+import threading
+import time
+import unittest
+
+from appstart.sandbox import container
+from appstart.sandbox import stats
+from appstart import utils
+
+from fakes import fake_docker
+
+_MB = 1 << 20
+
+
+def _stats(total_usage, system_usage, memory, rx_bytes=0, read_bytes=0):
+    return {'cpu_stats': {'cpu_usage': {'total_usage': total_usage,
+                                        'percpu_usage': [0, 0]},
+                          'system_cpu_usage': system_usage},
+            'memory_stats': {'usage': memory, 'limit': 1024 * _MB},
+            'networks': {'eth0': {'rx_bytes': rx_bytes, 'tx_bytes': 10},
+                         'eth1': {'rx_bytes': rx_bytes, 'tx_bytes': 5}},
+            'blkio_stats': {'io_service_bytes_recursive': [
+                {'op': 'Read', 'value': read_bytes},
+                {'op': 'Write', 'value': 7},
+                {'op': 'Total', 'value': read_bytes + 7}]}}
+
+
+class SampleBufferTest(unittest.TestCase):
+
+    def _sample(self, when):
+        return stats.Sample(when, 0, 0, 0, 0, 0, 0, 0)
+
+    def test_wraps_around(self):
+        buf = stats.SampleBuffer(capacity=3)
+        for when in range(5):
+            buf.append(self._sample(when))
+        self.assertEqual(len(buf), 3)
+        self.assertEqual([s.time for s in buf.samples()], [2, 3, 4])
+
+    def test_since(self):
+        buf = stats.SampleBuffer(capacity=5)
+        for when in range(4):
+            buf.append(self._sample(when))
+        self.assertEqual([s.time for s in buf.samples(since=2)], [2, 3])
+        self.assertEqual(stats.SampleBuffer().samples(), [])
+
+
+class MakeSampleTest(unittest.TestCase):
+
+    def test_cpu_against_previous(self):
+        sample = stats.make_sample(_stats(300, 2000, 5 * _MB),
+                                   previous=_stats(100, 1000, 0), now=1)
+        # 200 of 1000 system ticks, on 2 cpus.
+        self.assertAlmostEqual(sample.cpu_percent, 40.0)
+        self.assertEqual(sample.time, 1)
+        self.assertEqual(sample.memory_usage, 5 * _MB)
+        self.assertEqual(sample.rx_bytes, 0)
+        self.assertEqual(sample.tx_bytes, 15)
+        self.assertEqual(sample.write_bytes, 7)
+
+    def test_cpu_against_precpu_stats(self):
+        raw = _stats(300, 2000, 0, rx_bytes=4, read_bytes=3)
+        raw['precpu_stats'] = _stats(200, 1000, 0)['cpu_stats']
+        sample = stats.make_sample(raw)
+        self.assertAlmostEqual(sample.cpu_percent, 20.0)
+        self.assertEqual(sample.rx_bytes, 8)
+        self.assertEqual(sample.read_bytes, 3)
+
+    def test_old_network_format(self):
+        sample = stats.make_sample({'network': {'rx_bytes': 3,
+                                                'tx_bytes': 4}})
+        self.assertEqual((sample.rx_bytes, sample.tx_bytes), (3, 4))
+        self.assertEqual(sample.cpu_percent, 0)
+
+
+class StatsCollectorTest(fake_docker.FakeDockerTestBase):
+
+    def setUp(self):
+        super(StatsCollectorTest, self).setUp()
+        fake_docker.images.append('app')
+        self.dclient = utils.get_docker_client()
+        self.cont = container.Container(self.dclient)
+        self.cont.create(name='app', image='app')
+
+    def _collect(self, raw_stats, interval=0):
+        fake_docker.find_container(self.cont.get_id())['Stats'] = raw_stats
+        collector = stats.StatsCollector(self.dclient, {'app': self.cont},
+                                         interval=interval)
+        collector.start()
+        for thread in threading.enumerate():
+            if thread.name == 'stats-app':
+                thread.join()
+        return collector
+
+    def test_collect(self):
+        collector = self._collect([_stats(100, 1000, 10 * _MB),
+                                   _stats(200, 2000, 30 * _MB),
+                                   _stats(400, 3000, 20 * _MB)])
+        samples = collector.samples('app')
+        self.assertEqual([s.memory_usage for s in samples],
+                         [10 * _MB, 30 * _MB, 20 * _MB])
+        self.assertAlmostEqual(samples[2].cpu_percent, 40.0)
+
+        summary = collector.summarize('app')
+        self.assertEqual(summary['samples'], 3)
+        self.assertAlmostEqual(summary['memory_peak'], 30)
+        self.assertAlmostEqual(summary['memory_final'], 20)
+        self.assertAlmostEqual(summary['memory_growth'], 10)
+        self.assertAlmostEqual(summary['cpu_peak'], 40.0)
+
+        self.assertIsNone(collector.summarize('app', since=time.time() + 1))
+
+    def test_interval(self):
+        collector = self._collect([_stats(0, 0, 0)] * 5, interval=60)
+        self.assertEqual(len(collector.samples('app')), 1)
+
+    def test_stopped(self):
+        fake_docker.find_container(self.cont.get_id())['Stats'] = [
+            _stats(0, 0, 0)]
+        collector = stats.StatsCollector(self.dclient, {'app': self.cont})
+        collector.stop()
+        collector.start()
+        for thread in threading.enumerate():
+            if thread.name == 'stats-app':
+                thread.join()
+        self.assertEqual(collector.samples('app'), [])
+        self.assertIsNone(collector.summarize('app'))
+
+    def test_removed_container(self):
+        collector = stats.StatsCollector(self.dclient, {'app': self.cont})
+        self.cont.remove(force=True)
+        collector.start()
+        for thread in threading.enumerate():
+            if thread.name == 'stats-app':
+                thread.join()
+        self.assertEqual(collector.samples('app'), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -24,9 +24,11 @@ import shutil
 import tarfile
 import tempfile
 import textwrap
+import time
 import unittest
 
 import docker
+import requests
 
 from fakes import fake_docker
 from appstart import utils
@@ -49,6 +51,38 @@ class DockerTest(fake_docker.FakeDockerTestBase):
         self.assertIn('tls', dclient.kwargs)
         self.assertIn('base_url', dclient.kwargs)
 
+    def test_docker_client_is_cached(self):
+        created = []
+
+        class CountingClient(fake_docker.FakeDockerClient):
+
+            def __init__(self, **kwargs):
+                super(CountingClient, self).__init__(**kwargs)
+                created.append(self)
+
+        self.stubs.Set(docker, 'Client', CountingClient)
+        dclient = utils.get_docker_client()
+        dclient.version()
+        dclient.images()
+        self.assertIs(utils.get_docker_client(), dclient)
+        self.assertEqual(len(created), 1)
+
+    def test_docker_client_reconnects(self):
+        failures = []
+
+        class FlakyClient(fake_docker.FakeDockerClient):
+
+            def images(self, *args, **kwargs):
+                if not failures:
+                    failures.append(self)
+                    raise requests.exceptions.ConnectionError('broken pipe')
+                return super(FlakyClient, self).images(*args, **kwargs)
+
+        self.stubs.Set(docker, 'Client', FlakyClient)
+        dclient = utils.get_docker_client()
+        self.assertTrue(dclient.images())
+        self.assertEqual(len(failures), 1)
+
     def test_build_from_directory(self):
         utils.build_from_directory(APP_DIR, 'test')
         self.assertEqual(len(fake_docker.images),
@@ -98,11 +132,31 @@ class TarTest(unittest.TestCase):
                          self.tempfile2.name: '/baz/bar.txt'}
 
         context = utils.make_tar_build_context(dockerfile, context_files)
-        tar = tarfile.TarFile(fileobj=context)
+        tar = tarfile.TarFile(fileobj=io.BytesIO(''.join(context)))
 
+        self.assertEqual(tar.extractfile('Dockerfile').read(), 'FROM debian')
         self.assertEqual(tar.extractfile('foo.txt').read(), 'foo')
         self.assertEqual(tar.extractfile('baz/bar.txt').read(), 'bar')
 
+    def test_make_compressed_build_context(self):
+        dockerfile = io.BytesIO('FROM debian'.encode('utf-8'))
+        context_files = {self.tempfile1.name: 'foo.txt',
+                         self.tempfile2.name: None}
+
+        context = ''.join(utils.make_tar_build_context(dockerfile,
+                                                       context_files,
+                                                       compress=True))
+        tar = tarfile.open(mode='r:gz', fileobj=io.BytesIO(context))
+        self.assertEqual(tar.getnames(),
+                         sorted(['Dockerfile', 'foo.txt',
+                                 self.tempfile2.name.lstrip('/')]))
+        self.assertEqual(tar.extractfile('foo.txt').read(), 'foo')
+
+        # The same inputs should always produce the same archive.
+        dockerfile.seek(0)
+        self.assertEqual(''.join(utils.make_tar_build_context(
+            dockerfile, context_files, compress=True)), context)
+
     def test_tar_wrapper(self):
         temp = tempfile.NamedTemporaryFile()
         tar = tarfile.open(mode='w', fileobj=temp)
@@ -137,6 +191,51 @@ class TarTest(unittest.TestCase):
         self.assertEqual(dirs, ['baz'])
         with self.assertRaises(ValueError):
             wrapped_tar.list('root/bar.txt')
+        with self.assertRaises(KeyError):
+            wrapped_tar.list('root/missing')
+
+        self.assertTrue(wrapped_tar.exists('/root/baz/'))
+        self.assertFalse(wrapped_tar.exists('root/foo.txt'))
+
+        self.assertEqual(list(wrapped_tar.walk('root')),
+                         [('root', ['baz'], ['bar.txt']),
+                          ('root/baz', [], ['foo.txt'])])
+        self.assertEqual(wrapped_tar.glob('root/*.txt'), ['root/bar.txt'])
+        self.assertEqual(wrapped_tar.glob('*/*/foo.*'), ['root/baz/foo.txt'])
+        self.assertEqual(wrapped_tar.glob('root/baz'), ['root/baz'])
+        self.assertEqual(wrapped_tar.glob('root/bar.txt/*'), [])
+
+    def test_tar_wrapper_implicit_directories(self):
+        """Directories without members of their own can still be listed."""
+        temp = tempfile.NamedTemporaryFile()
+        tar = tarfile.open(mode='w', fileobj=temp)
+        for name in ('logs/app/1.log', 'logs/app/2.log', 'logs/app.log'):
+            tar.addfile(tarfile.TarInfo(name), io.BytesIO(''))
+        tar.close()
+        temp.seek(0)
+
+        wrapped_tar = utils.TarWrapper(tarfile.open(mode='r', fileobj=temp))
+        self.assertEqual(wrapped_tar.list('logs'), (['app.log'], ['app']))
+        self.assertEqual(wrapped_tar.list('/'), ([], ['logs']))
+        self.assertEqual(wrapped_tar.glob('logs/*/*.log'),
+                         ['logs/app/1.log', 'logs/app/2.log'])
+
+    def test_tar_wrapper_large_directory(self):
+        """Indexing a directory with many entries takes linear time."""
+        fileobj = io.BytesIO()
+        tar = tarfile.open(mode='w', fileobj=fileobj)
+        names = ['{0}.log'.format(i) for i in range(20000)]
+        for name in names:
+            tar.addfile(tarfile.TarInfo('logs/' + name))
+        tar.close()
+        fileobj.seek(0)
+        tar = tarfile.open(mode='r', fileobj=fileobj)
+        tar.getmembers()
+
+        start = time.time()
+        wrapped_tar = utils.TarWrapper(tar)
+        self.assertLess(time.time() - start, 1)
+        self.assertEqual(wrapped_tar.list('logs'), (names, []))
 
 
 class FileCollectionTest(unittest.TestCase):
@@ -0,0 +1,288 @@
+# Copyright 2015 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for appstart.validator.batch."""
+
+# This file conforms to the external style guide.
+# pylint: disable=bad-indentation, g-bad-import-order
+
+import os
+import shutil
+import stat
+import stubout
+import sys
+import tempfile
+import textwrap
+import threading
+import time
+import unittest
+
+from appstart import utils
+from appstart.sandbox import container_sandbox
+from appstart.validator import batch
+from appstart.validator import contract
+from appstart.validator import reports
+from appstart.validator import runtime_contract
+
+
+class LoadBatchFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.batch_file = os.path.join(self.directory, 'batch.yaml')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _load(self, contents):
+        with open(self.batch_file, 'w') as batch_file:
+            batch_file.write(textwrap.dedent(contents))
+        return batch.load_batch_file(self.batch_file)
+
+    def test_load(self):
+        sandboxes = self._load('''\
+            defaults:
+              application_id: ci
+              storage_path: storage
+            sandboxes:
+              - config_files: frontend/app.yaml
+              - config_files: [/apps/frontend/app.yaml]
+                application_id: other
+              - image_name: gcr.io/my-project/backend:latest
+              - name: my service!
+                image_name: backend
+            ''')
+        self.assertEqual([name for name, _ in sandboxes],
+                         ['frontend', 'frontend_2', 'backend', 'my_service'])
+        self.assertEqual(sandboxes[0][1], {
+            'application_id': 'ci',
+            'config_files': [os.path.join(self.directory, 'frontend',
+                                          'app.yaml')],
+            'storage_path': os.path.join(self.directory, 'storage')})
+        self.assertEqual(sandboxes[1][1]['config_files'],
+                         ['/apps/frontend/app.yaml'])
+        self.assertEqual(sandboxes[1][1]['application_id'], 'other')
+
+    def test_bad_batch_files(self):
+        with self.assertRaises(utils.AppstartAbort):
+            self._load('- config_files: [app.yaml]\n')
+        with self.assertRaises(utils.AppstartAbort):
+            self._load('sandboxes:\n  - config_files: [app.yaml]\n'
+                       '    port: 8080\n')
+        with self.assertRaises(utils.AppstartAbort):
+            self._load('sandboxes: [[]]\n')
+        with self.assertRaises(utils.AppstartAbort):
+            batch.load_batch_file(os.path.join(self.directory, 'missing'))
+
+
+class BatchValidatorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.output_dir = os.path.join(self.directory, 'output')
+        test = self
+
+        # {basestring: dict} The keyword arguments of each sandbox, by
+        # application_id.
+        self.sandbox_kwargs = {}
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+
+        # The next port to give sandboxes that ask for a free one.
+        self.next_port = 32768
+
+        class FakeConfiguration(object):
+            health_checks_enabled = True
+
+        class FakeAppContainer(object):
+            host = 'localhost'
+            configuration = FakeConfiguration()
+
+            def get_id(self):
+                return '123'
+
+        class FakeSandbox(object):
+
+            def __init__(self, **kwargs):
+                self.kwargs = kwargs
+                self.app_dir = os.path.dirname(kwargs['config_files'][0])
+                self.app_container = FakeAppContainer()
+                self.port = kwargs['application_port']
+                test.sandbox_kwargs[kwargs['application_id']] = kwargs
+
+            def start(self):
+                with test.lock:
+                    test.active += 1
+                    test.max_active = max(test.max_active, test.active)
+                    if self.port == container_sandbox.AUTO_PORT:
+                        self.port = test.next_port
+                        test.next_port += 1
+                time.sleep(0.1)
+                with test.lock:
+                    test.active -= 1
+                if self.kwargs['application_id'] == 'broken':
+                    raise utils.AppstartAbort('Could not start')
+
+            def stop(self):
+                pass
+
+            def get_host_log_path(self):
+                return None
+
+        class Passes(contract.ContractClause):
+            title = 'Passes unless the application is bad'
+            description = 'test'
+            lifecycle_point = contract.POST_START
+            error_level = contract.FATAL
+
+            def evaluate_clause(self, app_container):
+                self.assertNotEqual(self.sandbox.kwargs['application_id'],
+                                    'bad')
+
+        class Module(object):
+            passes = Passes
+
+        self.module = Module
+        self.old_sandbox = container_sandbox.ContainerSandbox
+        container_sandbox.ContainerSandbox = FakeSandbox
+        self.stubs = stubout.StubOutForTesting()
+
+    def tearDown(self):
+        self.stubs.UnsetAll()
+        container_sandbox.ContainerSandbox = self.old_sandbox
+        shutil.rmtree(self.directory)
+
+    def _app(self, name):
+        """Make an application directory, returning its sandbox options."""
+        app_dir = os.path.join(self.directory, name)
+        os.makedirs(os.path.join(app_dir, contract.HOOK_DIRECTORY))
+        with open(os.path.join(app_dir, 'app.yaml'), 'w') as conf_file:
+            conf_file.write('vm: true\n')
+        return {'config_files': [os.path.join(app_dir, 'app.yaml')],
+                'application_id': name}
+
+    def test_validate(self):
+        sandboxes = [(name, self._app(name))
+                     for name in ('good', 'bad', 'broken')]
+        sandboxes[0][1]['application_port'] = 8081
+        report_file = os.path.join(self.directory, 'report.json')
+        validator = batch.BatchValidator(self.module, sandboxes,
+                                         self.output_dir, jobs=2)
+        self.assertFalse(validator.validate(report_file=report_file))
+        self.assertEqual(self.max_active, 2)
+
+        self.assertTrue(validator.results['good'].success)
+        self.assertFalse(validator.results['bad'].success)
+        self.assertIsNone(validator.results['bad'].error)
+        self.assertEqual(validator.results['broken'].error, 'Could not start')
+
+        # Sandboxes get free ports and directories of their own.
+        self.assertEqual(self.sandbox_kwargs['good']['application_port'], 8081)
+        self.assertEqual(self.sandbox_kwargs['bad']['application_port'],
+                         container_sandbox.AUTO_PORT)
+        self.assertEqual(self.sandbox_kwargs['bad']['storage_path'],
+                         os.path.join(self.output_dir, 'bad', 'storage'))
+        for name, _ in sandboxes:
+            self.assertTrue(os.path.exists(os.path.join(
+                self.output_dir, name, batch.LOG_FILE)))
+
+        plan, records, summary = reports.read_json_report(report_file)
+        self.assertEqual([step['sandbox'] for step in plan['execution_plan']],
+                         ['good', 'bad', 'broken'])
+        self.assertEqual(
+            [(r['sandbox'], r['name'], r['outcome']) for r in records],
+            [('good', 'Passes', reports.PASSED),
+             ('bad', 'Passes', reports.FAILED),
+             ('broken', 'Sandbox', reports.ERROR)])
+        self.assertEqual(records[2]['message'], 'Could not start')
+        self.assertFalse(summary['success'])
+
+        validator.write_report(report_file, 'junit', time.time())
+        with open(report_file) as report:
+            junit = report.read()
+        self.assertIn('<testsuite name="good.Post Start">', junit)
+        self.assertIn('<testsuite name="broken.Pre Start">', junit)
+
+    def test_hooks_stay_with_their_sandbox(self):
+        hooked = self._app('hooked')
+        hook = os.path.join(self.directory, 'hooked', contract.HOOK_DIRECTORY,
+                            'hook.py')
+        with open(hook, 'w') as hook_file:
+            hook_file.write('#!{0}\nimport sys\nsys.exit(1)\n'.format(
+                sys.executable))
+        os.chmod(hook, stat.S_IEXEC | stat.S_IREAD | stat.S_IWRITE)
+        with open(hook + '.conf.yaml', 'w') as conf_file:
+            conf_file.write(textwrap.dedent('''\
+                name: Hook
+                title: Failing hook
+                description: test
+                lifecycle_point: PRE_START
+                error_level: FATAL
+                dependents: [Passes]'''))
+
+        validator = batch.BatchValidator(
+            self.module, [('hooked', hooked), ('plain', self._app('plain'))],
+            self.output_dir)
+        report_file = os.path.join(self.directory, 'report.json')
+        self.assertFalse(validator.validate(report_file=report_file))
+        self.assertTrue(validator.results['plain'].success)
+
+        _, records, _ = reports.read_json_report(report_file)
+        self.assertEqual(
+            [(r['sandbox'], r['name'], r['outcome']) for r in records],
+            [('hooked', 'Hook', reports.FAILED),
+             ('hooked', 'Passes', reports.SKIPPED),
+             ('plain', 'Passes', reports.PASSED)])
+
+    def test_clauses_use_resolved_ports(self):
+        urls = []
+
+        class Response(object):
+            status_code = 200
+
+        def get(url):
+            with self.lock:
+                urls.append(url)
+            return Response()
+
+        def check_load(unused_clause, host, port):
+            get('http://{0}:{1}/_ah/health'.format(host, port))
+
+        self.stubs.Set(runtime_contract.requests, 'get', get)
+        self.stubs.Set(runtime_contract.LoadTester, 'check_load', check_load)
+
+        class Module(object):
+            enabled = runtime_contract.HealthChecksEnabledClause
+            health = runtime_contract.HealthCheckClause
+            start = runtime_contract.StartClause
+            stop = runtime_contract.StopClause
+            load = runtime_contract.DirectLoadClause
+
+        fixed = self._app('fixed')
+        fixed['application_port'] = 8081
+        validator = batch.BatchValidator(
+            Module, [('fixed', fixed), ('auto', self._app('auto'))],
+            self.output_dir, jobs=2)
+        self.assertTrue(validator.validate())
+
+        # Each sandbox is reached at its own port, never the default one.
+        self.assertEqual(len(urls), 8)
+        ports = sorted(set(int(url.split(':')[2].split('/')[0])
+                           for url in urls))
+        self.assertEqual(ports, [8081, 32768])
+
+
+if __name__ == '__main__':
+    unittest.main()
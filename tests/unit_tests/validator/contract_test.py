@@ -17,11 +17,16 @@
 # This file conforms to the external style guide.
 # pylint: disable=bad-indentation, g-bad-import-order
 
+import json
 import logging
 import os
 import stat
+import sys
 import tempfile
 import textwrap
+import threading
+import time
+import unittest
 
 from appstart import utils
 from appstart.sandbox import container_sandbox
@@ -203,6 +208,9 @@ class HookClauseTest(ClauseTestBase):
             def stop(self):
                 pass
 
+            def get_host_log_path(self):
+                return None
+
         class Module(object):
             pass
 
@@ -262,6 +270,16 @@ class HookClauseTest(ClauseTestBase):
             self.module,
             config_file=os.path.join(self.app_dir, 'app.yaml'))
 
+        # Limits must be numbers, and YAML booleans are not.
+        for limit in ('timeout: yes', 'timeout: 0', 'timeout: -1',
+                      'retries: true', 'retries: -1', 'retries: 1.5',
+                      'max_parallel: true', 'max_parallel: 0'):
+            self._add_file('validator_tests/test1.py.conf.yaml',
+                           test_config + '\n' + limit)
+            with self.assertRaises(utils.AppstartAbort):
+                contract.ContractValidator(self.module,
+                                           config_file=self.conf_file)
+
     def test_evaluate_hook_clauses(self):
         """Test that hook clauses are actually being evaluated."""
 
@@ -277,7 +295,15 @@ class HookClauseTest(ClauseTestBase):
 
         validator = contract.ContractValidator(self.module,
                                                config_file=self.conf_file)
-        self.assertTrue(validator.validate())
+        report_file = os.path.join(self.app_dir, 'report.json')
+        self.assertTrue(validator.validate(report_file=report_file))
+
+        # The resources used by the hook are reported.
+        record = [json.loads(line) for line in open(report_file)][1]
+        self.assertEqual(record['hook_usage']['attempts'], 1)
+        self.assertIsNotNone(record['hook_usage']['return_code'])
+        self.assertGreater(record['hook_usage']['wall_time'], 0)
+        self.assertIsNotNone(record['hook_usage']['max_rss'])
 
         self._add_file(self.default_test_file, self.unsuccessful_hook)
         os.chmod(os.path.join(self.app_dir, self.default_test_file),
@@ -303,6 +329,57 @@ class HookClauseTest(ClauseTestBase):
         # than FATAL.
         self.assertFalse(validator.validate())
 
+    def test_persistent_hook_clauses(self):
+        """Persistent hooks that share a command share one process."""
+        starts_file = os.path.join(self.app_dir, 'starts')
+        self._add_file('validator_tests/worker.py', textwrap.dedent('''\
+            #!{1}
+            import json
+            import sys
+            open({0!r}, 'a').write('started\\n')
+            results = {{'Pass': 'pass', 'Fail': 'fail', 'Skip': 'skip'}}
+            for line in iter(sys.stdin.readline, ''):
+                request = json.loads(line)
+                assert request['container_id'] == '123'
+                sys.stdout.write(json.dumps(
+                    {{'result': results[request['clause']],
+                     'message': request['clause']}}) + '\\n')
+                sys.stdout.flush()
+            '''.format(starts_file, sys.executable)))
+        os.chmod(os.path.join(self.app_dir, 'validator_tests/worker.py'),
+                 stat.S_IEXEC | stat.S_IREAD | stat.S_IWRITE)
+
+        def add_config(name):
+            self._add_file(
+                'validator_tests/{0}.conf.yaml'.format(name),
+                textwrap.dedent('''\
+                    name: {0}
+                    title: {0}
+                    description: A persistent hook.
+                    lifecycle_point: POST_START
+                    error_level: FATAL
+                    persistent: true
+                    command: {1}
+                    '''.format(name, os.path.join(self.app_dir,
+                                                   'validator_tests',
+                                                   'worker.py'))))
+
+        add_config('Pass')
+        add_config('Skip')
+        validator = contract.ContractValidator(self.module,
+                                               config_file=self.conf_file)
+        self.assertEqual(len(validator.hook_workers), 1)
+        self.assertTrue(validator.validate())
+
+        add_config('Fail')
+        validator = contract.ContractValidator(self.module,
+                                               config_file=self.conf_file)
+        self.assertFalse(validator.validate())
+
+        # The worker is started once per validation.
+        with open(starts_file) as f:
+            self.assertEqual(f.read().count('started'), 2)
+
     def test_loop_detection(self):
         """Test that the validator detects dependency loops."""
 
@@ -359,6 +436,79 @@ class HookClauseTest(ClauseTestBase):
             with self.assertRaises(errors.CircularDependencyError):
                 contract.ContractValidator(mod, config_file=self.conf_file)
 
+    def test_cycle_report(self):
+        """The reported loop should only contain the clauses in the loop."""
+
+        class Test1(contract.ContractClause):
+            title = 'test'
+            description = 'test'
+            lifecycle_point = contract.POST_START
+            _unresolved_dependencies = {'Test3'}
+
+        class Test2(contract.ContractClause):
+            title = 'test'
+            description = 'test'
+            lifecycle_point = contract.POST_START
+            _unresolved_dependencies = {'Test1'}
+
+        class Test3(contract.ContractClause):
+            title = 'test'
+            description = 'test'
+            lifecycle_point = contract.POST_START
+            _unresolved_dependencies = {'Test2'}
+
+        class Test4(contract.ContractClause):
+            title = 'test'
+            description = 'test'
+            lifecycle_point = contract.POST_START
+            _unresolved_dependencies = {'Test1'}
+
+        class LoopyModule(object):
+            test1 = Test1
+            test2 = Test2
+            test3 = Test3
+            test4 = Test4
+
+        with self.assertRaises(errors.CircularDependencyError) as cm:
+            contract.ContractValidator(LoopyModule, config_file=self.conf_file)
+        self.assertIn('Test1->Test3->Test2->Test1', str(cm.exception))
+
+    def test_execution_plan(self):
+        """Deep dependency chains are planned level by level."""
+        chain = {}
+        previous = None
+        for index in range(2000):
+            attrs = {'title': 'test',
+                     'description': 'test',
+                     'lifecycle_point': contract.POST_START,
+                     'dependencies': {previous} if previous else set()}
+            previous = type('Chain{0:04}'.format(index),
+                            (contract.ContractClause,), attrs)
+            chain[previous.__name__.lower()] = previous
+
+        class Other(contract.ContractClause):
+            title = 'test'
+            description = 'test'
+            lifecycle_point = contract.POST_START
+
+        class Early(contract.ContractClause):
+            title = 'test'
+            description = 'test'
+            lifecycle_point = contract.PRE_START
+
+        chain.update(other=Other, early=Early)
+        module = type('Module', (object,), chain)
+        validator = contract.ContractValidator(module,
+                                               config_file=self.conf_file)
+        plan = validator.execution_plan
+        self.assertEqual([step['lifecycle_point'] for step in plan],
+                         ['Pre Start', 'Post Start'])
+        self.assertEqual(plan[0]['levels'], [['Early']])
+        self.assertEqual(plan[1]['levels'][0], ['Chain0000', 'Other'])
+        self.assertEqual(plan[1]['levels'][-1], ['Chain1999'])
+        self.assertEqual(len(plan[1]['levels']), 2000)
+        json.dumps(plan)
+
     def test_dependency_order(self):
         """Test that dependencies get executed in correct order."""
         ordering = []
@@ -410,6 +560,153 @@ class HookClauseTest(ClauseTestBase):
         types = [type(obj) for obj in ordering]
         self.assertEqual(types, [Test0, Test1, Test2, Test3])
 
+    def test_parallel_clauses(self):
+        """Independent clauses run concurrently; dependents still wait."""
+        started = {'Test1': threading.Event(), 'Test2': threading.Event()}
+        finished = []
+
+        class Test1(contract.ContractClause):
+            title = 'test'
+            description = 'test'
+            lifecycle_point = contract.POST_START
+
+            def evaluate_clause(self, app_container):
+                started['Test1'].set()
+                self.assertTrue(started['Test2'].wait(5))
+                finished.append(type(self))
+
+        class Test2(contract.ContractClause):
+            title = 'test'
+            description = 'test'
+            lifecycle_point = contract.POST_START
+
+            def evaluate_clause(self, app_container):
+                started['Test2'].set()
+                self.assertTrue(started['Test1'].wait(5))
+                time.sleep(0.1)
+                finished.append(type(self))
+
+        class Test3(contract.ContractClause):
+            title = 'test'
+            description = 'test'
+            lifecycle_point = contract.POST_START
+            dependencies = {Test2}
+
+            def evaluate_clause(self, app_container):
+                finished.append(type(self))
+
+        class Module(object):
+            test1 = Test1
+            test2 = Test2
+            test3 = Test3
+
+        validator = contract.ContractValidator(Module,
+                                               config_file=self.conf_file)
+        self.assertTrue(validator.validate(parallel=2))
+        self.assertEqual(finished, [Test1, Test2, Test3])
+        self.assertEqual(validator.prerequisites,
+                         {Test1: set(), Test2: set(), Test3: {Test2}})
+
+        # Results are reported in the order of the contract, even though
+        # Test1 finished first.
+        clauses = validator.contract[contract.POST_START]
+        runner = contract.ContractTestRunner(set(), contract.WARNING, None,
+                                             False)
+        finished[:] = []
+        for event in started.itervalues():
+            event.clear()
+        result = runner.run(unittest.TestSuite(clauses), 'Post Start',
+                            parallel=2, prerequisites=validator.prerequisites)
+
+        with self.assertRaises(ValueError):
+            runner.run(unittest.TestSuite(clauses), 'Post Start', parallel=2)
+        self.assertEqual(result.success_list, clauses)
+
+    def test_soak_duration(self):
+        """Clauses see the soak duration given to the validator."""
+        durations = []
+
+        class Test1(contract.ContractClause):
+            title = 'test'
+            description = 'test'
+            lifecycle_point = contract.LOAD
+
+            def evaluate_clause(self, app_container):
+                durations.append(self.soak_duration)
+
+        class Module(object):
+            test1 = Test1
+
+        validator = contract.ContractValidator(Module,
+                                               config_file=self.conf_file)
+        validator.validate()
+        validator.validate(soak_duration=30)
+        self.assertEqual(durations, [0, 30])
+
+    def test_report(self):
+        """Each evaluated clause is written to the report."""
+
+        class Test1(contract.ContractClause):
+            title = 'test'
+            description = 'test'
+            lifecycle_point = contract.POST_START
+            error_level = contract.FATAL
+
+            def evaluate_clause(self, app_container):
+                time.sleep(0.01)
+                self.fail('broken')
+
+        class Test2(contract.ContractClause):
+            title = 'test'
+            description = 'test'
+            lifecycle_point = contract.POST_START
+            dependencies = {Test1}
+
+            def evaluate_clause(self, app_container):
+                pass
+
+        class Test3(contract.ContractClause):
+            title = 'test'
+            description = 'test'
+            lifecycle_point = contract.LOAD
+
+            def evaluate_clause(self, app_container):
+                self.metrics = {'p50': 0.1}
+
+        class Module(object):
+            test1 = Test1
+            test2 = Test2
+            test3 = Test3
+
+        report_file = os.path.join(self.app_dir, 'report.json')
+        validator = contract.ContractValidator(Module,
+                                               config_file=self.conf_file)
+        self.assertFalse(validator.validate(report_file=report_file))
+
+        lines = [json.loads(line) for line in open(report_file)]
+        self.assertEqual([line['type'] for line in lines],
+                         ['plan', 'clause', 'clause', 'clause', 'summary'])
+        self.assertEqual(lines[0]['execution_plan'],
+                         validator.execution_plan)
+
+        failed, skipped = lines[1:3]
+        self.assertEqual((failed['name'], failed['outcome'],
+                          failed['error_level'], failed['message']),
+                         ('Test1', 'FAILED', 'FATAL', 'broken'))
+        self.assertGreaterEqual(failed['duration'], 0.01)
+        self.assertEqual((skipped['name'], skipped['outcome'],
+                          skipped['dependencies'], skipped['lifecycle_point']),
+                         ('Test2', 'SKIPPED', ['Test1'], 'Post Start'))
+        self.assertIn('did not pass', skipped['message'])
+
+        # The load point comes after the post start point.
+        self.assertEqual((lines[3]['name'], lines[3]['lifecycle_point'],
+                          lines[3]['metrics']), ('Test3', 'Load', {'p50': 0.1}))
+        self.assertFalse(lines[4]['success'])
+
+        with self.assertRaises(utils.AppstartAbort):
+            validator.validate(report_file=report_file, report_format='csv')
+
     def tearDown(self):
         super(HookClauseTest, self).tearDown()
         logging.getLogger('appstart.validator').disabled = False
@@ -0,0 +1,142 @@
+# Copyright 2015 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for validator.hooks."""
+
+# This file conforms to the external style guide.
+# pylint: disable=bad-indentation, g-bad-import-order
+
+import os
+import shutil
+import stubout
+import sys
+import tempfile
+import textwrap
+import time
+import unittest
+
+from appstart.validator import hooks
+
+
+class RunCommandTest(unittest.TestCase):
+
+    def test_success(self):
+        run = hooks.run_command('exit 0', dict(os.environ))
+        self.assertEqual(run.result, hooks.PASS)
+        self.assertEqual(run.return_code, 0)
+        self.assertIsNotNone(run.cpu_time)
+        self.assertGreater(run.max_rss, 0)
+
+    def test_failure(self):
+        run = hooks.run_command('echo broken; exit 3', dict(os.environ))
+        self.assertEqual(run.result, hooks.FAIL)
+        self.assertEqual(run.return_code, 3)
+        self.assertIn('broken', run.message)
+
+    def test_timeout_kills_subprocesses(self):
+        temp_dir = tempfile.mkdtemp()
+        marker = os.path.join(temp_dir, 'marker')
+        try:
+            start = time.time()
+            # The subshell outlives the shell unless the group is killed.
+            run = hooks.run_command('(sleep 1; touch {0}) & sleep 5'.format(
+                marker), dict(os.environ), timeout=0.2)
+            self.assertLess(time.time() - start, 1)
+            self.assertTrue(run.timed_out)
+            self.assertEqual(run.result, hooks.FAIL)
+            time.sleep(1.5)
+            self.assertFalse(os.path.exists(marker))
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_interrupt_kills_subprocesses(self):
+        temp_dir = tempfile.mkdtemp()
+        marker = os.path.join(temp_dir, 'marker')
+        stubs = stubout.StubOutForTesting()
+
+        def interrupt(unused_seconds):
+            raise KeyboardInterrupt()
+
+        try:
+            stubs.Set(hooks.time, 'sleep', interrupt)
+            with self.assertRaises(KeyboardInterrupt):
+                hooks.run_command('(sleep 1; touch {0}) & sleep 5'.format(
+                    marker), dict(os.environ), timeout=10)
+            stubs.UnsetAll()
+            time.sleep(1.5)
+            self.assertFalse(os.path.exists(marker))
+        finally:
+            stubs.UnsetAll()
+            shutil.rmtree(temp_dir)
+
+    def test_add_attempt(self):
+        first = hooks.run_command('exit 1', dict(os.environ))
+        second = hooks.run_command('exit 0', dict(os.environ))
+        run = first.add_attempt(second)
+        self.assertIs(run, second)
+        self.assertEqual(run.attempts, 2)
+        self.assertIn('2 attempts', run.describe_usage())
+
+
+class HookWorkerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.script = os.path.join(self.temp_dir, 'worker.py')
+        with open(self.script, 'w') as f:
+            f.write(textwrap.dedent('''\
+                import json
+                import sys
+                import time
+                for line in iter(sys.stdin.readline, ''):
+                    request = json.loads(line)
+                    time.sleep(request.get('delay', 0))
+                    sys.stdout.write(json.dumps({'result': 'pass'}) + '\\n')
+                    sys.stdout.flush()
+                '''))
+        self.worker = hooks.HookWorker('{0} {1}'.format(sys.executable,
+                                                         self.script))
+
+    def tearDown(self):
+        self.worker.stop()
+        shutil.rmtree(self.temp_dir)
+
+    def test_timeout_restarts_worker(self):
+        self.assertEqual(self.worker.evaluate({}).result, hooks.PASS)
+
+        run = self.worker.evaluate({'delay': 5}, timeout=0.2)
+        self.assertEqual(run.result, hooks.FAIL)
+        self.assertTrue(run.timed_out)
+        self.assertLess(run.wall_time, 1)
+
+        # The next request is answered by a new process.
+        self.assertEqual(self.worker.evaluate({}, timeout=5).result,
+                         hooks.PASS)
+
+    def test_interrupt_kills_worker(self):
+        self.assertEqual(self.worker.evaluate({}).result, hooks.PASS)
+        process = self.worker._process
+
+        def interrupt(unused_timeout):
+            raise KeyboardInterrupt()
+
+        self.worker._read_line = interrupt
+        with self.assertRaises(KeyboardInterrupt):
+            self.worker.evaluate({'delay': 5})
+        self.assertIsNotNone(process.poll())
+        self.assertIsNone(self.worker._process)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+# Copyright 2015 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for validator.load."""
+
+# This file conforms to the external style guide.
+# pylint: disable=bad-indentation, g-bad-import-order
+
+import BaseHTTPServer
+import SocketServer
+import threading
+import unittest
+
+from appstart.validator import load
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        status = 500 if self.path == '/broken' else 200
+        self.server.seen.append(self.path)
+        self.send_response(status)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write('ok')
+
+    def log_message(self, *args):
+        pass
+
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class LoadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = _Server(('127.0.0.1', 0), _Handler)
+        self.server.seen = []
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.url = 'http://127.0.0.1:{0}'.format(self.server.server_port)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_run_load(self):
+        result = load.run_load(self.url + '/ok', 50, 5, timeout=5)
+        self.assertEqual(len(self.server.seen), 50)
+        self.assertEqual(result.requests, 50)
+        self.assertEqual(result.error_rate, 0.0)
+        self.assertGreater(result.throughput, 0)
+        metrics = result.get_metrics()
+        self.assertLessEqual(metrics['p50'], metrics['p95'])
+        self.assertLessEqual(metrics['p95'], metrics['p99'])
+
+    def test_errors(self):
+        result = load.run_load(self.url + '/broken', 10, 3)
+        self.assertEqual((result.errors, result.error_rate), (10, 1.0))
+        self.assertIsNone(result.percentile(50))
+
+        # Nothing listens on port 1.
+        result = load.run_load('http://127.0.0.1:1/', 4, 2, timeout=1)
+        self.assertEqual(result.errors, 4)
+
+    def test_percentile(self):
+        result = load.LoadResult()
+        result.latencies = [float(i) for i in range(100, 0, -1)]
+        self.assertEqual(result.percentile(50), 50.0)
+        self.assertEqual(result.percentile(99), 99.0)
+        self.assertEqual(result.percentile(100), 100.0)
+        self.assertEqual(result.percentile(0), 1.0)
+
+    def test_run_probes(self):
+        result = load.run_probes(self.url + '/ok', 0.05, 0.2, timeout=5)
+        self.assertEqual(result.outcomes, [True] * 4)
+        self.assertEqual(self.server.seen, ['/ok'] * 4)
+        self.assertGreaterEqual(result.duration, 0.15)
+        metrics = result.get_metrics()
+        self.assertEqual((metrics['requests'], metrics['flaps']), (4, 0))
+        self.assertIsNotNone(metrics['jitter'])
+
+        result = load.run_probes(self.url + '/broken', 1, 0)
+        self.assertEqual(result.outcomes, [False])
+
+    def test_probe_result(self):
+        result = load.ProbeResult()
+        result.outcomes = [True, False, False, True, False, True]
+        self.assertEqual(result.max_consecutive_failures, 2)
+        self.assertEqual(result.flaps, 2)
+        self.assertIsNone(result.jitter)
+        result.latencies = [0.1, 0.3, 0.2]
+        self.assertAlmostEqual(result.jitter, 0.15)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,210 @@
+# Copyright 2015 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for validator.log_format."""
+
+# This file conforms to the external style guide.
+# pylint: disable=bad-indentation, g-bad-import-order
+
+import StringIO
+import json
+import unittest
+
+from appstart.validator import log_format
+
+SCHEMA = {'timestamp': ['seconds', 'nanos'],
+          'severity': None,
+          'message': None}
+
+
+def _entry(**fields):
+    entry = {'timestamp': {'seconds': 1, 'nanos': 2},
+             'severity': 'INFO',
+             'message': 'hello'}
+    entry.update(fields)
+    return json.dumps(entry)
+
+
+class JsonLogValidatorTest(unittest.TestCase):
+
+    def _validate(self, lines, max_violations=log_format.MAX_VIOLATIONS):
+        validator = log_format.JsonLogValidator(SCHEMA, max_violations)
+        return validator.validate(StringIO.StringIO('\n'.join(lines)))
+
+    def test_valid_log(self):
+        report = self._validate([_entry(), '', '  ' + _entry() + '\r',
+                                 _entry(message='\\"severity\\"')])
+        self.assertEqual(report.total, 0)
+        self.assertEqual(report.lines, 3)
+
+    def test_violations(self):
+        missing = json.loads(_entry())
+        del missing['severity']
+        lines = [_entry(),
+                 'plain text',
+                 '[1, 2]',
+                 json.dumps(missing),
+                 _entry(timestamp={'seconds': 1}),
+                 _entry() + ' trailing',
+                 _entry()[:-1]]
+        report = self._validate(lines)
+        self.assertEqual(report.counts, {log_format.INVALID_JSON: 3,
+                                         log_format.NOT_AN_OBJECT: 1,
+                                         log_format.MISSING_FIELD: 1,
+                                         log_format.BAD_FIELD: 1})
+        self.assertEqual([(n, kind) for n, kind, _ in report.violations],
+                         [(2, log_format.INVALID_JSON),
+                          (3, log_format.NOT_AN_OBJECT),
+                          (4, log_format.MISSING_FIELD),
+                          (5, log_format.BAD_FIELD),
+                          (6, log_format.INVALID_JSON),
+                          (7, log_format.INVALID_JSON)])
+        self.assertIn('Missing "severity" field', report.violations[2][2])
+
+        description = report.describe()
+        self.assertTrue(description.startswith(
+            '6 of 7 lines are improperly formatted'))
+        self.assertIn('Line 5: "timestamp" must have fields', description)
+
+    def test_escaped_field_name(self):
+        # The field name can't be found in the text, but the entry is valid.
+        line = _entry().replace('"severity"', '"sev\\u0065rity"')
+        self.assertEqual(self._validate([line]).total, 0)
+
+    def test_max_violations(self):
+        report = self._validate(['bad'] * 10 + [_entry()], max_violations=3)
+        self.assertEqual(report.total, 10)
+        self.assertEqual([n for n, _, _ in report.violations], [1, 2, 3])
+        self.assertIn('(7 more)', report.describe())
+
+    def test_lines_across_chunks(self):
+        read_size = log_format.READ_SIZE
+        log_format.READ_SIZE = 7
+        try:
+            report = self._validate([_entry()] * 5 + ['bad'])
+        finally:
+            log_format.READ_SIZE = read_size
+        self.assertEqual(report.lines, 6)
+        self.assertEqual([n for n, _, _ in report.violations], [6])
+
+
+COMMON = ('127.0.0.1 - frank [10/Oct/2000:13:55:36 -0700] '
+          '"GET /apache_pb.gif HTTP/1.0" 200 2326')
+COMBINED = ('127.0.0.1 - - [29/Feb/2000:23:59:60 +0100] "GET / HTTP/1.1" '
+            '304 - "http://example.com/" "Agent \\"quoted\\""')
+
+
+class NonSeekableFile(object):
+
+    def __init__(self, data):
+        self.read = StringIO.StringIO(data).read
+
+
+class AccessLogValidatorTest(unittest.TestCase):
+
+    def setUp(self):
+        # Read in small chunks, so that sampling skips over some of them.
+        self.read_size = log_format.READ_SIZE
+        log_format.READ_SIZE = 16
+
+    def tearDown(self):
+        log_format.READ_SIZE = self.read_size
+
+    def _validate(self, lines, **sample):
+        validator = log_format.AccessLogValidator()
+        return validator.validate(StringIO.StringIO('\n'.join(lines)),
+                                  **sample)
+
+    def test_valid_log(self):
+        report = self._validate([COMMON, COMBINED, '',
+                                 '1.2.3.4 - - [01/Jan/2016:00:00:00 +0000] '
+                                 '"-" 408 0'])
+        self.assertEqual((report.total, report.lines), (0, 3))
+
+    def test_field_errors(self):
+        report = self._validate([
+            COMMON,
+            COMMON.replace('10/Oct', '31/Feb'),
+            COMMON.replace('200 2326', '600 lots'),
+            COMMON.replace('GET /apache_pb.gif HTTP/1.0', 'GET'),
+            COMMON.replace('13:55:36 -0700', '13:55:36'),
+            'not an access log'])
+        self.assertEqual(report.counts, {'timestamp': 2,
+                                         'status': 1,
+                                         'bytes': 1,
+                                         'request': 1,
+                                         'structure': 1})
+        self.assertEqual(report.total, 5)
+        self.assertEqual(report.violations[1][:2], (3, 'status, bytes'))
+
+    def test_w3c_extended(self):
+        report = self._validate([
+            '#Version: 1.0',
+            '#Fields: date time c-ip cs-method cs-uri sc-status sc-bytes '
+            'time-taken cs(User-Agent)',
+            '2016-01-01 12:00:00 1.2.3.4 GET / 200 100 0.01 "A ""B"" C"',
+            '2016-13-01 12:00 1.2.3.4 GET / 200 - - -',
+            '2016-01-01 12:00:00 1.2.3.4 GET / 200 100'])
+        self.assertEqual(report.lines, 3)
+        self.assertEqual(report.counts, {'date': 1, 'structure': 1})
+
+    def test_sampling(self):
+        lines = [COMMON] * 100
+        lines[1] = lines[50] = lines[98] = 'bad'
+
+        report = self._validate(lines, first=3, last=3)
+        self.assertTrue(report.sampled)
+        self.assertEqual(report.lines, 6)
+        self.assertEqual([n for n, _, _ in report.violations], [2, -2])
+        self.assertIn('Line 2 from the end', report.describe())
+
+        # The middle is only checked when sampling at random.
+        report = self._validate(lines, first=3, last=3, random_lines=94)
+        self.assertEqual(report.lines, 100)
+        self.assertEqual([n for n, _, _ in report.violations], [2, 51, 99])
+
+        report = self._validate(lines, random_lines=10, seed=1)
+        self.assertEqual(report.lines, 10)
+        self.assertEqual(
+            report.lines,
+            self._validate(lines, random_lines=10, seed=1).lines)
+
+        # Without sampling parameters, every line is checked.
+        self.assertEqual(self._validate(lines).total, 3)
+
+    def test_sample_lines(self):
+        lines = ['line {0}'.format(i) for i in range(1, 11)]
+        data = '\n'.join(lines) + '\n'
+
+        def sample(logfile, **kwargs):
+            return list(log_format.sample_lines(logfile, **kwargs))
+
+        # The end of the file overlaps the beginning.
+        self.assertEqual(sample(StringIO.StringIO(data), first=4, last=8),
+                         list(enumerate(lines, 1)))
+        self.assertEqual(sample(StringIO.StringIO(data), first=4, last=2),
+                         list(enumerate(lines[:4], 1)) +
+                         [(-2, 'line 9'), (-1, 'line 10')])
+        self.assertEqual(sample(NonSeekableFile(data), first=1, last=2),
+                         [(1, 'line 1'), (9, 'line 9'), (10, 'line 10')])
+
+        chosen = sample(StringIO.StringIO(data), first=1, last=1,
+                        random_lines=3, seed=0)
+        self.assertEqual(len(chosen), 5)
+        self.assertEqual(chosen, sorted(chosen))
+        self.assertEqual((chosen[0], chosen[-1]),
+                         ((1, 'line 1'), (10, 'line 10')))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+# Copyright 2015 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for validator.log_snapshot."""
+
+# This file conforms to the external style guide.
+# pylint: disable=bad-indentation, g-bad-import-order
+
+import os
+import shutil
+import tempfile
+
+from appstart.sandbox import container
+from appstart.validator import log_snapshot
+
+from fakes import fake_docker
+
+LOGS = {'request.log': 'GET /',
+        'custom_logs/a.log': 'a',
+        'custom_logs/nested/b.log': 'b'}
+
+
+class LogSnapshotTest(fake_docker.FakeDockerTestBase):
+
+    def setUp(self):
+        super(LogSnapshotTest, self).setUp()
+        fake_docker.images.append('app')
+        self.app_container = container.Container(
+            fake_docker.FakeDockerClient())
+        self.app_container.create(name='app', image='app')
+        self.files = fake_docker.containers[0]['Files']
+        for name, contents in LOGS.iteritems():
+            self.files[os.path.join(log_snapshot.LOG_LOCATION, name)] = (
+                contents)
+
+        self.copies = []
+        extract_tar = self.app_container.extract_tar
+
+        def counting_extract_tar(path):
+            self.copies.append(path)
+            return extract_tar(path)
+
+        self.app_container.extract_tar = counting_extract_tar
+
+        self.host_path = tempfile.mkdtemp()
+        for name, contents in LOGS.iteritems():
+            path = os.path.join(self.host_path, name)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'w') as f:
+                f.write(contents)
+
+    def tearDown(self):
+        super(LogSnapshotTest, self).tearDown()
+        shutil.rmtree(self.host_path)
+
+    def _check_snapshot(self, snapshot):
+        root = log_snapshot.LOG_LOCATION
+        self.assertTrue(snapshot.exists(root + '/request.log'))
+        self.assertFalse(snapshot.exists(root + '/app.log.json'))
+        self.assertEqual(snapshot.open(root + '/request.log').read(), 'GET /')
+        self.assertEqual(snapshot.list(root + '/custom_logs'),
+                         (['a.log'], ['nested']))
+        with self.assertRaises(IOError):
+            snapshot.open(root + '/app.log.json')
+        with self.assertRaises(ValueError):
+            snapshot.open(root + '/custom_logs')
+        with self.assertRaises(ValueError):
+            snapshot.exists('/etc/passwd')
+
+    def test_snapshot_from_container(self):
+        snapshot = log_snapshot.LogSnapshot(self.app_container)
+        self._check_snapshot(snapshot)
+        self.assertEqual(self.copies, [log_snapshot.LOG_LOCATION])
+
+    def test_snapshot_from_host(self):
+        snapshot = log_snapshot.LogSnapshot(self.app_container,
+                                            self.host_path)
+        self._check_snapshot(snapshot)
+        self.assertEqual(self.copies, [])
+
+    def test_missing_log_directory(self):
+        self.files.clear()
+        snapshot = log_snapshot.LogSnapshot(self.app_container)
+        self.assertFalse(snapshot.exists(log_snapshot.LOG_LOCATION))
+        with self.assertRaises(IOError):
+            snapshot.list(log_snapshot.LOG_LOCATION)
+
+    def test_cache_invalidation(self):
+        cache = log_snapshot.SnapshotCache()
+        cache.invalidate(1)
+        snapshot = cache.get(self.app_container)
+        self.assertIs(cache.get(self.app_container), snapshot)
+
+        # Snapshots are kept within a lifecycle point.
+        cache.invalidate(1)
+        self.assertIs(cache.get(self.app_container), snapshot)
+
+        cache.invalidate(2)
+        self.assertIsNot(cache.get(self.app_container), snapshot)
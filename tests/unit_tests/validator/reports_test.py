@@ -0,0 +1,116 @@
+# Copyright 2015 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for validator.reports."""
+
+# This file conforms to the external style guide.
+# pylint: disable=bad-indentation, g-bad-import-order
+
+import StringIO
+import json
+import unittest
+from xml.etree import ElementTree
+
+from appstart.validator import reports
+
+
+def _record(name, point, outcome, message=None):
+    return {'name': name,
+            'title': name,
+            'lifecycle_point': point,
+            'outcome': outcome,
+            'error_level': 'WARNING',
+            'start_time': 100.0,
+            'end_time': 100.5,
+            'duration': 0.5,
+            'message': message,
+            'dependencies': []}
+
+
+class ReportsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.stream = StringIO.StringIO()
+        self.records = [
+            _record('A', 'Pre Start', reports.PASSED),
+            _record('B', 'Post Start', reports.FAILED, 'bad <thing>\nmore'),
+            _record('C', 'Post Start', reports.SKIPPED, '"B" did not pass'),
+            _record('D', 'Post Start', reports.ERROR, 'Traceback'),
+            _record('E', 'Load', reports.PASSED)]
+        self.records[-1]['metrics'] = {'p50': 0.25, 'requests': 10}
+        self.records[-1]['hook_usage'] = {'attempts': 1, 'max_rss': None}
+
+    def test_dependency_chain(self):
+
+        class Clause(object):
+            dependencies = set()
+
+        def make(name, *dependencies):
+            return type(name, (Clause,), {'dependencies': set(dependencies)})
+
+        c = make('C')
+        b = make('B', c)
+        a = make('A', c)
+        top = make('Top', b, a)
+        self.assertEqual(reports.dependency_chain(top), ['A', 'B', 'C'])
+        self.assertEqual(reports.dependency_chain(c), [])
+
+    def test_json_report(self):
+        writer = reports.JsonReportWriter(self.stream)
+        writer.start([])
+
+        # Records are written as soon as they're added.
+        writer.add_result(self.records[0])
+        self.assertEqual(json.loads(self.stream.getvalue().splitlines()[-1]),
+                         dict(self.records[0], type='clause'))
+
+        for record in self.records[1:]:
+            writer.add_result(record)
+        writer.finish(False)
+        lines = [json.loads(l) for l in self.stream.getvalue().splitlines()]
+        self.assertEqual(len(lines), 7)
+        self.assertEqual(lines[0]['execution_plan'], [])
+        self.assertEqual(lines[-1]['type'], 'summary')
+        self.assertFalse(lines[-1]['success'])
+
+    def test_junit_report(self):
+        writer = reports.JUnitReportWriter(self.stream)
+        writer.start([])
+        for record in self.records:
+            writer.add_result(record)
+        writer.finish(False)
+
+        root = ElementTree.fromstring(self.stream.getvalue())
+        suites = root.findall('testsuite')
+        self.assertEqual([s.get('name') for s in suites],
+                         ['Pre Start', 'Post Start', 'Load'])
+        cases = suites[1].findall('testcase')
+        self.assertEqual([c.get('name') for c in cases], ['B', 'C', 'D'])
+        self.assertEqual(cases[0].get('time'), '0.500')
+
+        failure = cases[0].find('failure')
+        self.assertEqual(failure.get('message'), 'bad <thing>')
+        self.assertEqual(failure.get('type'), 'WARNING')
+        self.assertEqual(failure.text, 'bad <thing>\nmore')
+        self.assertIsNotNone(cases[1].find('skipped'))
+        self.assertIsNotNone(cases[2].find('error'))
+        self.assertEqual(list(suites[0].find('testcase')), [])
+        properties = suites[2].findall('testcase/properties/property')
+        self.assertEqual([(p.get('name'), p.get('value')) for p in properties],
+                         [('p50', '0.25'), ('requests', '10'),
+                          ('hook_attempts', '1'), ('hook_max_rss', 'None')])
+
+
+if __name__ == '__main__':
+    unittest.main()
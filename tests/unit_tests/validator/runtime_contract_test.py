@@ -0,0 +1,112 @@
+# Copyright 2015 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for appstart.validator.runtime_contract."""
+
+# This file conforms to the external style guide.
+# pylint: disable=bad-indentation, g-bad-import-order
+
+import logging
+import shutil
+import stubout
+import tempfile
+import unittest
+
+from appstart.sandbox import container_sandbox
+from appstart.validator import contract
+from appstart.validator import runtime_contract
+
+
+class HealthCheckSoakTest(unittest.TestCase):
+
+    def setUp(self):
+        logging.getLogger('appstart.validator').disabled = True
+        self.stubs = stubout.StubOutForTesting()
+        self.app_dir = tempfile.mkdtemp()
+
+        # [(basestring, float), ...] The url and duration of each soak.
+        self.soaks = []
+
+        class FakeConfiguration(object):
+            health_checks_enabled = True
+            health_check_options = {'check_interval_sec': 5,
+                                    'timeout_sec': 4,
+                                    'unhealthy_threshold': 2}
+
+        class FakeAppContainer(object):
+            host = 'localhost'
+            configuration = FakeConfiguration()
+
+        class FakeSandbox(object):
+            app_dir = self.app_dir
+            app_container = FakeAppContainer()
+            port = 8081
+
+            def __init__(self, *args, **kwargs):
+                pass
+
+            def start(self):
+                pass
+
+            def stop(self):
+                pass
+
+            def get_host_log_path(self):
+                return None
+
+        class Response(object):
+            status_code = 200
+
+        class ProbeResult(object):
+            max_consecutive_failures = 0
+            flaps = 0
+
+            def get_metrics(self):
+                return {'p50': 0.01, 'p95': 0.02, 'p99': 0.03}
+
+        def run_probes(url, unused_interval, duration, timeout=None):
+            self.soaks.append((url, duration))
+            return ProbeResult()
+
+        self.stubs.Set(container_sandbox, 'ContainerSandbox', FakeSandbox)
+        self.stubs.Set(runtime_contract.requests, 'get',
+                       lambda url: Response())
+        self.stubs.Set(runtime_contract.load, 'run_probes', run_probes)
+
+        class Module(object):
+            enabled = runtime_contract.HealthChecksEnabledClause
+            health = runtime_contract.HealthCheckClause
+            soak = runtime_contract.HealthCheckSoakClause
+
+        self.validator = contract.ContractValidator(Module)
+
+    def tearDown(self):
+        self.stubs.UnsetAll()
+        shutil.rmtree(self.app_dir)
+        logging.getLogger('appstart.validator').disabled = False
+
+    def test_soak_is_opt_in(self):
+        self.assertTrue(self.validator.validate(quiet=True))
+        self.assertEqual(self.soaks, [])
+
+    def test_soak_tag(self):
+        """The soak tag also runs the health checks that the soak needs."""
+        self.assertTrue(self.validator.validate(tags=['soak'], quiet=True,
+                                                soak_duration=300))
+        self.assertEqual(self.soaks, [('http://localhost:8081/_ah/health',
+                                       300)])
+
+
+if __name__ == '__main__':
+    unittest.main()